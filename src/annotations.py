@@ -1,15 +1,45 @@
 import csv
+import io
 import json
 import os
 import multiprocessing
+import re
 import sys
 import time
 import xml.etree.ElementTree as ET
-from kbs import KnowledgeBase
+from collections import deque
+from contextlib import ExitStack, contextmanager
 from functools import partial
+from itertools import islice
+from kbs import KnowledgeBase, frozen_kb_file, get_worker_kb, init_worker_kbs
+from profiling import profiled, span
 
 sys.path.append("./")
 
+# Patterns applied to the raw lines of PBDMS split files, see prefilter_PBDMS_doc and decode_PBDMS_doc
+PBDMS_mesh_id_pattern = re.compile(r'"mesh_id"\s*:\s*"([^"\\]*)"')
+PBDMS_field_patterns = {"_id": re.compile(r'[{,]\s*"_id"\s*:\s*'), "mentions": re.compile(r'[{,]\s*"mentions"\s*:\s*')}
+PBDMS_decoder = json.JSONDecoder()
+worker_pubtator_ids = set() # Concept IDs of the lines selected by the current worker process, see init_pubtator_worker
+
+# Input files of each corpus
+PBDMS_DIR = "./retrieved_data/corpora/pubmed_ds/"
+NCBI_DISEASE_DIR = "./retrieved_data/corpora/NCBI_disease_corpus/"
+NCBI_DISEASE_FILENAMES = ["NCBItrainset_corpus.txt", "NCBIdevelopset_corpus.txt", "NCBItestset_corpus.txt"]
+BC5CDR_DIR = "./retrieved_data/corpora/BioCreative-V-CDR-Corpus/CDR_Data/CDR.Corpus.v010516/"
+BC5CDR_FILENAMES = ["CDR_TrainingSet.PubTator.txt", "CDR_DevelopmentSet.PubTator.txt", "CDR_TestSet.PubTator.txt"]
+CRAFT_DIRS = {"chebi": "./retrieved_data/corpora/CRAFT-4.0.1/concept-annotation/CHEBI/CHEBI/knowtator/",
+                "go_bp": "./retrieved_data/corpora/CRAFT-4.0.1/concept-annotation/GO_BP/GO_BP/knowtator/"}
+MEDMENTIONS_FILEPATH = "./retrieved_data/corpora/MedMentions/corpus_pubtator.txt"
+PGR_FILEPATHS = ["./retrieved_data/corpora/PGR/train.tsv", "./retrieved_data/corpora/PGR/test.tsv"]
+PUBTATOR_RANGE_SIZE = 4 * 1024 * 1024 # Bytes of a PubTator file parsed by each task, see pubtator_ranges
+
+
+def annotations_count(output_dict):
+    """Returns the number of annotations in an output dict with format {file_id: [annotation]}"""
+
+    return sum(len(annotations) for annotations in output_dict.values())
+
 
 def add_annotation_to_output_dict(file_id, annotation, output_dict):
     """Updates output_dict with given annotation"""
@@ -36,11 +66,16 @@ def parse_PBDMS_doc(kb_data, doc_dict):
         output_PBDMS (list): has format [(annotation_str, start_pos, end_pos,  mesh_id, direct_ancestor)]
     """
 
-    doc_dict_up = json.loads(doc_dict)
+    return extract_PBDMS_annotations(kb_data, json.loads(doc_dict))
+
+
+def extract_PBDMS_annotations(kb_data, doc_dict_up):
+    """Extract the MeSH annotations of the KB from a decoded PBDMS document (see parse_PBDMS_doc)"""
+
     doc_id = doc_dict_up["_id"]
+    output_PBDMS = [doc_id] # Documents without valid annotations are discarded by convert_PBDMS_into_dict
     
     if len(doc_dict_up['mentions']) > 0: #current doc will be present in the final dataset   
-        output_PBDMS = [doc_id] 
 
         for mention in doc_dict_up['mentions']:
             mesh_id = mention['mesh_id'] 
@@ -58,31 +93,271 @@ def parse_PBDMS_doc(kb_data, doc_dict):
     return output_PBDMS
 
 
-def structure_PBDMS_annotations(documents, kb_data):
+def prefilter_PBDMS_doc(kbs_data, doc_dict):
+    """Scans the raw line of a PBDMS document for the MeSH IDs of its mentions, without decoding it.
+
+    Args
+        kbs_data (list): instances of FrozenKnowledgeBase
+        doc_dict (str): line of the PBDMS split file
+
+    Returns
+        bool: False if no mention can have a MeSH ID in child_to_parent of any of the KBs, so the document can be skipped
+    """
+
+    mesh_ids = PBDMS_mesh_id_pattern.findall(doc_dict)
+
+    if len(mesh_ids) != doc_dict.count('"mesh_id"'): # Escaped or non-string values are left to the decoder
+        return True
+
+    return any(kb_data.may_have_parent(mesh_id) for mesh_id in mesh_ids for kb_data in kbs_data)
+
+
+def decode_PBDMS_doc(doc_dict):
+    """Decodes only the "_id" and "mentions" fields of the raw line of a PBDMS document, the whole line is decoded 
+    with json.loads if a field does not occur exactly once"""
+
+    doc_dict_up = dict()
+
+    for field, pattern in PBDMS_field_patterns.items():
+        matches = pattern.findall(doc_dict)
+
+        if len(matches) != 1:
+            return json.loads(doc_dict)
+
+        doc_dict_up[field] = PBDMS_decoder.raw_decode(doc_dict, pattern.search(doc_dict).end())[0]
+
+    return doc_dict_up
+
+
+def parse_PBDMS_doc_worker(doc_dict):
+    """Applies parse_PBDMS_doc in a pool worker, using the frozen KB attached by the worker. 
+    Returns None if the document is skipped by prefilter_PBDMS_doc."""
+
+    kb_data = get_worker_kb()
+
+    if not prefilter_PBDMS_doc([kb_data], doc_dict):
+        return None
+
+    return extract_PBDMS_annotations(kb_data, decode_PBDMS_doc(doc_dict))
+
+
+def parse_PBDMS_doc_multi_worker(kbs, doc_dict):
+    """Decodes a PBDMS document once in a pool worker and extracts its annotations for each of the given KBs (list),
+    using the frozen KBs attached by the worker. Returns a list with the output of parse_PBDMS_doc for each KB, or 
+    None if the document is skipped by prefilter_PBDMS_doc."""
+
+    kbs_data = [get_worker_kb(kb) for kb in kbs]
+
+    if not prefilter_PBDMS_doc(kbs_data, doc_dict):
+        return None
+
+    doc_dict_up = decode_PBDMS_doc(doc_dict)
+
+    return [extract_PBDMS_annotations(kb_data, doc_dict_up) for kb_data in kbs_data]
+
+
+def report_PBDMS_throughput(split, docs_count, skipped_count, runtime):
+    """Prints the number of documents of the PBDMS split skipped by the prefilter and the throughput in docs/s"""
+
+    skipped_ratio = (skipped_count / docs_count) * 100 if docs_count > 0 else 0.0
+    print("PBDMS documents ( split", str(split), "):", str(docs_count), "\nSkipped by the prefilter:", 
+            str(skipped_count), "(", str(round(skipped_ratio, 2)), "% )")
+    print("Throughput:", str(round(docs_count / max(runtime, 1e-9), 1)), "docs/s")
+
+
+@contextmanager
+def PBDMS_pool(kb_data, workers=10, pool=None):
+    """Yields the given pool or, if it is None, a new pool whose workers memory-map a frozen version of the KB.
+
+    Args
+        kb_data (KnowledgeBase): instance of the referred class representing a given knowledge base 
+        workers (int): number of worker processes of the new pool
+        pool (multiprocessing.Pool): pool already started with init_worker_kbs for this KB, kept open at exit
+    """
+
+    if pool is not None:
+        yield pool
+        return
+
+    with multi_KB_pool([kb_data], workers=workers) as new_pool:
+        yield new_pool
+
+
+@contextmanager
+def multi_KB_pool(kbs_data, workers=10):
+    """Yields a new pool whose workers memory-map a frozen version of each of the given KBs (list of KnowledgeBase)"""
+
+    with ExitStack() as stack: # Workers memory-map the KBs instead of receiving a copy of them
+        kb_filepaths = [stack.enter_context(frozen_kb_file(kb_data)) for kb_data in kbs_data]
+        
+        with multiprocessing.Pool(processes=workers, initializer=init_worker_kbs, initargs=(kb_filepaths,)) as pool:
+            yield pool
+
+
+def structure_PBDMS_annotations(documents, kb_data, workers=10, pool=None, chunksize=64):
     """Parallel implementation of the function parse_PBDMS_doc
 
     Args
         documents (list): includes documents retrieved from PBDMS file (str) 
         kb_data (KnowledgeBase): instance of the referred class representing a given knowledge base 
+        workers (int): number of worker processes
+        pool (multiprocessing.Pool): warm pool to use instead of starting a new one (see PBDMS_pool)
+        chunksize (int): number of documents sent to a worker at once
 
     Returns
-        doc_annotations (list): each element is a document including the respective valid annotations to output 
+        doc_annotations (list): each element is a document including the respective valid annotations to output,
+            or None if the document was skipped by the prefilter
     """
     
     doc_annotations = list()
-    partial_func = partial(parse_PBDMS_doc, kb_data)
-        
-    with multiprocessing.Pool(processes=10) as pool:
-        doc_annotations = pool.map(partial_func, documents)
+
+    with PBDMS_pool(kb_data, workers=workers, pool=pool) as kb_pool, span("PBDMS.pool", items=len(documents)):
+        doc_annotations = list(imap_bounded(kb_pool, parse_PBDMS_doc_worker, documents, chunksize=chunksize))
     
     return doc_annotations
 
 
+def apply_to_chunk(worker_func, items):
+    """Applies worker_func to each item of a chunk (list) in a pool worker, see imap_bounded"""
+
+    return [worker_func(item) for item in items]
+
+
+def imap_bounded(pool, worker_func, items, max_in_flight=4096, chunksize=64):
+    """Applies worker_func to the items in the pool, yielding the results in order, like pool.imap.
+
+    The items are read lazily and sent to the pool in chunks, each one as a separate task: at most max_in_flight items 
+    (at least one chunk) are read before their results are consumed. Since each caller only keeps a few chunks in the 
+    queue of the pool, several threads sharing a pool (e.g. PBDMS splits built concurrently) get their chunks processed
+    in turn. With pool.imap or pool.map, the single thread of the pool that feeds its queue takes the items of one call
+    after the other, so the calls are processed one at a time.
+
+    Args
+        pool (multiprocessing.Pool): pool whose workers run worker_func
+        worker_func (function): receives an item and returns its result, must be picklable
+        items (iterable): the items to process
+        max_in_flight (int): maximum number of items read and whose results are not yet consumed
+        chunksize (int): number of items sent to a worker at once
+
+    Yields
+        result of worker_func for each item, in the order of items
+    """
+
+    items = iter(items)
+    max_chunks = max(max_in_flight // chunksize, 1)
+    pending_chunks = deque()
+    chunk = list(islice(items, chunksize))
+
+    while len(chunk) > 0 or len(pending_chunks) > 0:
+
+        while len(chunk) > 0 and len(pending_chunks) < max_chunks:
+            pending_chunks.append(pool.apply_async(apply_to_chunk, (worker_func, chunk)))
+            chunk = list(islice(items, chunksize))
+
+        for result in pending_chunks.popleft().get():
+            yield result
+
+
+def iter_PBDMS_results(split, pool, worker_func, max_in_flight=4096, chunksize=64):
+    """Applies worker_func to each document of a PBDMS split file in the pool, reading the lines lazily.
+
+    No more than max_in_flight documents are read before their results are consumed, so memory does not grow with 
+    the size of the split (see imap_bounded).
+
+    Args
+        split (str): the split of PBDMS dataset to parse
+        pool (multiprocessing.Pool): pool whose workers attached the frozen KBs used by worker_func
+        worker_func (function): receives a document (str) and returns its result
+        max_in_flight (int): maximum number of documents read from the split file and not yet consumed
+        chunksize (int): number of documents sent to a worker at once
+
+    Yields
+        result of worker_func for each document, in the order of the split file
+    """
+
+    filepath = PBDMS_DIR + "split_" + split + ".txt"
+
+    with open(filepath, 'r', buffering=1, encoding="utf-8") as input_split:
+
+        for result in imap_bounded(pool, worker_func, input_split, max_in_flight, chunksize):
+            yield result
+
+
+def iter_PBDMS_annotations(kb_data, split, workers=10, max_in_flight=4096, chunksize=64, pool=None):
+    """Streaming implementation of the function structure_PBDMS_annotations over a PBDMS split file (see iter_PBDMS_results).
+
+    Args
+        kb_data (KnowledgeBase): instance of the referred class representing a given knowledge base 
+        split (str): the split of PBDMS dataset to parse
+        workers (int): number of worker processes
+        max_in_flight (int): maximum number of documents read from the split file and not yet consumed
+        chunksize (int): number of documents sent to a worker at once
+        pool (multiprocessing.Pool): warm pool to use instead of starting a new one (see PBDMS_pool)
+
+    Yields
+        doc_id, annotations (tuple): annotations with format [(annotation_str, start_pos, end_pos,  mesh_id, direct_ancestor)]
+            for each document including valid annotations, in the order of the split file
+    """
+
+    docs_count, skipped_count = int(), int()
+    begin_time = time.time()
+
+    with PBDMS_pool(kb_data, workers=workers, pool=pool) as kb_pool, span("PBDMS.stream") as record:
+
+        for doc in iter_PBDMS_results(split, kb_pool, parse_PBDMS_doc_worker, max_in_flight, chunksize):
+            docs_count += 1
+            record["items"] = docs_count
+
+            if doc is None:
+                skipped_count += 1
+
+            elif len(doc) > 1:
+                yield doc[0], [annot for annot in doc if type(annot) != str]
+
+    report_PBDMS_throughput(split, docs_count, skipped_count, time.time() - begin_time)
+
+
+def iter_PBDMS_multi_annotations(kbs_data, split, pool, max_in_flight=4096, chunksize=64):
+    """Parses a PBDMS split file once for several KBs: each document is decoded once and each of its mentions is
+    routed to every KB whose child_to_parent includes its MeSH ID.
+
+    Args
+        kbs_data (list): instances of KnowledgeBase, whose frozen versions are attached by the workers of the pool
+        split (str): the split of PBDMS dataset to parse
+        pool (multiprocessing.Pool): pool started with multi_KB_pool(kbs_data)
+        max_in_flight (int): maximum number of documents read from the split file and not yet consumed
+        chunksize (int): number of documents sent to a worker at once
+
+    Yields
+        kb_annotations (list): for each KB, has format (doc_id, [(annotation_str, start_pos, end_pos,  mesh_id, direct_ancestor)])
+            or None if the document does not include valid annotations for that KB
+    """
+
+    worker_func = partial(parse_PBDMS_doc_multi_worker, [kb_data.kb for kb_data in kbs_data])
+    docs_count, skipped_count = int(), int()
+    begin_time = time.time()
+
+    with span("PBDMS.stream") as record:
+
+        for docs in iter_PBDMS_results(split, pool, worker_func, max_in_flight, chunksize):
+            docs_count += 1
+            record["items"] = docs_count
+
+            if docs is None:
+                skipped_count += 1
+                yield [None for kb_data in kbs_data]
+
+            else:
+                yield [(doc[0], [annot for annot in doc if type(annot) != str]) if len(doc) > 1 else None for doc in docs]
+
+    report_PBDMS_throughput(split, docs_count, skipped_count, time.time() - begin_time)
+
+
 def convert_PBDMS_into_dict(doc_annotations):
     """Convert annotations built from PBDMS dataset into final output dict.
 
     Args
-        doc_annotations (list): has format [(annotation 1), (annotation 2), ...]
+        doc_annotations (list): has format [(annotation 1), (annotation 2), ...], None for skipped documents
 
     Returns
         output_PBDMS (dict): has format {file_id: [(annotation_str, start_pos, end_pos,  mesh_id, direct_ancestor)]}
@@ -92,18 +367,139 @@ def convert_PBDMS_into_dict(doc_annotations):
 
     for doc in doc_annotations:
         
-        if len(doc) > 1:
+        if doc is not None and len(doc) > 1:
             doc_annot = [annot for annot in doc if type(annot) != str]
             output_PBDMS[doc[0]] = doc_annot
     
     return output_PBDMS
 
 
-def parse_NCBI_disease(kb_data):
+def pubtator_ranges(filepath, range_size=PUBTATOR_RANGE_SIZE):
+    """Splits a PubTator file into byte ranges of about range_size bytes that end after the blank line closing a document.
+
+    Returns
+        ranges (list): has format [(start, end)], covering the whole file in order
+    """
+
+    file_size = os.path.getsize(filepath)
+    ranges = list()
+    start = 0
+
+    with open(filepath, 'rb') as corpus_file:
+
+        while start < file_size:
+            end = start + range_size
+
+            if end >= file_size:
+                end = file_size
+
+            else:
+                corpus_file.seek(end - 1)
+                corpus_file.readline() # Rest of the line where the range would end, even if it ends within "\r\n"
+                line = corpus_file.readline()
+
+                while line not in [b"", b"\n", b"\r\n"]:
+                    line = corpus_file.readline()
+
+                end = corpus_file.tell()
+
+            ranges.append((start, end))
+            start = end
+
+    return ranges
+
+
+def init_pubtator_worker(concept_ids):
+    """Initializer of the pool workers of iter_pubtator_lines: keeps the concept IDs used to select lines for all the tasks"""
+
+    global worker_pubtator_ids
+    worker_pubtator_ids = concept_ids
+
+
+def parse_pubtator_range_worker(task):
+    """Applies parse_pubtator_range in a pool worker, with the concept IDs of the worker"""
+
+    return parse_pubtator_range(task, worker_pubtator_ids)
+
+
+def parse_pubtator_range(task, concept_ids):
+    """Splits the lines in a byte range of a PubTator file into fields and keeps the ones that can be annotations.
+
+    Args
+        task (tuple): has format (filepath, start, end, line_type), line_type being "annotation" to consider the lines 
+            with 6 fields or "mention" to consider every line that is not a title, an abstract or a blank line (as MedMentions)
+        concept_ids (set): only the lines whose last field, without "\n", is in this set are kept
+
+    Returns
+        lines_data (list): has format [line.split("\t")], fields are kept as they are in the file (including "\n")
+    """
+
+    filepath, start, end, line_type = task
+
+    with open(filepath, 'rb') as corpus_file:
+        corpus_file.seek(start)
+        data = corpus_file.read(end - start)
+
+    lines_data = list()
+
+    for line in io.TextIOWrapper(io.BytesIO(data), encoding="utf-8"): # Same newline handling as open(filepath, 'r')
+        line_data = line.split("\t")
+
+        if line_type == "annotation":
+
+            if len(line_data) == 6 and line_data[5].strip("\n") in concept_ids:
+                lines_data.append(line_data)
+
+        elif "|t|" not in line and "|a|" not in line and line != "\n" and line_data[5].strip("\n") in concept_ids:
+            lines_data.append(line_data)
+
+    return lines_data
+
+
+def iter_pubtator_lines(filepaths, line_type, concept_ids, workers=10):
+    """Yields the fields of the selected lines of PubTator files, in the order of the files.
+
+    Each file is split into document-aligned byte ranges (see pubtator_ranges) that are parsed in parallel by a pool of 
+    processes, each line being split once. Only the lines with one of the given concept IDs are sent back by the workers, 
+    the caller still checks them against the KB. Files that fit in a single range are parsed in the current process.
+
+    Args
+        filepaths (list): paths of the PubTator files
+        line_type (str): "annotation" or "mention", see parse_pubtator_range
+        concept_ids (set): IDs (last field of the line, without "\n") of the lines to yield
+        workers (int): number of worker processes
+
+    Yields
+        line_data (list): fields of a line, line.split("\t")
+    """
+
+    tasks = [(filepath, start, end, line_type) for filepath in filepaths for start, end in pubtator_ranges(filepath)]
+
+    if len(tasks) <= 1 or workers <= 1:
+        
+        for task in tasks:
+            
+            for line_data in parse_pubtator_range(task, concept_ids):
+                yield line_data
+
+        return
+
+    with multiprocessing.Pool(processes=min(workers, len(tasks)), initializer=init_pubtator_worker, 
+                                initargs=(concept_ids,)) as pool:
+
+        for lines_data in pool.imap(parse_pubtator_range_worker, tasks):
+
+            for line_data in lines_data:
+                yield line_data
+
+
+@profiled("corpus.NCBI_disease", count_items=annotations_count)
+def parse_NCBI_disease(kb_data, workers=10):
     """Parse MeSH annotations in NCBI Disease corpus.
         
     Args
         kb_data (KnowledgeBase): instance of the referred class representing a given knowledge base 
+        workers (int): number of processes reading the corpus files, see iter_pubtator_lines
         
     Returns
         output_NCBI_Disease (dict): has format {file_id: [(annotation_str, start_pos, end_pos,  mesh_id, direct_ancestor)]}
@@ -111,38 +507,30 @@ def parse_NCBI_disease(kb_data):
 
     print("Parsing NCBI Disease corpus...")
     output_NCBI_disease = dict()
-    corpus_dir = "./retrieved_data/corpora/NCBI_disease_corpus/"
-    filenames = ["NCBItrainset_corpus.txt", "NCBIdevelopset_corpus.txt", "NCBItestset_corpus.txt"]
-
-    for filename in filenames:
-            
-        with open(corpus_dir + filename, 'r', encoding="utf-8") as corpus_file:
-            data = corpus_file.readlines()
-            corpus_file.close()
-                
-            for line in data:
-                line_data = line.split("\t")
-                file_id = line_data[0]
-                    
-                if len(line_data) == 6:
-                    mesh_id = line_data[5].strip("\n")
-            
-                    if mesh_id in kb_data.child_to_parent.keys():  
-                        direct_ancestor =  kb_data.child_to_parent[mesh_id].strip("MESH:")
-                        update_mesh_id = line_data[5].strip("MESH:").strip("\n")
-                        annotation = (line_data[3], line_data[1], line_data[2], update_mesh_id, direct_ancestor)
-                        output_NCBI_disease = add_annotation_to_output_dict(file_id, annotation, 
-                                                                                            output_NCBI_disease)
+    filepaths = [NCBI_DISEASE_DIR + filename for filename in NCBI_DISEASE_FILENAMES]
+    mesh_ids = set(kb_data.child_to_parent.keys())
+
+    for line_data in iter_pubtator_lines(filepaths, "annotation", mesh_ids, workers=workers):
+        file_id = line_data[0]
+        mesh_id = line_data[5].strip("\n")
+
+        if mesh_id in kb_data.child_to_parent.keys():  
+            direct_ancestor =  kb_data.child_to_parent[mesh_id].strip("MESH:")
+            update_mesh_id = line_data[5].strip("MESH:").strip("\n")
+            annotation = (line_data[3], line_data[1], line_data[2], update_mesh_id, direct_ancestor)
+            output_NCBI_disease = add_annotation_to_output_dict(file_id, annotation, output_NCBI_disease)
        
     print("...Done!")
     return output_NCBI_disease
 
     
-def parse_BC5CDR(kb_data):
+@profiled("corpus.BC5CDR", count_items=annotations_count)
+def parse_BC5CDR(kb_data, workers=10):
     """Parse MeSH annotations in BC5CDR corpus.
         
     Args
         kb_data (KnowledgeBase): instance of the referred class representing a given knowledge base  
+        workers (int): number of processes reading the corpus files, see iter_pubtator_lines
         
     Returns
         output_BC5CDR (dict): has format {file_id: [(annotation_str, start_pos, end_pos,  mesh_id, direct_ancestor)]}
@@ -157,84 +545,107 @@ def parse_BC5CDR(kb_data):
     elif kb_data.kb == "ctd_chemicals":
         entity_type = "Chemical"
 
-    corpus_dir = "./retrieved_data/corpora/BioCreative-V-CDR-Corpus/CDR_Data/CDR.Corpus.v010516/"  
-    filenames = ["CDR_TrainingSet.PubTator.txt", "CDR_DevelopmentSet.PubTator.txt", "CDR_TestSet.PubTator.txt"]
+    filepaths = [BC5CDR_DIR + filename for filename in BC5CDR_FILENAMES]
+    mesh_ids = {mesh_id[5:] for mesh_id in kb_data.child_to_parent.keys() if mesh_id.startswith("MESH:")}
 
-    for filename in filenames:
-        with open(corpus_dir + filename, 'r', encoding="utf-8") as corpus_file:
-            data = corpus_file.readlines()
-            corpus_file.close()
-
-            for line in data:
-                line_data = line.split("\t")
-                file_id = line_data[0]
-                    
-                if len(line_data) == 6 and line_data[4] == entity_type:
-                    mesh_id = "MESH:" + line_data[5].strip("\n")  
-                        
-                    if mesh_id in kb_data.child_to_parent.keys():
-                        direct_ancestor = "https://id.nlm.nih.gov/mesh/" \
-                                                + kb_data.child_to_parent[mesh_id].strip("MESH:")
-                        update_mesh_id = "https://id.nlm.nih.gov/mesh/" + line_data[5].strip("MESH:").strip("\n")
-                        annotation = (line_data[3], line_data[1], line_data[2], update_mesh_id, direct_ancestor)
-                        output_BC5CDR = add_annotation_to_output_dict(file_id, annotation, output_BC5CDR)
+    for line_data in iter_pubtator_lines(filepaths, "annotation", mesh_ids, workers=workers):
+        file_id = line_data[0]
+            
+        if line_data[4] == entity_type:
+            mesh_id = "MESH:" + line_data[5].strip("\n")  
+                
+            if mesh_id in kb_data.child_to_parent.keys():
+                direct_ancestor = "https://id.nlm.nih.gov/mesh/" \
+                                        + kb_data.child_to_parent[mesh_id].strip("MESH:")
+                update_mesh_id = "https://id.nlm.nih.gov/mesh/" + line_data[5].strip("MESH:").strip("\n")
+                annotation = (line_data[3], line_data[1], line_data[2], update_mesh_id, direct_ancestor)
+                output_BC5CDR = add_annotation_to_output_dict(file_id, annotation, output_BC5CDR)
 
     print("...Done!")
     return output_BC5CDR
 
    
-def parse_CRAFT(kb_data):
+def parse_CRAFT_doc(filepath):
+    """Parse the mentions in a CRAFT knowtator file incrementally, clearing each element once it is processed.
+
+    Args
+        filepath (str): path to the .txt.knowtator.xml file
+
+    Returns
+        mentions (list): has format [(annotation_str, start_pos, end_pos, kb_id)], in the order of the classMention elements
+    """
+
+    annotations = dict()
+    class_mentions = list()
+
+    for event, element in ET.iterparse(filepath, events=("end",)):
+
+        if element.tag == "annotation":
+            annotation_id = element.find('mention').attrib['id']
+            annotation_text = element.find('spannedText').text
+            start_pos, end_pos = element.find('span').attrib['start'], element.find('span').attrib['end']
+            annotations[annotation_id] = [annotation_text, start_pos, end_pos]
+            element.clear()
+
+        elif element.tag == "classMention":
+            class_mentions.append((element.attrib['id'], element.find('mentionClass').attrib['id']))
+            element.clear()
+
+    mentions = list()
+
+    for classMention_id, kb_id in class_mentions: # Resolved at the end, as every annotation was seen by ET.parse
+        annotation_values = annotations[classMention_id]
+        mentions.append((annotation_values[0], annotation_values[1], annotation_values[2], kb_id))
+
+    return mentions
+
+
+@profiled("corpus.CRAFT", count_items=annotations_count)
+def parse_CRAFT(kb_data, workers=10):
     """Parse annotations ChEBI or GO annotations in CRAFT corpus. 
 
+    The knowtator files are parsed by a pool of processes (see parse_CRAFT_doc) and the KB is only used to filter 
+    their mentions, so the workers do not need a copy of it. Results are merged in the order of the files.
+
     Args
         kb_data (KnowledgeBase): instance of the referred class representing a given knowledge base 
+        workers (int): number of worker processes
         
     Returns
         output_CRAFT (dict): has format {file_id: [(annotation_str, start_pos, end_pos, kb_id, direct_ancestor)]}
     """
 
     print("Parsing CRAFT corpus...")
-    corpus_dir = str()
-        
-    if kb_data.kb == "chebi":
-        corpus_dir = "./retrieved_data/corpora/CRAFT-4.0.1/concept-annotation/CHEBI/CHEBI/knowtator/"
-        
-    elif kb_data.kb == "go_bp":
-        corpus_dir = "./retrieved_data/corpora/CRAFT-4.0.1/concept-annotation/GO_BP/GO_BP/knowtator/"
+    corpus_dir = CRAFT_DIRS[kb_data.kb] # chebi or go_bp
+    documents = os.listdir(corpus_dir) # Same order as the original build, that sets the published train/dev/test split
 
     output_CRAFT = dict()
+
+    with multiprocessing.Pool(processes=max(min(workers, len(documents)), 1)) as pool:
+        doc_mentions = pool.imap(parse_CRAFT_doc, [corpus_dir + document for document in documents])
         
-    for document in os.listdir(corpus_dir): 
-        root = ET.parse(corpus_dir + document)
-        file_id = document.strip('.txt.knowtator.xml')
-        annotations = dict()
-
-        for annotation in root.iter("annotation"):
-            annotation_id = annotation.find('mention').attrib['id']
-            annotation_text = annotation.find('spannedText').text
-            start_pos, end_pos = annotation.find('span').attrib['start'], annotation.find('span').attrib['end']
-            annotations[annotation_id] = [annotation_text, start_pos, end_pos] 
-                
-        for classMention in root.iter("classMention"):
-            classMention_id = classMention.attrib['id']
-            annotation_values = annotations[classMention_id]
-            kb_id = classMention.find('mentionClass').attrib['id']
+        for document, mentions in zip(documents, doc_mentions): 
+            file_id = document.strip('.txt.knowtator.xml')
+
+            for mention in mentions:
+                kb_id = mention[3]
                     
-            if kb_id in kb_data.child_to_parent.keys(): # Consider only KB concepts with ONE direct ancestor
-                direct_ancestor = kb_data.child_to_parent[kb_id]
-                annotation = (annotation_values[0], annotation_values[1], 
-                                annotation_values[2], kb_id, direct_ancestor) 
-                output_CRAFT = add_annotation_to_output_dict(file_id, annotation, output_CRAFT)
+                if kb_id in kb_data.child_to_parent.keys(): # Consider only KB concepts with ONE direct ancestor
+                    direct_ancestor = kb_data.child_to_parent[kb_id]
+                    annotation = (mention[0], mention[1], mention[2], kb_id, direct_ancestor) 
+                    output_CRAFT = add_annotation_to_output_dict(file_id, annotation, output_CRAFT)
                     
     print("...Done!")
     return output_CRAFT
 
    
-def parse_MedMentions(kb_data):
+@profiled("corpus.MedMentions", count_items=annotations_count)
+def parse_MedMentions(kb_data, workers=10):
     """Parse UMLS annotations from MedMentions corpus and convert them to HPO annotations.
         
     Args
         kb_data (KnowledgeBase): instance of the referred class representing a given knowledge base 
+        workers (int): number of processes reading the corpus file, see iter_pubtator_lines
 
     Returns
         output_MedMentions (dict): has format {file_id: [(annotation_str, start_pos, end_pos, hp_id, direct_ancestor)]}
@@ -242,31 +653,27 @@ def parse_MedMentions(kb_data):
     
     print("Parsing MedMentions corpus...")
     output_MedMentions = dict()
-    filepath = "./retrieved_data/corpora/MedMentions/corpus_pubtator.txt"
-    
-    with open(filepath, 'r', buffering=1, encoding="utf-8") as corpus_file:
-
-            for line in corpus_file:
-                if "|t|" not in line and "|a|" not in line and line != "\n":
-                    doc_id = line.split("\t")[0]
-                    annotation_str = line.split("\t")[3]
-                    umls_id =line.split("\t")[5].strip("\n")
-                    start_pos, end_pos = line.split("\t")[1], line.split("\t")[2]
-                        
-                    if umls_id in kb_data.umls_to_hp.keys(): # UMLS concept has an equivalent HPO concept
-                        hp_id = kb_data.umls_to_hp[umls_id]
-
-                        if hp_id in kb_data.child_to_parent.keys(): # Consider only HPO concepts with ONE direct ancestor
-                            direct_ancestor = kb_data.child_to_parent[hp_id].strip("\n")
-                            annotation = (annotation_str, start_pos, end_pos, hp_id, direct_ancestor)
-                            output_MedMentions = add_annotation_to_output_dict(doc_id, annotation, output_MedMentions)
-    
-    corpus_file.close()
+    umls_ids = {umls_id for umls_id, hp_id in kb_data.umls_to_hp.items() if hp_id in kb_data.child_to_parent.keys()}
+
+    for line_data in iter_pubtator_lines([MEDMENTIONS_FILEPATH], "mention", umls_ids, workers=workers):
+        doc_id = line_data[0]
+        annotation_str = line_data[3]
+        umls_id = line_data[5].strip("\n")
+        start_pos, end_pos = line_data[1], line_data[2]
+            
+        if umls_id in kb_data.umls_to_hp.keys(): # UMLS concept has an equivalent HPO concept
+            hp_id = kb_data.umls_to_hp[umls_id]
+
+            if hp_id in kb_data.child_to_parent.keys(): # Consider only HPO concepts with ONE direct ancestor
+                direct_ancestor = kb_data.child_to_parent[hp_id].strip("\n")
+                annotation = (annotation_str, start_pos, end_pos, hp_id, direct_ancestor)
+                output_MedMentions = add_annotation_to_output_dict(doc_id, annotation, output_MedMentions)
 
     print("...Done!")
     return output_MedMentions
 
     
+@profiled("corpus.PGR", count_items=annotations_count)
 def parse_PGR(kb_data):
     """Parse HPO annotaitons in PGR corpus.
 
@@ -279,7 +686,7 @@ def parse_PGR(kb_data):
 
     print("Parsing  corpus...")
     output_PGR = dict()
-    filepaths = ["./retrieved_data/corpora/PGR/train.tsv", "./retrieved_data/corpora/PGR/test.tsv"]
+    filepaths = PGR_FILEPATHS
 
     for filepath in filepaths:
             
@@ -305,19 +712,103 @@ def parse_PGR(kb_data):
     return output_PGR
 
 
-def parse_annotations(kb, split):
-    """Wrapper function to build the output dict specified by arg 'kb' (str)"""
+def corpus_filepaths(kb, split):
+    """Returns the paths of the corpus files parsed by parse_annotations for given kb (str) and split (str)"""
+
+    filepaths = list()
+
+    if kb in ["medic", "ctd_anatomy", "ctd_chemicals"]:
+        filepaths.append(PBDMS_DIR + "split_" + split + ".txt")
+
+        if split == "1" and kb == "medic":
+            filepaths.extend(NCBI_DISEASE_DIR + filename for filename in NCBI_DISEASE_FILENAMES)
+
+        if split == "1" and kb in ["medic", "ctd_chemicals"]:
+            filepaths.extend(BC5CDR_DIR + filename for filename in BC5CDR_FILENAMES)
+
+    elif kb == "hp":
+        filepaths.append(MEDMENTIONS_FILEPATH)
+        filepaths.extend(PGR_FILEPATHS)
+
+    elif kb in CRAFT_DIRS.keys():
+        filepaths.extend(CRAFT_DIRS[kb] + document for document in sorted(os.listdir(CRAFT_DIRS[kb])))
+
+    return filepaths
+
+
+def load_kb(kb):
+    """Returns an instance of KnowledgeBase with the dicts of given kb (str) loaded"""
+
+    kb_data = KnowledgeBase(kb)
+
+    if kb in ["ctd_chemicals", "ctd_anatomy"]:
+        kb_data.load_tsv(kb_data.kb)
+
+    else:
+        kb_data.load_obo(kb_data.kb)
+
+    return kb_data
+
+
+def iter_extra_annotations(kb_data, split, workers=10):
+    """Yields the (doc_id, annotations) of the corpora other than PBDMS that are included in given split of a partition:
+    split 1 also contains documents from NCBI disease (medic) and BC5CDR (medic and ctd_chemicals) corpora"""
+
+    if split == "1":
+
+        if kb_data.kb == "medic":
+            
+            for doc_id, annotations in parse_NCBI_disease(kb_data, workers=workers).items():
+                yield doc_id, annotations
+
+        if kb_data.kb == "medic" or kb_data.kb == "ctd_chemicals":
+
+            for doc_id, annotations in parse_BC5CDR(kb_data, workers=workers).items():
+                yield doc_id, annotations
+
+
+def stream_annotations(kb, split, workers=10, max_in_flight=4096, kb_data=None, pool=None):
+    """Streaming version of parse_annotations for the partitions including PBDMS documents (medic, ctd_anatomy and
+    ctd_chemicals).
+
+    Yields
+        doc_id, annotations (tuple): in the same order as the keys of the dict returned by parse_annotations; a doc_id 
+            may be yielded more than once, in which case the last annotations replace the previous ones
+    """
+
+    if kb_data is None:
+        kb_data = load_kb(kb)
+
+    print("Parsing PBDMS ( split", str(split), ") in streaming mode...")
+    begin_time_split = time.time()
+
+    for doc_id, annotations in iter_PBDMS_annotations(kb_data, split, workers=workers, max_in_flight=max_in_flight, 
+                                                        pool=pool):
+        yield doc_id, annotations
+
+    for doc_id, annotations in iter_extra_annotations(kb_data, split, workers=workers):
+        yield doc_id, annotations
+
+    total_time = time.time() - begin_time_split
+    print("...Done!\nRuntime for split", str(split), ":", str(round(total_time, 3)), "s")
+
+
+def parse_annotations(kb, split, workers=10, kb_data=None, pool=None):
+    """Wrapper function to build the output dict specified by arg 'kb' (str), 'workers' (int) sets the size of the 
+    pool that parses PBDMS documents (or CRAFT and PubTator files). An already loaded 'kb_data' (KnowledgeBase) and a warm 'pool' 
+    (see PBDMS_pool) can be given to reuse them across PBDMS splits"""
 
     obo_list = ["hp", "chebi", "medic", "go_bp"] 
     tsv_list = ["ctd_chemicals", "ctd_anatomy"]
-    kb_data = KnowledgeBase(kb)
     out_dict = dict()
 
+    if kb_data is None:
+        kb_data = load_kb(kb)
+
     if kb in obo_list:
-        kb_data.load_obo(kb_data.kb)        
 
         if kb == "hp":
-            output_MedMentions= parse_MedMentions(kb_data)
+            output_MedMentions= parse_MedMentions(kb_data, workers=workers)
             output_PGR = parse_PGR(kb_data)
             out_dict = {**output_PGR, **output_MedMentions} # Merge two dicts
             
@@ -326,18 +817,21 @@ def parse_annotations(kb, split):
             print("Parsing PBDMS ( split", str(split), ")...")
             begin_time_split = time.time()
             
-            with open("./retrieved_data/corpora/pubmed_ds/split_" + split + ".txt", 'r', buffering=1, encoding="utf-8") as input_split:
+            with open(PBDMS_DIR + "split_" + split + ".txt", 'r', buffering=1, encoding="utf-8") as input_split:
                 documents = [doc for doc in input_split]
                 input_split.close()
             
-            doc_annotations = structure_PBDMS_annotations(documents, kb_data)
+            begin_time_PBDMS = time.time()
+            doc_annotations = structure_PBDMS_annotations(documents, kb_data, workers=workers, pool=pool)
+            report_PBDMS_throughput(split, len(doc_annotations), doc_annotations.count(None), 
+                                        time.time() - begin_time_PBDMS)
             
             output_PBDMS = convert_PBDMS_into_dict(doc_annotations)
             
 
             if split == "1": #Split 1 contains documents from PBDMS, NCBI disease, and BC5CDR corpora
-                output_NCBI_disease = parse_NCBI_disease(kb_data)
-                output_BC5CDR = parse_BC5CDR(kb_data)
+                output_NCBI_disease = parse_NCBI_disease(kb_data, workers=workers)
+                output_BC5CDR = parse_BC5CDR(kb_data, workers=workers)
                 out_dict = {**output_PBDMS, **output_NCBI_disease, **output_BC5CDR}
                    
             else:
@@ -347,26 +841,27 @@ def parse_annotations(kb, split):
             print("...Done!\nRuntime for split", str(split), ":", str(round(total_time, 3)), "s")
 
         elif kb == "chebi":
-            out_dict = parse_CRAFT(kb_data)
+            out_dict = parse_CRAFT(kb_data, workers=workers)
             
         elif kb == "go_bp":
-            out_dict = parse_CRAFT(kb_data)
+            out_dict = parse_CRAFT(kb_data, workers=workers)
 
     elif kb in tsv_list:    
-        kb_data.load_tsv(kb_data.kb)
         documents = list()
         print("Parsing PBDMS ( split", str(split), ")...")
         begin_time_split = time.time()
 
-        with open("./retrieved_data/corpora/pubmed_ds/split_" + split + ".txt", 'r', buffering=1, encoding="utf-8") as input_split:
+        with open(PBDMS_DIR + "split_" + split + ".txt", 'r', buffering=1, encoding="utf-8") as input_split:
             documents = [doc for doc in input_split]
             input_split.close()
         
-        doc_annotations = structure_PBDMS_annotations(documents, kb_data)
+        begin_time_PBDMS = time.time()
+        doc_annotations = structure_PBDMS_annotations(documents, kb_data, workers=workers, pool=pool)
+        report_PBDMS_throughput(split, len(doc_annotations), doc_annotations.count(None), time.time() - begin_time_PBDMS)
         output_PBDMS = convert_PBDMS_into_dict(doc_annotations)
 
         if kb == "ctd_chemicals" and split == "1":  
-            output_BC5CDR = parse_BC5CDR(kb_data)
+            output_BC5CDR = parse_BC5CDR(kb_data, workers=workers)
             out_dict = {**output_PBDMS, **output_BC5CDR}
                        
         else:
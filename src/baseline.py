@@ -1,28 +1,197 @@
-import csv
+import argparse
+import math
 import multiprocessing
+import os
+import random
 import sys
+import tempfile
 import time
-from functools import partial
+from candidates import CandidateIndex, ChoiceTable, TokenBlockingIndex, attach_candidate_index, freeze_candidate_index, \
+                        normalize_mention
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from evaluation import Evaluator
+from functools import lru_cache
 from fuzzywuzzy import fuzz, process
-from kbs import KnowledgeBase
-from utils import retrieve_annotations
+from kbs import KnowledgeBase, attach_frozen_kb, detach_frozen_kb, frozen_kb_file
+from profiling import enable_profiling, profiled, span, write_profile
+from utils import iter_annotations
 
 sys.path.append("./")
 
+worker_partition = dict() # Frozen KB and candidate index of the partition scored by the current worker process
 
-def find_best_candidate(kb_data, annotation):
+
+def rank_candidates(kb_data, text, candidate_index=None):
+    """Retrieve the 2 KB names most similar to given text (Fuzzy Wuzzy token sort ratio).
+
+    Args
+        kb_data (KnowledgeBase): instance of the referred class representing a given knowledge base
+        text (str): the annotation text
+        candidate_index (ChoiceTable or CandidateIndex): with a CandidateIndex, only the names shortlisted by the index 
+            are scored ("fast" mode), otherwise every name in the KB is scored ("exact" mode), using the precomputed
+            names of the ChoiceTable if given
+
+    Returns
+        top_candidates (list): has format [(KB name, score)]
+    """
+
+    if isinstance(candidate_index, ChoiceTable):
+        return candidate_index.top_candidates(text)
+
+    choices = kb_data.name_to_id.keys()
+
+    if candidate_index is not None:
+        shortlist = candidate_index.shortlist(text)
+
+        if len(shortlist) >= 2: # Fall back to the full scan if the index retrieves less than 2 names
+            choices = shortlist
+
+    return process.extract(text, choices, scorer=fuzz.token_sort_ratio, limit=2)
+
+
+def find_best_candidate(kb_data, annotation, candidate_index=None):
     """Find best candidate in KB for given annotation based on string similarity (Fuzzy Wuzzy token sort ratio).
 
     Args
         kb_data (KnowledgeBase): instance of the referred class representing a given knowledge base
         annotation (tuple): has format (annotation text, gold label ID, direct ancestor ID, doc)
+        candidate_index (ChoiceTable or CandidateIndex): see rank_candidates, None to score every KB name with 
+            process.extract
     
     Returns
         tuple with format ((annotation), top_candidate_id)
     """
     
-    top_candidates = process.extract(annotation[0], \
-                            kb_data.name_to_id.keys(), scorer=fuzz.token_sort_ratio, limit=2)
+    top_candidates = rank_candidates(kb_data, annotation[0], candidate_index)
+    
+    return (annotation, select_top_candidate(kb_data, annotation, top_candidates))
+
+
+def find_best_candidate_blocked(blocking_index, annotation):
+    """Find best candidate among the KB names and synonyms for given annotation, using a token blocking index.
+
+    A name or synonym whose normalized form is the normalized annotation text is taken directly ("exact" path). 
+    Otherwise, only the entries sharing a token with the annotation are scored with Fuzzy Wuzzy token sort ratio 
+    ("blocked" path), or every entry if none shares a token ("full" path). As in select_top_candidate, the gold label 
+    of the annotation is never the answer.
+
+    Args
+        blocking_index (TokenBlockingIndex): index over the names and synonyms of the KB
+        annotation (tuple): has format (annotation text, gold label ID, direct ancestor ID, doc)
+
+    Returns
+        tuple with format ((annotation), top_candidate_id, path), path being "exact", "blocked" or "full"
+    """
+
+    normalized_text = normalize_mention(annotation[0])
+
+    for entry_index in blocking_index.exact_matches(normalized_text):
+        concept_id = blocking_index.entries[entry_index][1]
+
+        if concept_id != annotation[1]: #It is assumed the true disambiguation concept does not exist in KB
+            return (annotation, concept_id, "exact")
+
+    top_candidate_id = score_entries(blocking_index, annotation, blocking_index.block(normalized_text))
+
+    if top_candidate_id is not None:
+        return (annotation, top_candidate_id, "blocked")
+
+    return (annotation, score_entries(blocking_index, annotation, range(len(blocking_index.entries))), "full")
+
+
+def score_entries(blocking_index, annotation, entry_indexes):
+    """Returns the concept ID of the entry with the highest token sort ratio with the annotation text among the given 
+    entries of the blocking index (the first one in case of a tie), ignoring the entries of the gold label. 
+    Returns None if there is no entry to score."""
+
+    choices = dict()
+
+    for entry_index in entry_indexes:
+        text, concept_id = blocking_index.entries[entry_index] # Read once, entries of a frozen index are decoded
+
+        if concept_id != annotation[1]:
+            choices[entry_index] = text
+
+    if len(choices) == 0:
+        return None
+
+    top_choice = max(process.extractWithoutOrder(annotation[0], choices, scorer=fuzz.token_sort_ratio), 
+                        key=lambda choice: choice[1])
+
+    return blocking_index.entries[top_choice[2]][1]
+
+
+def report_resolution_paths(valid_annotations, unique_answers):
+    """Prints the fraction of annotations resolved by each path of find_best_candidate_blocked.
+
+    Args
+        valid_annotations (list): has format [(annotation text, gold label ID, direct ancestor ID, doc)]
+        unique_answers (list): has format [((first annotation with the key), top_candidate_id, path)]
+    """
+
+    key_to_path = {(normalize_mention(answer[0][0]), answer[0][1]): answer[2] for answer in unique_answers}
+    path_counts = {"exact": 0, "blocked": 0, "full": 0}
+
+    for annotation in valid_annotations:
+        path_counts[key_to_path[(normalize_mention(annotation[0]), annotation[1])]] += 1
+
+    for path, count in path_counts.items():
+        print("Resolved by", path, "path:", str(count), "(", str(round((count/max(len(valid_annotations), 1))*100, 2)), "% )")
+
+
+def attach_partition(kb_filepath, index_filepath):
+    """Attaches the frozen KB and the candidate index of a partition in a pool worker, once per partition.
+
+    Partitions are scored one after the other, so the KB and candidate index of the previous partition are released.
+    The candidate index is memory-mapped like the KB (see freeze_candidate_index).
+
+    Returns
+        kb_data (FrozenKnowledgeBase), 
+        candidate_index (FrozenChoiceTable, FrozenCandidateIndex or FrozenTokenBlockingIndex)
+    """
+
+    if worker_partition.get("kb_filepath") != kb_filepath:
+
+        if "kb_filepath" in worker_partition:
+            detach_frozen_kb(worker_partition["kb_filepath"])
+
+        worker_partition.update({"kb_filepath": kb_filepath, "kb_data": attach_frozen_kb(kb_filepath), 
+                                    "candidate_index": attach_candidate_index(index_filepath)})
+
+    return worker_partition["kb_data"], worker_partition["candidate_index"]
+
+
+def find_best_candidates_worker(task):
+    """Applies find_best_candidate (or find_best_candidate_blocked, given a TokenBlockingIndex) to a chunk of 
+    annotations in a pool worker.
+
+    Args
+        task (tuple): has format (frozen KB filepath, candidate index filepath, [annotation])
+
+    Returns
+        list with format [((annotation), top_candidate_id)], in the order of the chunk
+    """
+
+    kb_data, candidate_index = attach_partition(task[0], task[1])
+
+    if isinstance(candidate_index, TokenBlockingIndex):
+        return [find_best_candidate_blocked(candidate_index, annotation) for annotation in task[2]]
+
+    return [find_best_candidate(kb_data, annotation, candidate_index) for annotation in task[2]]
+
+
+def select_top_candidate(kb_data, annotation, top_candidates):
+    """Select the ID of the top candidate, ignoring the 1st candidate if it is the gold label of the annotation.
+
+    Args
+        kb_data (KnowledgeBase): instance of the referred class representing a given knowledge base
+        annotation (tuple): has format (annotation text, gold label ID, direct ancestor ID, doc)
+        top_candidates (list): has format [(KB name, score)], as returned by rank_candidates
+
+    Returns
+        top_candidate_id (str)
+    """
 
     top_candidate_text_1 = top_candidates[0][0]
     top_candidate_id_1 = kb_data.name_to_id[top_candidate_text_1]
@@ -34,16 +203,110 @@ def find_best_candidate(kb_data, annotation):
     else:
         top_candidate_id = top_candidate_id_1    
     
-    return (annotation, top_candidate_id)
+    return top_candidate_id
+
+
+def memoized_candidate_finder(kb_data, candidate_index=None, maxsize=100000):
+    """Returns a version of find_best_candidate for given KB that memoizes the answers of the last scored mentions.
+
+    Annotations with the same normalized text and gold label ID get the same answer, so each of these keys is scored once
+    while it stays in the bounded LRU cache. Intended for callers that link annotations one by one.
+
+    Args
+        kb_data (KnowledgeBase): instance of the referred class representing a given knowledge base
+        candidate_index (ChoiceTable or CandidateIndex): see rank_candidates, None to score every KB name with
+            process.extract
+        maxsize (int): maximum number of (normalized text, gold label ID) keys kept in the cache
+
+    Returns
+        find_candidate (function): receives an annotation with format (annotation text, gold label ID, direct ancestor ID, doc)
+            and returns a tuple with format ((annotation), top_candidate_id); find_candidate.cache_info() reports
+            the hits and misses of the cache
+    """
+
+    @lru_cache(maxsize=maxsize)
+    def find_top_candidate_id(normalized_text, gold_id):
+        top_candidates = rank_candidates(kb_data, normalized_text, candidate_index)
+        
+        return select_top_candidate(kb_data, (normalized_text, gold_id), top_candidates)
+
+    def find_candidate(annotation):
+        return (annotation, find_top_candidate_id(normalize_mention(annotation[0]), annotation[1]))
+
+    find_candidate.cache_info = find_top_candidate_id.cache_info
+
+    return find_candidate
+
+
+def group_annotations(valid_annotations):
+    """Group annotations that necessarily get the same answer, i.e. with the same normalized text and gold label ID.
+
+    Args
+        valid_annotations (list): has format [(annotation text, gold label ID, direct ancestor ID, doc)]
+
+    Returns
+        unique_annotations (dict): has format {(normalized text, gold label ID): first annotation with this key}
+    """
+
+    unique_annotations = dict()
+
+    for annotation in valid_annotations:
+        key = (normalize_mention(annotation[0]), annotation[1])
+
+        if key not in unique_annotations:
+            unique_annotations[key] = annotation
+
+    dedup_ratio = len(valid_annotations) / max(len(unique_annotations), 1)
+    print("Unique (normalized text, gold label) keys:", str(len(unique_annotations)), "/", str(len(valid_annotations)), \
+        "annotations (dedup ratio:", str(round(dedup_ratio, 3)), ")")
 
+    return unique_annotations
 
-def check_answers(model, partition, answers):
+
+def iter_answers(valid_annotations, unique_answers):
+    """Fan out the answers for each (normalized text, gold label ID) key to all the annotations with that key.
+
+    The unique answers are consumed as they come: the keys are in the order of their first annotation (see 
+    group_annotations), so the key of each annotation is either already answered or the next one to be answered.
+
+    Args
+        valid_annotations (list): has format [(annotation text, gold label ID, direct ancestor ID, doc)]
+        unique_answers (iterable): has format [((first annotation with the key), top_candidate_id)], possibly followed 
+            by the resolution path (see find_best_candidate_blocked), in the order of group_annotations
+
+    Yields
+        answer (tuple): has format ((annotation), top_candidate_id), in the order of valid_annotations
+    """
+
+    key_to_candidate = dict()
+    unique_answers = iter(unique_answers)
+
+    for annotation in valid_annotations:
+        key = (normalize_mention(annotation[0]), annotation[1])
+
+        while key not in key_to_candidate.keys():
+            unique_answer = next(unique_answers)
+            key_to_candidate[(normalize_mention(unique_answer[0][0]), unique_answer[0][1])] = unique_answer[1]
+
+        yield (annotation, key_to_candidate[key])
+
+
+def expand_answers(valid_annotations, unique_answers):
+    """Returns the list of the answers of iter_answers, with format [((annotation), top_candidate_id)]"""
+
+    return list(iter_answers(valid_annotations, unique_answers))
+
+
+@profiled("baseline.check_answers", count_items=lambda counts: counts[1])
+def check_answers(model, partition, answers, hierarchy=None):
     """Checks correcteness of answers in chosen partition, outputs answer to file, and print out statistics.
 
     Args
         model (str): "baseline"
         partition (str): has value "hp", "medic", "ctd_anatomy", "ctd_chemicals", "chebi", "go_bp" or "all"
-        answers (list): each answer has the format ((text, gold label, direct ancestor, doc), top_candidate_id)
+        answers (iterable): each answer has the format ((text, gold label, direct ancestor, doc), top_candidate_id),
+            they are written to the file as they come (see evaluation.Evaluator)
+        hierarchy (HierarchyIndex): if given, the ancestor hits and the distance to the direct ancestor are also reported
 
     Returns
         outputs answers in .csv file
@@ -51,54 +314,210 @@ def check_answers(model, partition, answers):
         annotations_partition_count (int): number of annotations in partition
         docs_in_partition_count (int): number of documents in partition
     """
+
+    with Evaluator(model, partition, hierarchy=hierarchy) as evaluator:
+
+        for answer in answers:
+            evaluator.add(answer)
+
+    return evaluator.report()
     
-    output_annotations = list()
-    correct_answers_partition_count = int()
-    annotations_partition_count = int()
-    doc_unique = list()
 
-    #output results in a csv file
-    with open("./" + model + "_" + partition + "_answers.csv", "w", newline="") as out_file:
-        
-        out_writer = csv.writer(out_file, delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL)
-        out_writer.writerow(["doc", "text", "gold label", "direct ancestor", "answer", "classification"])
+@profiled("baseline.load_partition", count_items=lambda loaded: len(loaded[1]))
+def load_partition(partition):
+    """Loads the KB of given partition and the annotations of its test set that are considered by the baseline model.
 
-        for annot in answers:
+    Args
+        partition (str): has value "hp", "medic", "ctd_anatomy", "ctd_chemicals", "chebi" or "go_bp"
+
+    Returns
+        kb_data (KnowledgeBase): instance of the referred class representing the KB of the partition
+        valid_annotations (list): has format [(annotation text, gold label ID, direct ancestor ID, doc)]
+    """
 
-            if annot[0][3] not in doc_unique: #To count the number of docs
-                doc_unique.append(annot[0][3])
-            
-            annotations_partition_count += 1
+    kb_data = KnowledgeBase(partition)
+    valid_annotations = list()
 
-            if annot[0][2] == annot[1]:
-                correct_answers_partition_count += 1
-                classification = "1"
+    if partition == "ctd_anatomy" or partition == "ctd_chemicals":
+        kb_data.load_tsv(partition)
 
-            else:
-                classification = "0"
-            
-            out_writer.writerow([annot[0][3], annot[0][0], annot[0][1], annot[0][2], annot[1], classification])
+    else:
+        kb_data.load_obo(partition)
 
-        out_file.close()
+    #get annotations only from test set, one document at a time
+    for split, subset, doc, annotations in iter_annotations(partition, subsets=["test"]):
 
-    partition_accuracy = (correct_answers_partition_count/annotations_partition_count)*100
-    docs_in_partition_count = len(doc_unique)
+        for annotation in annotations: #Only consider annotations with 1 or 2 words
+            annotations_words = annotation[0].split(" ")
 
-    print("------------\nTotal docs (", partition , "):", str(docs_in_partition_count),  \
-         "\nTotal annotations (", partition, "):", str(annotations_partition_count), \
-         "\nCorrect answers:", str(correct_answers_partition_count), \
-         "\nAccuracy (", partition, "):", str(partition_accuracy))
+            if len(annotations_words) == 1 or len(annotations_words) == 2:
+                valid_annotations.append((annotation[0],annotation[3], annotation[4], doc))
 
-    return correct_answers_partition_count, annotations_partition_count, docs_in_partition_count
-    
+    return kb_data, valid_annotations
+
+
+def build_candidate_index(kb_data, mode):
+    """Builds the candidate index for the KB in "exact" mode (ChoiceTable), "fast" mode (CandidateIndex) or "blocked" 
+    mode (TokenBlockingIndex)"""
+
+    begin_time = time.time()
+
+    with span("baseline.candidate_index", items=len(kb_data.name_to_id)):
+
+        if mode == "exact":
+            candidate_index = ChoiceTable(kb_data.name_to_id)
+
+        elif mode == "fast":
+            candidate_index = CandidateIndex(kb_data.name_to_id)
+
+        else:
+            candidate_index = TokenBlockingIndex(kb_data.name_to_id, kb_data.synonym_to_id)
+
+    print("Candidate index built in", str(round(time.time() - begin_time, 3)), "s")
+
+    return candidate_index
+
+
+@contextmanager
+def candidate_index_file(candidate_index):
+    """Yields the path of a frozen copy of the candidate index (see freeze_candidate_index), that the pool workers 
+    memory-map instead of each holding a copy, removing it at exit"""
+
+    file_descriptor, filepath = tempfile.mkstemp(prefix="candidate_index.", suffix=".cif")
+    os.close(file_descriptor)
+
+    try:
+        freeze_candidate_index(candidate_index, filepath)
+        yield filepath
+
+    finally:
+        os.remove(filepath)
+
+
+def prepare_partition(partition, mode):
+    """Loads a partition and writes the files its scoring needs, while the previous partition is being scored.
+
+    Args
+        partition (str): has value "hp", "medic", "ctd_anatomy", "ctd_chemicals", "chebi" or "go_bp"
+        mode (str): "exact", "fast" or "blocked" (see baseline_model)
+
+    Returns
+        prepared (dict): has format {"valid_annotations": list, "unique_annotations": dict, "hierarchy": HierarchyIndex,
+            "kb_filepath": str, "index_filepath": str, "files": ExitStack, "load_time": float}, the caller closes 
+            "files" to remove the frozen KB and the candidate index
+    """
+
+    begin_time = time.time()
+    kb_data, valid_annotations = load_partition(partition)
+    candidate_index = build_candidate_index(kb_data, mode)
+    unique_annotations = group_annotations(valid_annotations)
+    hierarchy = kb_data.hierarchy # Built (or loaded from its snapshot) the first time it is used
 
-def baseline_model(partition):
+    with ExitStack() as stack: # Files are removed here only if something fails before returning
+        kb_filepath = stack.enter_context(frozen_kb_file(kb_data)) # Workers memory-map the KB instead of copying it
+        index_filepath = stack.enter_context(candidate_index_file(candidate_index))
+        files = stack.pop_all()
+
+    return {"valid_annotations": valid_annotations, "unique_annotations": unique_annotations, "hierarchy": hierarchy,
+            "kb_filepath": kb_filepath, "index_filepath": index_filepath, "files": files, 
+            "load_time": time.time() - begin_time}
+
+
+def score_partition(pool, prepared, workers, unique_answers):
+    """Scores the unique annotations of a prepared partition (see prepare_partition) with the shared pool.
+
+    The annotations are split into about 4 chunks per worker, so that even a small partition keeps every worker busy.
+    The answers of each chunk are yielded as soon as the chunk and the ones before it are scored.
+
+    Args
+        unique_answers (list): the yielded answers are also appended to this list
+
+    Yields
+        unique_answer (tuple): has format ((annotation), top_candidate_id), in the order of unique_annotations
+    """
+
+    annotations = list(prepared["unique_annotations"].values())
+    chunk_size = max(math.ceil(len(annotations) / (workers * 4)), 1)
+    tasks = [(prepared["kb_filepath"], prepared["index_filepath"], annotations[i:i + chunk_size]) \
+                for i in range(0, len(annotations), chunk_size)]
+    with span("baseline.scoring", items=len(annotations)):
+
+        for answers in pool.imap(find_best_candidates_worker, tasks, chunksize=1):
+            unique_answers.extend(answers)
+
+            for unique_answer in answers:
+                yield unique_answer
+
+
+def compare_modes(partition, sample_size):
+    """Compares the "exact", "fast" and "blocked" modes of the baseline model over a random sample of the test set.
+
+    The reference is fuzzywuzzy process.extract over every KB name (find_best_candidate without candidate index), that
+    the top-2 candidates of "exact" mode must match.
+
+    Args
+        partition (str): has value "hp", "medic", "ctd_anatomy", "ctd_chemicals", "chebi" or "go_bp"
+        sample_size (int): number of annotations to sample
+
+    Returns
+        prints the runtime and accuracy of each mode, the number of annotations with the same top-2 candidates in 
+            "exact" and "fast" modes as with process.extract and the number of annotations with the same answer in each
+            mode as with process.extract
+    """
+
+    kb_data, valid_annotations = load_partition(partition)
+    random.seed(100)
+    sample = random.sample(valid_annotations, min(sample_size, len(valid_annotations)))
+    choice_table = build_candidate_index(kb_data, "exact")
+    candidate_index = build_candidate_index(kb_data, "fast")
+    blocking_index = build_candidate_index(kb_data, "blocked")
+    top_candidates = dict()
+    answers = dict()
+
+    for mode, mode_index in (("process.extract", None), ("exact", choice_table), ("fast", candidate_index), 
+                                ("blocked", blocking_index)):
+        begin_time = time.time()
+
+        if mode == "blocked":
+            answers[mode] = [find_best_candidate_blocked(mode_index, annotation)[1] for annotation in sample]
+
+        else:
+            top_candidates[mode] = [rank_candidates(kb_data, annotation[0], mode_index) for annotation in sample]
+            answers[mode] = [select_top_candidate(kb_data, sample[i], top_candidates[mode][i]) \
+                                for i in range(len(sample))]
+
+        correct_answers = len([i for i in range(len(sample)) if sample[i][2] == answers[mode][i]])
+        print("------------\nMode:", mode, "\nRuntime:", str(time.time() - begin_time), "s", \
+            "\nAccuracy (", partition, "):", str((correct_answers/len(sample))*100))
+
+    print("------------")
+
+    for mode in ["exact", "fast"]:
+        identical_top_2 = len([i for i in range(len(sample)) \
+                                    if top_candidates["process.extract"][i] == top_candidates[mode][i]])
+        print("Identical top-2 candidates (", mode, "):", str(identical_top_2), "/", str(len(sample)))
+
+    for mode in ["exact", "fast", "blocked"]:
+        identical_answers = len([i for i in range(len(sample)) if answers["process.extract"][i] == answers[mode][i]])
+        print("Identical answers (", mode, "):", str(identical_answers), "/", str(len(sample)))
+
+
+def baseline_model(partition, mode="exact", workers=20, prefetch=1):
     """Applies baseline model based on string matching over EvaNIL dataset.
+
+    A single pool of workers scores all the partitions, one after the other. While a partition is scored, a loader 
+    thread loads the KB and the test set of the next ones, builds their candidate index and freezes their KB.
     
     Arg
         partition (str): has value "hp", "medic", "ctd_anatomy", "ctd_chemicals", "chebi", "go_bp" or "all"
-
+        mode (str): "exact" to score every KB name for each annotation, "fast" to only score the names shortlisted
+            by a character n-gram index, "blocked" to match the KB names and synonyms exactly or score the ones 
+            sharing a token with the annotation (see find_best_candidate_blocked)
+        workers (int): number of processes scoring the annotations, shared by all the partitions
+        prefetch (int): number of partitions loaded ahead of the one being scored (bounds the partitions in memory)
+    
     Returns
+        prints results for chosen partition
         prints results for the entire dataset (if "all" selected)
     """
 
@@ -112,41 +531,38 @@ def baseline_model(partition):
     
     else:
         partitions = ["hp", "chebi", "go_bp", "medic", "ctd_anatomy", "ctd_chemicals"]
-        
-    for partition in partitions:
-        kb_data = KnowledgeBase(partition)
-        part_annotations = retrieve_annotations(partition, test=True) #get annotations only from test set
-        annotations_partition_count= int()
-        correct_answers_partition_count = int()
-        valid_annotations = list()
-        
-        if partition == "ctd_anatomy" or partition == "ctd_chemicals":
-            kb_data.load_tsv(partition)
-        
-        else:
-            kb_data.load_obo(partition)
-        
-        for doc in part_annotations: #Only consider annotations with 1 or 2 words
-            
-            for annotation in part_annotations[doc]:
-                annotations_words = annotation[0].split(" ")
-                    
-                if len(annotations_words) == 1 or len(annotations_words) == 2: 
-                    annotations_partition_count += 1 
-                    valid_annotations.append((annotation[0],annotation[3], annotation[4], doc)) 
-        
-        partial_func = partial(find_best_candidate, kb_data)
-        
-        with multiprocessing.Pool(processes=20) as pool:
-            top_candidates = pool.map(partial_func, valid_annotations)
 
-        correct_answers_partition_count, annotations_partition_count, \
-            docs_in_partition_count = check_answers("baseline", partition, top_candidates)
+    # The pool is started before the loader thread, so that the workers are not forked while it runs
+    with multiprocessing.Pool(processes=workers) as pool, ThreadPoolExecutor(max_workers=1) as loader:
+        prepared_futures = [loader.submit(prepare_partition, partitions[i], mode) \
+                                for i in range(min(prefetch + 1, len(partitions)))]
+
+        for i, partition_name in enumerate(partitions):
+            wait_begin_time = time.time()
+            prepared = prepared_futures[i].result()
+            prepared_futures[i] = None
+            scoring_begin_time = time.time()
+
+            valid_annotations = prepared["valid_annotations"]
+            unique_answers = list()
+
+            with prepared["files"]: # The answers are checked and written as they come out of the pool
+                top_candidates = iter_answers(valid_annotations, score_partition(pool, prepared, workers, unique_answers))
+                correct_answers_partition_count, annotations_partition_count, docs_in_partition_count = \
+                    check_answers("baseline", partition_name, top_candidates, hierarchy=prepared["hierarchy"])
+
+            if i + prefetch + 1 < len(partitions):
+                prepared_futures.append(loader.submit(prepare_partition, partitions[i + prefetch + 1], mode))
 
-        total_correct_answers += correct_answers_partition_count
-        total_valid_annotations += annotations_partition_count
-        total_docs_count += docs_in_partition_count
-        print("\nPartition runtime:", str(time.time()-begin_time), "s")
+            if mode == "blocked":
+                report_resolution_paths(valid_annotations, unique_answers)
+
+            total_correct_answers += correct_answers_partition_count
+            total_valid_annotations += annotations_partition_count
+            total_docs_count += docs_in_partition_count
+            print("\nPartition runtime:", str(prepared["load_time"] + time.time() - scoring_begin_time), "s", \
+                "(loading:", str(round(prepared["load_time"], 3)), "s, waited for loading:", \
+                str(round(scoring_begin_time - wait_begin_time, 3)), "s )")
     
     if partition == "all":
         global_accuracy = (total_correct_answers/total_valid_annotations)*100
@@ -157,4 +573,28 @@ def baseline_model(partition):
 
 
 if __name__ == "__main__":
-    baseline_model(sys.argv[1])
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Apply the baseline model over EvaNIL dataset")
+    parser.add_argument("partition", help="hp, medic, ctd_anatomy, ctd_chemicals, chebi, go_bp or all")
+    parser.add_argument("--mode", default="exact", choices=["exact", "fast", "blocked"], 
+                        help="score every KB name (exact), only the names shortlisted by the candidate index (fast) " \
+                            + "or only the names and synonyms sharing a token with the annotation (blocked)")
+    parser.add_argument("--workers", type=int, default=20, help="number of processes scoring the annotations")
+    parser.add_argument("--prefetch", type=int, default=1, 
+                        help="number of partitions loaded while the current one is scored (all)")
+    parser.add_argument("--compare", type=int, metavar="SAMPLE_SIZE", 
+                        help="compare the exact, fast and blocked modes over a sample of the test set instead")
+    parser.add_argument("--profile", nargs="?", const=True, metavar="PATH", 
+                        help="write the timing and memory of each stage to a JSON report (./profiles/ by default)")
+    args = parser.parse_args()
+
+    if args.profile:
+        enable_profiling()
+
+    if args.compare is not None:
+        compare_modes(args.partition, args.compare)
+    
+    else:
+        baseline_model(args.partition, mode=args.mode, workers=args.workers, prefetch=args.prefetch)
+
+    if args.profile:
+        write_profile(None if args.profile is True else args.profile, script="baseline")
@@ -0,0 +1,314 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from annotations import convert_PBDMS_into_dict, load_kb, parse_CRAFT, parse_MedMentions, parse_PBDMS_doc, \
+    structure_PBDMS_annotations, CRAFT_DIRS, MEDMENTIONS_FILEPATH, PBDMS_DIR
+from baseline import find_best_candidate, build_candidate_index
+from dataset import build_partition
+from kbs import KnowledgeBase
+from manifest import code_version
+from statistics import get_corpus_statistics
+
+sys.path.append("./")
+
+# Size of each synthetic input at scale 1.0, see benchmark_sizes
+BENCHMARK_SIZES = {"concepts": 20000, "PBDMS_docs": 20000, "pubtator_docs": 2000, "craft_files": 20, "mentions": 50}
+BENCHMARK_DIR = "./benchmarks/"
+name_syllables = ["ab", "ne", "ro", "ti", "ca", "lo", "mi", "sar", "cor", "neu", "pla", "sia", "tro", "phy", "gen", "oma",
+                    "itis", "ex", "ost", "card", "hep", "ren", "my", "der"]
+
+
+def benchmark_sizes(scale):
+    """Returns the number of items of each synthetic input for given scale (float)"""
+
+    return {item: max(int(count * scale), 1) for item, count in BENCHMARK_SIZES.items()}
+
+
+def synthetic_name(rng):
+    """Returns a random concept name with 1 to 3 words"""
+
+    return " ".join("".join(rng.choice(name_syllables) for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 3)))
+
+
+def perturb_name(rng, name):
+    """Returns a mention of given concept name with typical variations: replaced characters, dropped or swapped words"""
+
+    words = name.split(" ")
+    variation = rng.random()
+
+    if variation < 0.3 and len(words) > 1:
+        words.reverse()
+
+    elif variation < 0.5 and len(words) > 1:
+        words.pop(rng.randrange(len(words)))
+
+    elif variation < 0.8:
+        word_index = rng.randrange(len(words))
+        words[word_index] = words[word_index].replace(rng.choice(words[word_index]), rng.choice("aeiou"), 1)
+
+    return " ".join(words)
+
+
+def generate_obo(filepath, prefix, concepts_count, rng):
+    """Writes a synthetic .obo ontology in the format of the HPO/ChEBI files.
+
+    Every term has a name, a synonym and a UMLS xref, and 1 (80% of the terms) or 2 is_a parents.
+
+    Returns
+        names (list): has format [(name, concept ID)]
+    """
+
+    names = list()
+
+    with open(filepath, 'w', encoding="utf-8") as obo_file:
+        obo_file.write("format-version: 1.2\nontology: synthetic\n\n")
+        obo_file.write("[Term]\nid: " + prefix + ":0000001\nname: root\nnamespace: biological_process\n\n")
+
+        for i in range(2, concepts_count + 1):
+            node_id, node_name = prefix + ":%07d" % i, synthetic_name(rng)
+            parents = [prefix + ":%07d" % rng.randint(1, i - 1) for _ in range(1 if rng.random() < 0.8 else 2)]
+            names.append((node_name, node_id))
+            obo_file.write("[Term]\nid: " + node_id + "\nname: " + node_name + "\nnamespace: biological_process\n")
+
+            for parent in parents:
+                obo_file.write("is_a: " + parent + " ! parent\n")
+
+            obo_file.write('synonym: "' + synthetic_name(rng) + '" EXACT []\nxref: UMLS:C%07d\n\n' % i)
+
+    return names
+
+
+def generate_tsv(filepath, concepts_count, rng):
+    """Writes a synthetic CTD vocabulary (.tsv with 29 header lines), MeSH IDs have format D%06d"""
+
+    with open(filepath, 'w', encoding="utf-8") as tsv_file:
+
+        for i in range(29):
+            tsv_file.write("# header line " + str(i) + "\n")
+
+        for i in range(1, concepts_count + 1):
+            parents = "|".join("MESH:D%06d" % rng.randint(0, i - 1) for _ in range(1 if rng.random() < 0.8 else 2))
+            synonyms = "|".join(synthetic_name(rng) for _ in range(rng.randint(1, 3)))
+            tsv_file.write("\t".join([synthetic_name(rng), "MESH:D%06d" % i, "", "", parents, "", "", synonyms]) + "\n")
+
+
+def generate_PBDMS_split(filepath, docs_count, concepts_count, rng):
+    """Writes a synthetic PBDMS split file, about 75% of the MeSH IDs of the mentions are in the CTD vocabulary"""
+
+    with open(filepath, 'w', encoding="utf-8") as split_file:
+
+        for doc in range(docs_count):
+            mentions = list()
+
+            for i in range(rng.randint(0, 8)):
+                mention = synthetic_name(rng)
+                mentions.append({"mention": mention, "start_offset": i * 20, "end_offset": i * 20 + len(mention),
+                                    "mesh_id": "D%06d" % rng.randint(1, int(concepts_count * 1.3))})
+
+            split_file.write(json.dumps({"_id": str(10000000 + doc), "text": synthetic_name(rng) * 20,
+                                            "mentions": mentions}) + "\n")
+
+
+def generate_pubtator(filepath, docs_count, concepts_count, rng):
+    """Writes a synthetic PubTator corpus as MedMentions, about half of the UMLS IDs are xrefs of the .obo ontology"""
+
+    with open(filepath, 'w', encoding="utf-8") as corpus_file:
+
+        for doc in range(docs_count):
+            doc_id = str(20000000 + doc)
+            corpus_file.write(doc_id + "|t|" + synthetic_name(rng) + "\n" + doc_id + "|a|" + synthetic_name(rng) * 20 + "\n")
+
+            for i in range(rng.randint(1, 20)):
+                mention = synthetic_name(rng)
+                corpus_file.write("\t".join([doc_id, str(i * 20), str(i * 20 + len(mention)), mention, "T047",
+                                                "C%07d" % rng.randint(1, concepts_count * 2)]) + "\n")
+
+            corpus_file.write("\n")
+
+
+def generate_knowtator(dirpath, files_count, concepts_count, rng, prefix="CHEBI"):
+    """Writes synthetic CRAFT knowtator files (.txt.knowtator.xml) with 50 to 500 annotations each"""
+
+    for i in range(files_count):
+        mention_ids = list(range(rng.randint(50, 500)))
+
+        with open(dirpath + str(11000000 + i) + ".txt.knowtator.xml", 'w', encoding="utf-8") as xml_file:
+            xml_file.write('<?xml version="1.0" encoding="UTF-8"?>\n<annotations textSource="' + str(i) + '.txt">\n')
+
+            for mention_id in mention_ids:
+                xml_file.write('  <annotation>\n    <mention id="m_' + str(mention_id) + '" />\n' \
+                                + '    <annotator id="a">annotator</annotator>\n' \
+                                + '    <span start="' + str(mention_id * 20) + '" end="' + str(mention_id * 20 + 9) + '" />\n' \
+                                + '    <spannedText>' + synthetic_name(rng) + '</spannedText>\n  </annotation>\n')
+
+            for mention_id in mention_ids:
+                xml_file.write('  <classMention id="m_' + str(mention_id) + '">\n    <mentionClass id="' + prefix \
+                                + ":%07d" % rng.randint(1, concepts_count) + '">concept</mentionClass>\n  </classMention>\n')
+
+            xml_file.write('</annotations>\n')
+
+
+def generate_inputs(sizes, seed=2022):
+    """Writes the synthetic KBs and corpora in the current directory, in the paths read by kbs.py and annotations.py.
+
+    Args
+        sizes (dict): number of items of each input, see benchmark_sizes
+        seed (int): seed of the random generator, the same seed and sizes always produce the same files
+
+    Returns
+        names (list): has format [(name, HPO ID)], the names of the synthetic HPO
+    """
+
+    rng = random.Random(seed)
+    os.makedirs("./retrieved_data/kb_files/", exist_ok=True)
+    os.makedirs(PBDMS_DIR, exist_ok=True)
+    os.makedirs(os.path.dirname(MEDMENTIONS_FILEPATH), exist_ok=True)
+    os.makedirs(CRAFT_DIRS["chebi"], exist_ok=True)
+    names = generate_obo(KnowledgeBase("hp").kb_filepath("hp"), "HP", sizes["concepts"], rng)
+    generate_obo(KnowledgeBase("chebi").kb_filepath("chebi"), "CHEBI", sizes["concepts"], rng)
+    generate_tsv(KnowledgeBase("ctd_anatomy").kb_filepath("ctd_anatomy"), sizes["concepts"], rng)
+    generate_PBDMS_split(PBDMS_DIR + "split_1.txt", sizes["PBDMS_docs"], sizes["concepts"], rng)
+    generate_pubtator(MEDMENTIONS_FILEPATH, sizes["pubtator_docs"], sizes["concepts"], rng)
+    generate_knowtator(CRAFT_DIRS["chebi"], sizes["craft_files"], sizes["concepts"], rng)
+
+    return names
+
+
+def time_stage(results, stage, items_count, func, *args, **kwargs):
+    """Runs func(*args, **kwargs) and records its runtime in results (dict) under given stage name.
+
+    Args
+        items_count (int): number of items processed by the stage, to report its throughput (items/s)
+
+    Returns
+        the return value of func
+    """
+
+    begin_time, begin_cpu_time = time.perf_counter(), time.process_time()
+    output = func(*args, **kwargs)
+    runtime = time.perf_counter() - begin_time
+    results[stage] = {"runtime": runtime, "cpu_time": time.process_time() - begin_cpu_time, "items": items_count,
+                        "throughput": items_count / max(runtime, 1e-9)}
+    print(stage.ljust(32), str(round(runtime, 3)).rjust(10), "s", str(round(results[stage]["throughput"], 1)).rjust(12),
+            "items/s", file=sys.__stdout__)
+
+    return output
+
+
+def run_benchmark(scale=1.0, workers=4, seed=2022, verbose=False):
+    """Generates the synthetic inputs in a temporary directory and times each stage of the pipeline on them.
+
+    Args
+        scale (float): multiplies the size of every input (BENCHMARK_SIZES)
+        workers (int): number of worker processes of the parallel stages
+        seed (int): seed of the generators
+        verbose (bool): "True" to keep the progress messages printed by the stages
+
+    Returns
+        report (dict): has keys "version", "created", "python", "platform", "cpu_count", "scale", "workers", "seed",
+            "sizes" and "stages", the latter with format {stage: {"runtime", "cpu_time", "items", "throughput"}}
+    """
+
+    sizes = benchmark_sizes(scale)
+    work_dir = tempfile.mkdtemp(prefix="evanil_benchmark.")
+    initial_dir = os.getcwd()
+    stages = dict()
+
+    try:
+        os.chdir(work_dir) # The pipeline reads and writes paths relative to the current directory
+
+        with contextlib.redirect_stdout(sys.stdout if verbose else io.StringIO()):
+            names = time_stage(stages, "generate_inputs", sum(sizes.values()), generate_inputs, sizes, seed=seed)
+            time_stage(stages, "load_obo", sizes["concepts"], KnowledgeBase("hp", use_cache=False).load_obo, "hp")
+            hp_data = KnowledgeBase("hp")
+            hp_data.load_obo("hp") # Writes the compiled snapshot
+            time_stage(stages, "load_obo.snapshot", sizes["concepts"], KnowledgeBase("hp").load_obo, "hp")
+            kb_data = KnowledgeBase("ctd_anatomy", use_cache=False)
+            time_stage(stages, "load_tsv", sizes["concepts"], kb_data.load_tsv, "ctd_anatomy")
+
+            with open(PBDMS_DIR + "split_1.txt", 'r', encoding="utf-8") as split_file:
+                documents = split_file.readlines()
+
+            time_stage(stages, "parse_PBDMS_doc", len(documents),
+                        lambda: [parse_PBDMS_doc(kb_data, document) for document in documents])
+            doc_annotations = time_stage(stages, "structure_PBDMS_annotations", len(documents),
+                                            structure_PBDMS_annotations, documents, kb_data, workers=workers)
+            annotations = convert_PBDMS_into_dict(doc_annotations)
+            time_stage(stages, "build_partition", len(annotations), build_partition, annotations, "ctd_anatomy", "1")
+            time_stage(stages, "get_corpus_statistics", len(annotations), get_corpus_statistics, annotations.items())
+            time_stage(stages, "parse_MedMentions", sizes["pubtator_docs"], parse_MedMentions, hp_data, workers=workers)
+            chebi_data = load_kb("chebi")
+            time_stage(stages, "parse_CRAFT", sizes["craft_files"], parse_CRAFT, chebi_data, workers=workers)
+
+            rng = random.Random(seed)
+            mentions = [(perturb_name(rng, name), node_id, "HP:0000001", "doc") for name, node_id in
+                            rng.sample(names, min(sizes["mentions"], len(names)))]
+            time_stage(stages, "find_best_candidate", len(mentions),
+                        lambda: [find_best_candidate(hp_data, mention) for mention in mentions])
+            choice_table = time_stage(stages, "build_choice_table", sizes["concepts"], build_candidate_index,
+                                        hp_data, "exact")
+            time_stage(stages, "find_best_candidate.choice_table", len(mentions),
+                        lambda: [find_best_candidate(hp_data, mention, choice_table) for mention in mentions])
+            candidate_index = time_stage(stages, "build_candidate_index", sizes["concepts"], build_candidate_index,
+                                            hp_data, "fast")
+            time_stage(stages, "find_best_candidate.fast", len(mentions),
+                        lambda: [find_best_candidate(hp_data, mention, candidate_index) for mention in mentions])
+
+    finally:
+        os.chdir(initial_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {"version": code_version(), "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "platform": platform.platform(), "cpu_count": multiprocessing.cpu_count(), "scale": scale, "workers": workers,
+            "seed": seed, "sizes": sizes, "stages": stages}
+
+
+def compare_reports(report, baseline_report):
+    """Prints the runtime of each stage in both reports and the ratio between them (> 1 means the stage got slower)"""
+
+    if report["sizes"] != baseline_report["sizes"] or report["workers"] != baseline_report["workers"]:
+        print("WARNING: the reports were run with different sizes or workers, runtimes are not comparable")
+
+    print("------------\n" + "Stage".ljust(32), "Baseline (s)".rjust(12), "Current (s)".rjust(12), "Ratio".rjust(8))
+
+    for stage, result in report["stages"].items():
+
+        if stage in baseline_report["stages"]:
+            baseline_runtime = baseline_report["stages"][stage]["runtime"]
+            ratio = result["runtime"] / max(baseline_runtime, 1e-9)
+            print(stage.ljust(32), str(round(baseline_runtime, 3)).rjust(12), str(round(result["runtime"], 3)).rjust(12),
+                    str(round(ratio, 2)).rjust(8))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the stages of EvaNIL on synthetic KBs and corpora")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the size of the synthetic inputs")
+    parser.add_argument("--workers", type=int, default=4, help="number of processes of the parallel stages")
+    parser.add_argument("--seed", type=int, default=2022, help="seed of the synthetic data generators")
+    parser.add_argument("--output", help="path of the JSON report (./benchmarks/benchmark_<date>.json by default)")
+    parser.add_argument("--compare", metavar="REPORT", help="JSON report of a previous run to compare with")
+    parser.add_argument("--verbose", action="store_true", help="print the progress messages of the stages")
+    args = parser.parse_args()
+
+    output_filepath = args.output or BENCHMARK_DIR + "benchmark_" + time.strftime("%Y%m%d_%H%M%S") + ".json"
+    report = run_benchmark(scale=args.scale, workers=args.workers, seed=args.seed, verbose=args.verbose)
+    os.makedirs(os.path.dirname(os.path.abspath(output_filepath)), exist_ok=True)
+
+    with open(output_filepath, 'w', encoding="utf-8") as out_file:
+        json.dump(report, out_file, indent=4)
+
+    print("Report:", output_filepath)
+
+    if args.compare is not None:
+
+        with open(args.compare, 'r', encoding="utf-8") as in_file:
+            compare_reports(report, json.load(in_file))
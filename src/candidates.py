@@ -0,0 +1,528 @@
+import heapq
+import math
+import sys
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from collections.abc import Mapping, Sequence
+from fuzzywuzzy import fuzz, utils
+from utils import MappedSectionFile, write_section_file
+
+sys.path.append("./")
+
+CANDIDATE_INDEX_MAGIC = b"EVANILCI"
+
+
+def process_choice(text):
+    """Applies to a KB name the same preprocessing fuzzywuzzy applies to choices in process.extract with token_sort_ratio"""
+
+    return " ".join(sorted(utils.full_process(text, force_ascii=True).split())).strip()
+
+
+def normalize_mention(text):
+    """Applies to a mention the same preprocessing fuzzywuzzy applies to the query in process.extract with token_sort_ratio.
+
+    Two mentions with the same normalized form get the same scores against every KB name.
+    """
+
+    return " ".join(sorted(utils.full_process(utils.full_process(text), force_ascii=True).split())).strip()
+
+
+def char_ngrams(processed_text, n=3):
+    """Returns the character n-grams of each token in the processed text, with tokens padded by one space on each side"""
+
+    ngrams = list()
+
+    for token in processed_text.split():
+        padded_token = " " + token + " "
+        ngrams.extend(padded_token[i:i + n] for i in range(max(len(padded_token) - n + 1, 1)))
+
+    return ngrams
+
+
+def ratio_bound(length_1, length_2):
+    """Returns the highest fuzz.ratio two strings with given lengths can get.
+
+    The Levenshtein distance used by fuzz.ratio (substitutions count twice) is at least the length difference, so the
+    ratio is at most 2 * min length / sum of the lengths. Two empty strings are equal and get 100.
+    """
+
+    if length_1 + length_2 == 0:
+        return 100
+
+    return utils.intr(100 * (2 * min(length_1, length_2) / (length_1 + length_2)))
+
+
+class ChoiceTable:
+    """Token-sorted forms of the names of a knowledge base, used to score a mention against every name.
+
+    process.extract preprocesses and sorts the tokens of every name for every mention, here they are processed once. 
+    The names are grouped by the length of their processed form and the groups are scored from the closest length to 
+    the mention to the furthest, stopping when the length difference alone caps the ratio below the k-th best score. 
+    The top-k names are the same as process.extract(text, names, scorer=fuzz.token_sort_ratio, limit=k).
+
+    Attributes
+    ----------
+        names (list): KB names in the insertion order of kb_data.name_to_id
+        processed_names (list): has format [processed name], see process_choice
+        length_groups (dict): has format {length of processed name: array of name indexes, in increasing order}
+
+    Methods
+    -------
+        __init__(self, name_to_id)
+        top_candidates(self, text, k=2)
+    """
+
+    def __init__(self, name_to_id):
+        self.names = list(name_to_id.keys())
+        self.processed_names = [process_choice(name) for name in self.names]
+        self.length_groups = dict()
+
+        for name_index, processed_name in enumerate(self.processed_names):
+
+            if len(processed_name) not in self.length_groups:
+                self.length_groups[len(processed_name)] = array('I')
+
+            self.length_groups[len(processed_name)].append(name_index)
+
+    def top_candidates(self, text, k=2):
+        """Retrieves the k KB names with the highest token sort ratio with the mention text.
+
+        Ties are broken in favour of the name that comes first in the table, like heapq.nlargest in process.extract.
+
+        Args
+            text (str): the mention text
+            k (int): number of names to retrieve
+
+        Returns
+            top_candidates (list): has format [(KB name, score)], sorted by decreasing score
+        """
+
+        query = normalize_mention(text)
+        groups = sorted(((ratio_bound(len(query), length), length) for length in self.length_groups),
+                            key=lambda group: group[0], reverse=True)
+        top_names = list() # Has format [(score, name_index)], at most k, best first
+
+        for bound, length in groups:
+
+            if len(top_names) == k and bound < top_names[-1][0]:
+                break
+
+            name_indexes = self.length_groups[length]
+
+            if len(top_names) == k and bound == top_names[-1][0]: # Only names before the k-th can tie and replace it
+                name_indexes = name_indexes[:bisect_left(name_indexes, top_names[-1][1])]
+
+            for name_index in name_indexes:
+
+                if len(top_names) == k and (bound < top_names[-1][0] or \
+                        (bound == top_names[-1][0] and name_index > top_names[-1][1])):
+                    break
+
+                score = fuzz.ratio(query, self.processed_names[name_index])
+
+                if len(top_names) < k or score > top_names[-1][0] or \
+                        (score == top_names[-1][0] and name_index < top_names[-1][1]):
+                    top_names.append((score, name_index))
+                    top_names = sorted(top_names, key=lambda name: (-name[0], name[1]))[:k]
+
+        return [(self.names[name_index], score) for score, name_index in top_names]
+
+
+class CandidateIndex:
+    """Character n-gram TF-IDF index over the names of a knowledge base, used to shortlist candidates for a mention.
+
+    Attributes
+    ----------
+        names (list): KB names in the insertion order of kb_data.name_to_id
+        shortlist_size (int): number of names retrieved by cosine similarity to be reranked by the fuzzy scorer
+        max_df (float): n-grams present in more than this fraction of the names are not used for retrieval
+
+    Methods
+    -------
+        __init__(self, name_to_id, shortlist_size=50, max_df=0.05)
+        search(self, text, k=None)
+        shortlist(self, text)
+    """
+
+    def __init__(self, name_to_id, shortlist_size=50, max_df=0.05):
+        self.names = list(name_to_id.keys())
+        self.shortlist_size = shortlist_size
+        self.max_df = max_df
+        name_ngrams = [Counter(char_ngrams(process_choice(name))) for name in self.names]
+        doc_freq = Counter()
+
+        for ngram_counts in name_ngrams:
+            doc_freq.update(ngram_counts.keys())
+
+        names_count = len(self.names)
+        self.idf = {ngram: math.log((1 + names_count) / (1 + freq)) + 1 for ngram, freq in doc_freq.items()}
+        self.max_postings = max(int(self.max_df * names_count), shortlist_size)
+        self.postings = dict()
+
+        for name_index, ngram_counts in enumerate(name_ngrams):
+            weights = {ngram: count * self.idf[ngram] for ngram, count in ngram_counts.items()}
+            norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+
+            for ngram, weight in weights.items():
+
+                if ngram not in self.postings:
+                    self.postings[ngram] = (array('I'), array('f'))
+
+                self.postings[ngram][0].append(name_index)
+                self.postings[ngram][1].append(weight / norm)
+
+    def search(self, text, k=None):
+        """Retrieves the top-k KB names by cosine similarity between TF-IDF vectors of character n-grams.
+
+        Args
+            text (str): the mention text
+            k (int): number of names to retrieve, shortlist_size if None
+
+        Returns
+            top_names (list): has format [(name_index, cosine similarity)], sorted by decreasing similarity
+        """
+
+        if k is None:
+            k = self.shortlist_size
+
+        query_ngrams = Counter(char_ngrams(normalize_mention(text)))
+        weights = {ngram: count * self.idf[ngram] for ngram, count in query_ngrams.items() if ngram in self.idf}
+        norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+        scores = dict()
+
+        for ngram, weight in weights.items():
+            name_indexes, name_weights = self.postings[ngram]
+
+            if len(name_indexes) > self.max_postings: # Too frequent n-grams barely change the ranking
+                continue
+
+            query_weight = weight / norm
+
+            for name_index, name_weight in zip(name_indexes, name_weights):
+                scores[name_index] = scores.get(name_index, 0.0) + query_weight * name_weight
+
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def shortlist(self, text):
+        """Returns the shortlisted KB names for the mention, in the insertion order of kb_data.name_to_id
+
+        Keeping the original order ensures ties in the fuzzy scorer are broken the same way as in a full scan.
+        """
+
+        return [self.names[name_index] for name_index, _ in sorted(self.search(text))]
+
+
+class TokenBlockingIndex:
+    """Inverted index from the normalized tokens of the KB names and synonyms to the entries that contain them.
+
+    Mentions are resolved by an exact match of their normalized form when possible, otherwise only the entries sharing
+    at least one token with the mention (the block) are scored, and every entry is scored if the block is empty.
+
+    Attributes
+    ----------
+        entries (list): has format [(KB name or synonym, concept ID)], names first, in the insertion order of the dicts
+        exact_entries (dict): has format {normalized text: [entry index]}
+        postings (dict): has format {token: array of entry indexes}
+        max_block_df (float): tokens present in more than this fraction of the entries are only used if the mention
+            does not have rarer tokens
+
+    Methods
+    -------
+        __init__(self, name_to_id, synonym_to_id, max_block_df=0.05)
+        exact_matches(self, normalized_text)
+        block(self, normalized_text)
+    """
+
+    def __init__(self, name_to_id, synonym_to_id, max_block_df=0.05):
+        self.entries = list(name_to_id.items()) + list(synonym_to_id.items())
+        self.max_block_df = max_block_df
+        self.exact_entries = dict()
+        self.postings = dict()
+
+        for entry_index, (text, concept_id) in enumerate(self.entries):
+            processed_text = process_choice(text)
+            self.exact_entries.setdefault(processed_text, list()).append(entry_index)
+
+            for token in set(processed_text.split()):
+
+                if token not in self.postings:
+                    self.postings[token] = array('I')
+
+                self.postings[token].append(entry_index)
+
+        self.max_postings = max(int(max_block_df * len(self.entries)), 1)
+
+    def exact_matches(self, normalized_text):
+        """Returns the indexes of the entries whose normalized form is the normalized mention (see normalize_mention)"""
+
+        return self.exact_entries.get(normalized_text, list())
+
+    def block(self, normalized_text):
+        """Returns the indexes of the entries sharing at least one token with the normalized mention, sorted.
+
+        Tokens present in too many entries (see max_block_df) are ignored, unless all the tokens of the mention are
+        frequent, in which case only the rarest one is used. The block is empty if no token is in the index.
+        """
+
+        token_postings = [self.postings[token] for token in set(normalized_text.split()) if token in self.postings]
+
+        if len(token_postings) == 0:
+            return list()
+
+        block_postings = [postings for postings in token_postings if len(postings) <= self.max_postings]
+
+        if len(block_postings) == 0:
+            block_postings = [min(token_postings, key=len)]
+
+        block = set()
+
+        for postings in block_postings:
+            block.update(postings)
+
+        return sorted(block)
+
+
+
+def sorted_strings(strings):
+    """Returns the strings sorted by their UTF-8 bytes, the order searched by FrozenStrings.position"""
+
+    return sorted(strings, key=lambda string: string.encode("utf-8"))
+
+
+def string_sections(table_name, strings):
+    """Returns the sections of a string table (UTF-8 blob plus offsets) with given strings, in the same order"""
+
+    encoded_strings = [string.encode("utf-8") for string in strings]
+    string_offsets = array('Q', [0])
+
+    for string in encoded_strings:
+        string_offsets.append(string_offsets[-1] + len(string))
+
+    return [(table_name + ".offsets", string_offsets.tobytes()), (table_name + ".blob", b"".join(encoded_strings))]
+
+
+def postings_sections(table_name, postings, typecodes):
+    """Returns the sections of a list of postings in CSR format: offsets plus one concatenated array per column.
+
+    Args
+        table_name (str): prefix of the section names
+        postings (list): has format [(values of column 0, values of column 1, ...)]
+        typecodes (list): array typecode of each column
+    """
+
+    offsets = array('Q', [0])
+    columns = [array(typecode) for typecode in typecodes]
+
+    for posting in postings:
+
+        for column, values in zip(columns, posting):
+            column.extend(values)
+
+        offsets.append(len(columns[0]))
+
+    return [(table_name + ".offsets", offsets.tobytes())] + \
+                [(table_name + "." + str(i), column.tobytes()) for i, column in enumerate(columns)]
+
+
+def freeze_candidate_index(candidate_index, filepath):
+    """Writes a candidate index into an immutable file that pool workers memory-map with attach_candidate_index.
+
+    Strings are kept in UTF-8 tables and the dicts of the index become sorted string tables plus integer and float
+    arrays in CSR format, so the workers share the pages of the file instead of each holding a copy of the index.
+
+    Args
+        candidate_index (ChoiceTable, CandidateIndex or TokenBlockingIndex): the index to freeze
+        filepath (str): path of the output file
+    """
+
+    if isinstance(candidate_index, ChoiceTable):
+        lengths = sorted(candidate_index.length_groups.keys())
+        header = {"type": "ChoiceTable"}
+        sections = string_sections("names", candidate_index.names) + \
+                    string_sections("processed_names", candidate_index.processed_names) + \
+                    [("length_groups.lengths", array('I', lengths).tobytes())] + \
+                    postings_sections("length_groups", [(candidate_index.length_groups[length],) for length in lengths],
+                                        ['I'])
+
+    elif isinstance(candidate_index, CandidateIndex):
+        ngrams = sorted_strings(candidate_index.postings.keys())
+        header = {"type": "CandidateIndex", "shortlist_size": candidate_index.shortlist_size,
+                    "max_df": candidate_index.max_df, "max_postings": candidate_index.max_postings}
+        sections = string_sections("names", candidate_index.names) + string_sections("ngrams", ngrams) + \
+                    [("ngrams.idf", array('d', (candidate_index.idf[ngram] for ngram in ngrams)).tobytes())] + \
+                    postings_sections("postings", [candidate_index.postings[ngram] for ngram in ngrams], ['I', 'f'])
+
+    elif isinstance(candidate_index, TokenBlockingIndex):
+        normalized_texts = sorted_strings(candidate_index.exact_entries.keys())
+        tokens = sorted_strings(candidate_index.postings.keys())
+        header = {"type": "TokenBlockingIndex", "max_block_df": candidate_index.max_block_df,
+                    "max_postings": candidate_index.max_postings}
+        sections = string_sections("entries.texts", [entry[0] for entry in candidate_index.entries]) + \
+                    string_sections("entries.ids", [entry[1] for entry in candidate_index.entries]) + \
+                    string_sections("normalized_texts", normalized_texts) + \
+                    postings_sections("exact_entries", [(candidate_index.exact_entries[normalized_text],) \
+                                                            for normalized_text in normalized_texts], ['I']) + \
+                    string_sections("tokens", tokens) + \
+                    postings_sections("postings", [(candidate_index.postings[token],) for token in tokens], ['I'])
+
+    else:
+        raise TypeError("No frozen form for " + type(candidate_index).__name__)
+
+    write_section_file(filepath, CANDIDATE_INDEX_MAGIC, header, sections)
+
+
+def attach_candidate_index(filepath):
+    """Memory-maps the candidate index in filepath (written by freeze_candidate_index) and returns its frozen form"""
+
+    mapped_file = MappedSectionFile(filepath, CANDIDATE_INDEX_MAGIC)
+    frozen_classes = {"ChoiceTable": FrozenChoiceTable, "CandidateIndex": FrozenCandidateIndex,
+                        "TokenBlockingIndex": FrozenTokenBlockingIndex}
+
+    return frozen_classes[mapped_file.header["type"]](mapped_file)
+
+
+class FrozenStrings(Sequence):
+    """Read-only list of strings stored in a memory-mapped file (see string_sections), decoded when they are read"""
+
+    def __init__(self, mapped_file, table_name):
+        self.string_offsets = mapped_file.section(table_name + ".offsets").cast('Q')
+        self.string_blob = mapped_file.section(table_name + ".blob")
+
+    def __getitem__(self, index):
+        return str(self.string_blob[self.string_offsets[index]:self.string_offsets[index + 1]], "utf-8")
+
+    def __len__(self):
+        return len(self.string_offsets) - 1
+
+    def position(self, string):
+        """Returns the index of given string in the table (sorted with sorted_strings), None if it is not in the table"""
+
+        encoded_string = string.encode("utf-8")
+        low, high = 0, len(self)
+
+        while low < high:
+            middle = (low + high) // 2
+
+            if self.string_blob[self.string_offsets[middle]:self.string_offsets[middle + 1]].tobytes() < encoded_string:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low < len(self) and self.string_blob[self.string_offsets[low]:self.string_offsets[low + 1]] == encoded_string:
+            return low
+
+        return None
+
+
+class FrozenStringMap(Mapping):
+    """Read-only dict from the strings of a sorted FrozenStrings table to the items of one or more columns, or to their
+    slices between consecutive offsets (CSR). With several columns, values are tuples with one item/slice per column."""
+
+    def __init__(self, keys, columns, offsets=None):
+        self.keys_table = keys
+        self.columns = columns
+        self.offsets = offsets
+
+    def __getitem__(self, key):
+        position = self.keys_table.position(key)
+
+        if position is None:
+            raise KeyError(key)
+
+        if self.offsets is None:
+            values = tuple(column[position] for column in self.columns)
+
+        else:
+            begin, end = self.offsets[position], self.offsets[position + 1]
+            values = tuple(column[begin:end] for column in self.columns)
+
+        return values if len(values) > 1 else values[0]
+
+    def __contains__(self, key):
+        return self.keys_table.position(key) is not None
+
+    def __iter__(self):
+        return iter(self.keys_table)
+
+    def __len__(self):
+        return len(self.keys_table)
+
+
+class FrozenEntries(Sequence):
+    """Read-only list of (KB name or synonym, concept ID) entries of a frozen TokenBlockingIndex"""
+
+    def __init__(self, mapped_file):
+        self.texts = FrozenStrings(mapped_file, "entries.texts")
+        self.concept_ids = FrozenStrings(mapped_file, "entries.ids")
+
+    def __getitem__(self, index):
+        return (self.texts[index], self.concept_ids[index])
+
+    def __len__(self):
+        return len(self.texts)
+
+
+class FrozenChoiceTable(ChoiceTable):
+    """ChoiceTable memory-mapped from a file written by freeze_candidate_index, scored the same way.
+
+    The names and their processed forms are string tables and each length group is a slice of an array in the file.
+    Pickling only transfers the path of the file.
+    """
+
+    def __init__(self, mapped_file):
+        self.mapped_file = mapped_file
+        self.names = FrozenStrings(mapped_file, "names")
+        self.processed_names = FrozenStrings(mapped_file, "processed_names")
+        lengths = mapped_file.section("length_groups.lengths").cast('I')
+        offsets = mapped_file.section("length_groups.offsets").cast('Q')
+        name_indexes = mapped_file.section("length_groups.0").cast('I')
+        self.length_groups = {length: name_indexes[offsets[i]:offsets[i + 1]] for i, length in enumerate(lengths)}
+
+    def __reduce__(self):
+        return (attach_candidate_index, (self.mapped_file.filepath,))
+
+
+class FrozenCandidateIndex(CandidateIndex):
+    """CandidateIndex memory-mapped from a file written by freeze_candidate_index, searched the same way.
+
+    The n-grams are a sorted string table, their IDF and postings (name indexes and weights) are arrays in the file.
+    Pickling only transfers the path of the file.
+    """
+
+    def __init__(self, mapped_file):
+        self.mapped_file = mapped_file
+        self.names = FrozenStrings(mapped_file, "names")
+        self.shortlist_size = mapped_file.header["shortlist_size"]
+        self.max_df = mapped_file.header["max_df"]
+        self.max_postings = mapped_file.header["max_postings"]
+        ngrams = FrozenStrings(mapped_file, "ngrams")
+        self.idf = FrozenStringMap(ngrams, [mapped_file.section("ngrams.idf").cast('d')])
+        self.postings = FrozenStringMap(ngrams, [mapped_file.section("postings.0").cast('I'),
+                                                    mapped_file.section("postings.1").cast('f')],
+                                        mapped_file.section("postings.offsets").cast('Q'))
+
+    def __reduce__(self):
+        return (attach_candidate_index, (self.mapped_file.filepath,))
+
+
+class FrozenTokenBlockingIndex(TokenBlockingIndex):
+    """TokenBlockingIndex memory-mapped from a file written by freeze_candidate_index, searched the same way.
+
+    Pickling only transfers the path of the file.
+    """
+
+    def __init__(self, mapped_file):
+        self.mapped_file = mapped_file
+        self.entries = FrozenEntries(mapped_file)
+        self.max_block_df = mapped_file.header["max_block_df"]
+        self.max_postings = mapped_file.header["max_postings"]
+        self.exact_entries = FrozenStringMap(FrozenStrings(mapped_file, "normalized_texts"),
+                                                [mapped_file.section("exact_entries.0").cast('I')],
+                                                mapped_file.section("exact_entries.offsets").cast('Q'))
+        self.postings = FrozenStringMap(FrozenStrings(mapped_file, "tokens"),
+                                        [mapped_file.section("postings.0").cast('I')],
+                                        mapped_file.section("postings.offsets").cast('Q'))
+
+    def __reduce__(self):
+        return (attach_candidate_index, (self.mapped_file.filepath,))
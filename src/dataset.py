@@ -1,29 +1,43 @@
+import argparse
 import json
 import os
 import random
 import sys
+import tempfile
 import time
-from annotations import parse_annotations
+from annotations import PBDMS_pool, corpus_filepaths, iter_extra_annotations, iter_PBDMS_multi_annotations, load_kb, \
+    multi_KB_pool, parse_annotations, stream_annotations
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from kbs import KnowledgeBase
+from manifest import BuildManifest, code_version, input_checksum
+from profiling import enable_profiling, profiled, record_span, write_profile
+from statistics import CorpusStatistics, write_stats_sidecar
+from utils import ANNOTATION_FILE_EXTENSIONS, JSONL_INDEX_EXTENSION, atomic_filepath, write_jsonl
 
 sys.path.append("./")
 
 
+def split_doc_names(doc_names):
+    """Randomly split document names into train (80%), dev (10%), and test (10%) names"""
+
+    doc_names = list(doc_names)
+    shuffler = random.Random(100) #To ensure the shuffle always return the same result (allows reproducibility)
+    shuffler.shuffle(doc_names) # Same result as random.seed(100) + random.shuffle, but safe when splits run in threads
+        
+    split_1 = int(0.8 * len(doc_names))
+    split_2 = int(0.9 * len(doc_names))
+
+    return doc_names[:split_1], doc_names[split_1:split_2], doc_names[split_2:]
+
+
 def split_partition(annotations):
     """Randomly split annotations into train (80%), dev (10%), and test (10%) sets"""
 
     train_annotations = dict()
     dev_annotations = dict()
     test_annotations = dict()            
-    doc_names = list(annotations.keys()) 
-    random.seed(100) #To ensure the shuffle always return the same result (allows reproducibility)
-    random.shuffle(doc_names)
-        
-    split_1 = int(0.8 * len(doc_names))
-    split_2 = int(0.9 * len(doc_names))
-
-    train_doc_names = doc_names[:split_1]
-    dev_doc_names = doc_names[split_1:split_2]
-    test_doc_names = doc_names[split_2:]
+    train_doc_names, dev_doc_names, test_doc_names = split_doc_names(annotations.keys())
     
     for doc in train_doc_names:
         train_annotations[doc] = annotations[doc]
@@ -37,18 +51,43 @@ def split_partition(annotations):
     return train_annotations, dev_annotations, test_annotations
 
 
-def build_partition(annotations, partition, split):
+@profiled("dataset.build_partition")
+def build_partition(annotations, partition, split, output_format="json"):
     """Output given partition in .json files.
 
     Args:
         annotations (dict): has format {file_id: [(annotation_str, start_pos, end_pos, hp_id, direct_ancestor)]}
         partition (str): has value medic, ctd_anatomy, ctd_chemicals, chebi, go_bp or hp
         split(str): specifies the split of PBDMS dataset that was processed, has value "" for partitions without PBDMS docs
+        output_format (str): "json", "jsonl", "jsonl.gz" or "jsonl.zst" (see write_subset)
     
     Returns:
-        train.json, dev.json, and test.json files in the respective partition directory
+        train.json, dev.json, and test.json files in the respective partition directory, along with their statistics 
+        in stats.json (see statistics.py)
     """
+
+    partition_dir = partition_dirpath(partition, split)
+    train_annotations, dev_annotations, test_annotations = split_partition(annotations)
+    subset_annotations = {"train": train_annotations, "dev": dev_annotations, "test": test_annotations}
+    subset_stats = dict()
+    
+    for subset, out_dict in subset_annotations.items():
+        stats = CorpusStatistics()
+        filepath = write_subset(partition_dir, subset, stats.consume(out_dict.items()), output_format)
+        subset_stats[subset] = (filepath, stats)
+
+    write_stats_sidecar(partition_dir, subset_stats)
     
+    total_docs =  len(train_annotations.keys()) + len(dev_annotations.keys()) + len(test_annotations.keys())
+
+    print("-----------OUTPUT-----------\nPARTITION: ", partition, "\tSPLIT: ", str(split), \
+        "\nTOTAL DOCS: ", total_docs, "\nTRAIN: ", len(train_annotations.keys()), \
+        "| DEV: ", len(dev_annotations.keys()), "| TEST: ", len(test_annotations.keys()))
+
+
+def partition_dirpath(partition, split):
+    """Returns the output directory of given partition (and PBDMS split), creating it if needed"""
+
     if split != "":
         partition_dir = "./evanil/" + partition + "/split_" + split + "/"
     
@@ -57,51 +96,423 @@ def build_partition(annotations, partition, split):
 
     if not os.path.exists(partition_dir):
         os.makedirs(partition_dir)
+
+    return partition_dir
+
+
+def write_subset(partition_dir, subset, doc_annotations, output_format="json"):
+    """Writes a subset of a partition incrementally, one document at a time.
+
+    In "json" format, the file is identical to json.dumps(dict(doc_annotations), indent=4, ensure_ascii=False). The 
+    "jsonl" formats write one document per line, compressed with gzip or zstd in "jsonl.gz" and "jsonl.zst", plus an 
+    index with the byte offset of each document (see utils.write_jsonl).
+
+    Args:
+        partition_dir (str): output directory
+        subset (str): has value train, dev or test
+        doc_annotations (iterable): has format [(file_id, [(annotation_str, start_pos, end_pos, kb_id, direct_ancestor)])]
+        output_format (str): "json", "jsonl", "jsonl.gz" or "jsonl.zst"
+
+    Returns:
+        filepath (str): path of the written file
+    """
+
+    filepath = partition_dir + subset + "." + output_format
+    remove_stale_subset_files(partition_dir, subset, output_format)
+
+    if output_format != "json":
+        write_jsonl(filepath, doc_annotations)
+        return filepath
+
+    serialize_time, write_time = float(), float()
+
+    with atomic_filepath(filepath) as temp_path: # A partial file is never left behind if the build is interrupted
+
+        with open(temp_path, "w", encoding="utf-8") as out_file:
+            out_file.write("{")
+            docs_count = int()
+
+            for doc, annotations in doc_annotations:
+                begin_time = time.perf_counter()
+                # Each entry is written as json.dumps(..., indent=4) writes it inside the whole dict
+                doc_entry = json.dumps({doc: annotations}, indent=4, ensure_ascii=False)[2:-2]
+                serialized_time = time.perf_counter()
+                out_file.write(("\n" if docs_count == 0 else ",\n") + doc_entry)
+                serialize_time += serialized_time - begin_time
+                write_time += time.perf_counter() - serialized_time
+                docs_count += 1
+
+            out_file.write("\n}" if docs_count > 0 else "}")
+            closing_time = time.perf_counter()
+
+    record_span("output.serialize", serialize_time, items=docs_count)
+    record_span("output.write", write_time + time.perf_counter() - closing_time, items=docs_count)
+
+    return filepath
+
+
+def remove_stale_subset_files(partition_dir, subset, output_format):
+    """Removes the files of a subset written in other formats by previous builds, so they are not read instead of the 
+    new one (utils.subset_filepath returns the first format found)"""
+
+    for extension in ANNOTATION_FILE_EXTENSIONS:
+        filepath = partition_dir + subset + extension
+
+        if extension != "." + output_format:
+
+            for stale_filepath in [filepath, filepath + JSONL_INDEX_EXTENSION]:
+
+                if os.path.exists(stale_filepath):
+                    os.remove(stale_filepath)
+
+
+def spill_doc(spill_file, doc_offsets, doc_id, annotations):
+    """Appends the annotations of a document to the spill file and records their position in doc_offsets (dict).
+
+    A repeated doc keeps its first position and its last annotations, as in a dict.
+    """
+
+    doc_data = (json.dumps(annotations) + "\n").encode("utf-8")
+    doc_offsets[doc_id] = (spill_file.tell(), len(doc_data))
+    spill_file.write(doc_data)
+
+
+def iter_spilled_docs(spill_file, doc_offsets, doc_names):
+    """Yields (doc_id, annotations) for the given documents, reading their annotations back from the spill file"""
+
+    for doc in doc_names:
+        spill_file.seek(doc_offsets[doc][0])
+        
+        yield doc, json.loads(spill_file.read(doc_offsets[doc][1]).decode("utf-8"))
+
+
+def write_spilled_partition(spill_file, doc_offsets, partition, split, output_format="json"):
+    """Output the documents in the spill file (see spill_doc) in files identical to the ones of build_partition"""
+
+    partition_dir = partition_dirpath(partition, split)
+    train_doc_names, dev_doc_names, test_doc_names = split_doc_names(doc_offsets.keys())
+    subset_doc_names = {"train": train_doc_names, "dev": dev_doc_names, "test": test_doc_names}
+    subset_stats = dict()
+
+    for subset, doc_names in subset_doc_names.items():
+        stats = CorpusStatistics()
+        doc_annotations = stats.consume(iter_spilled_docs(spill_file, doc_offsets, doc_names))
+        subset_stats[subset] = (write_subset(partition_dir, subset, doc_annotations, output_format), stats)
+
+    write_stats_sidecar(partition_dir, subset_stats)
+
+    print("-----------OUTPUT-----------\nPARTITION: ", partition, "\tSPLIT: ", str(split), \
+        "\nTOTAL DOCS: ", len(doc_offsets), "\nTRAIN: ", len(train_doc_names), \
+        "| DEV: ", len(dev_doc_names), "| TEST: ", len(test_doc_names))
+
+
+def build_partition_stream(doc_annotations, partition, split, output_format="json"):
+    """Output given partition in .json files, consuming the annotations incrementally.
+
+    Annotations are spilled to a temporary file as they arrive, so that only the document names and their offsets in that
+    file are kept in memory. The output files are byte-identical to the ones written by build_partition.
+
+    Args:
+        doc_annotations (iterable): has format [(file_id, [(annotation_str, start_pos, end_pos, kb_id, direct_ancestor)])]
+        partition (str): has value medic, ctd_anatomy, ctd_chemicals, chebi, go_bp or hp
+        split(str): specifies the split of PBDMS dataset that was processed, has value "" for partitions without PBDMS docs
+        output_format (str): "json", "jsonl", "jsonl.gz" or "jsonl.zst" (see write_subset)
     
-    train_annotations, dev_annotations, test_annotations = split_partition(annotations)
-    subset_list = ["train", "dev", "test"]
+    Returns:
+        train.json, dev.json, and test.json files in the respective partition directory
+    """
+
+    doc_offsets = dict()
+
+    with tempfile.TemporaryFile() as spill_file:
+
+        for doc_id, annotations in doc_annotations:
+            spill_doc(spill_file, doc_offsets, doc_id, annotations)
+
+        write_spilled_partition(spill_file, doc_offsets, partition, split, output_format)
+
+
+def split_inputs(partition, split, output_format, version):
+    """Returns the inputs of a split of a partition, recorded in its manifest entry (see manifest.BuildManifest).
+
+    Args:
+        partition (str): has value medic, ctd_anatomy, ctd_chemicals, chebi, go_bp or hp
+        split(str): the split of PBDMS dataset, has value "" for partitions without PBDMS docs
+        output_format (str): "json", "jsonl", "jsonl.gz" or "jsonl.zst"
+        version (str): checksum of the code, see manifest.code_version
+
+    Returns:
+        inputs (dict): has keys "code_version", "output_format" and "files", with format {filepath: checksum} for the KB
+            file and the corpus files of the split
+    """
+
+    filepaths = [KnowledgeBase(partition).kb_filepath(partition)] + corpus_filepaths(partition, split)
+
+    return {"code_version": version, "output_format": output_format,
+            "files": {filepath: input_checksum(filepath) for filepath in filepaths}}
+
+
+def pending_splits(manifest, splits, inputs, force=False):
+    """Returns the splits (list) whose inputs or outputs changed since they were last built, all of them if 'force'"""
+
+    pending = [split for split in splits if force or not manifest.is_current(split, inputs[split])]
+    skipped = [split for split in splits if split not in pending]
+
+    if len(skipped) > 0:
+        print("Up to date ( " + manifest.partition + " ), skipping split(s):", ", ".join(skipped) if skipped != [""] \
+                else "the whole partition")
+
+    return pending
+
+
+@profiled("dataset.split")
+def build_PBDMS_split(partition, split, kb_data, pool, stream=False, max_in_flight=4096, output_format="json", 
+                        manifest=None, inputs=None, workers=10):
+    """Parses and outputs a split of a partition including PBDMS documents, returning its wall-clock runtime (s).
+    The split is recorded in the manifest (BuildManifest) once it is complete, along with its 'inputs' (dict).
+    'workers' (int) sets the size of the pools parsing the other corpora of the split (NCBI disease, BC5CDR)."""
+
+    begin_time = time.time()
+
+    if manifest is not None:
+        manifest.invalidate(split)
+
+    if stream:
+        doc_annotations = stream_annotations(partition, split, workers=workers, max_in_flight=max_in_flight, 
+                                                kb_data=kb_data, pool=pool)
+        build_partition_stream(doc_annotations, partition, split, output_format)
+
+    else:
+        annotations = parse_annotations(partition, split, workers=workers, kb_data=kb_data, pool=pool)
+        build_partition(annotations, partition, split, output_format)
+
+    if manifest is not None:
+        manifest.record(split, inputs, partition_dirpath(partition, split))
+
+    return time.time() - begin_time
+
+
+def build_PBDMS_partition(partition, splits, workers=10, concurrent_splits=1, stream=False, max_in_flight=4096, 
+                            output_format="json", force=False):
+    """Builds the given splits of a partition including PBDMS documents (medic, ctd_anatomy or ctd_chemicals).
+
+    The KB is loaded once and one pool of workers is kept warm for all the splits. Several splits can be processed 
+    concurrently, sharing the same pool: each split only keeps a few chunks of documents in its queue (see 
+    annotations.imap_bounded), so the pool parses the splits in turn. The other corpora of a split (NCBI disease, 
+    BC5CDR) are parsed by a separate pool of workers / concurrent_splits processes, running next to the shared pool. 
+    Splits whose inputs did not change since their last build are skipped (see manifest.BuildManifest).
+
+    Args:
+        partition (str): has value medic, ctd_anatomy or ctd_chemicals
+        splits (list): the splits of PBDMS dataset to process (str)
+        workers (int): number of processes parsing PBDMS documents, shared by all the splits
+        concurrent_splits (int): number of splits processed at the same time
+        stream (bool): "True" to parse splits lazily and write the output incrementally (see build_partition_stream)
+        max_in_flight (int): maximum number of PBDMS documents read and not yet written per split, in streaming mode
+        output_format (str): "json", "jsonl", "jsonl.gz" or "jsonl.zst" (see write_subset)
+        force (bool): "True" to build every split, even if it is up to date
+
+    Returns:
+        prints the runtime of each split, the KB loading time and the total runtime
+    """
+
+    begin_time = time.time()
+    manifest = BuildManifest(partition)
+    version = code_version()
+    inputs = {split: split_inputs(partition, split, output_format, version) for split in splits}
+    splits = pending_splits(manifest, splits, inputs, force=force)
+
+    if len(splits) == 0:
+        return
+
+    kb_begin_time = time.time() # After the checksums of the inputs, so only the KB loading is measured
+    kb_data = load_kb(partition)
+    kb_load_time = time.time() - kb_begin_time
+    split_times = dict()
+
+    split_workers = max(workers // concurrent_splits, 1) # Share of the workers for the other corpora of each split
+
+    with PBDMS_pool(kb_data, workers=workers) as pool:
+
+        with ThreadPoolExecutor(max_workers=concurrent_splits) as executor:
+            futures = {split: executor.submit(build_PBDMS_split, partition, split, kb_data, pool, stream, max_in_flight, 
+                                            output_format, manifest, inputs[split], split_workers) \
+                            for split in splits}
+
+            for split, future in futures.items():
+                split_times[split] = future.result()
+
+    print("---------------\nPARTITION: ", partition)
     
-    for subset in subset_list:
-        
-        if subset == "train":
-            out_dict = json.dumps(train_annotations, indent=4, ensure_ascii=False)
-        elif subset == "dev":
-            out_dict = json.dumps(dev_annotations, indent=4, ensure_ascii=False)
-        elif subset == "test":
-            out_dict = json.dumps(test_annotations, indent=4, ensure_ascii=False)
-
-        if not os.path.exists(partition_dir):
-            os.makedirs(partition_dir)
-
-        with open(partition_dir + subset + ".json", "w", encoding="utf-8") as out_file:
-            out_file.write(out_dict)
-            out_file.close()
+    for split in splits:
+        print("Runtime for split", split, ":", str(round(split_times[split], 3)), "s")
+
+    print("KB loading time:", str(round(kb_load_time, 3)), "s (loaded once instead of", str(len(splits)), "times)", \
+        "\nPBDMS runtime:", str(round(time.time() - begin_time, 3)), "s")
+
+
+@profiled("dataset.split")
+def build_PBDMS_multi_split(kbs_data, split, pool, max_in_flight=4096, output_format="json", manifests=None, 
+                                inputs=None, workers=10):
+    """Parses a PBDMS split once and outputs it for several partitions, returning its wall-clock runtime (s).
+    The split is recorded in the manifest of each partition, 'manifests' and 'inputs' have format {partition: ...}.
+    'workers' (int) sets the size of the pools parsing the other corpora of the split (NCBI disease, BC5CDR)."""
+
+    begin_time = time.time()
+    print("Parsing PBDMS ( split", split, ") for", ", ".join(kb_data.kb for kb_data in kbs_data), "...")
+
+    if manifests is not None:
+
+        for kb_data in kbs_data:
+            manifests[kb_data.kb].invalidate(split)
+
+    with ExitStack() as stack:
+        spill_files = [stack.enter_context(tempfile.TemporaryFile()) for kb_data in kbs_data]
+        doc_offsets = [dict() for kb_data in kbs_data]
+
+        for kb_annotations in iter_PBDMS_multi_annotations(kbs_data, split, pool, max_in_flight=max_in_flight):
+
+            for i, doc_annotations in enumerate(kb_annotations):
+                
+                if doc_annotations is not None:
+                    spill_doc(spill_files[i], doc_offsets[i], doc_annotations[0], doc_annotations[1])
+
+        for i, kb_data in enumerate(kbs_data):
+
+            for doc_id, annotations in iter_extra_annotations(kb_data, split, workers=workers):
+                spill_doc(spill_files[i], doc_offsets[i], doc_id, annotations)
+
+            write_spilled_partition(spill_files[i], doc_offsets[i], kb_data.kb, split, output_format)
+
+            if manifests is not None:
+                manifests[kb_data.kb].record(split, inputs[kb_data.kb], partition_dirpath(kb_data.kb, split))
+
+    return time.time() - begin_time
+
+
+def build_PBDMS_partitions(partitions, splits, workers=10, concurrent_splits=1, max_in_flight=4096, output_format="json", 
+                            force=False):
+    """Builds several partitions including PBDMS documents (medic, ctd_anatomy, ctd_chemicals) in a single pass over 
+    each split: the KBs are loaded together and each PBDMS document is decoded once for all the partitions. A split is
+    only built for the partitions where it is not up to date (see manifest.BuildManifest).
+
+    Args:
+        partitions (list): has values medic, ctd_anatomy and/or ctd_chemicals
+        splits (list): the splits of PBDMS dataset to process (str)
+        workers (int): number of processes parsing PBDMS documents, shared by all the splits (each split parses the 
+            other corpora with a separate pool of workers / concurrent_splits processes)
+        concurrent_splits (int): number of splits processed at the same time, the shared pool parses their documents in
+            turn (see annotations.imap_bounded)
+        max_in_flight (int): maximum number of PBDMS documents read and not yet written per split
+        output_format (str): "json", "jsonl", "jsonl.gz" or "jsonl.zst" (see write_subset)
+        force (bool): "True" to build every split, even if it is up to date
+
+    Returns:
+        train.json, dev.json, and test.json files in ./evanil/<partition>/split_<split>/ for each partition and split
+    """
+
+    begin_time = time.time()
+    manifests = {partition: BuildManifest(partition) for partition in partitions}
+    version = code_version()
+    inputs = {split: {partition: split_inputs(partition, split, output_format, version) for partition in partitions} \
+                for split in splits}
+    split_partitions = {split: list() for split in splits} # Partitions where each split is not up to date
+
+    for partition in partitions:
+        partition_inputs = {split: inputs[split][partition] for split in splits}
+
+        for split in pending_splits(manifests[partition], splits, partition_inputs, force=force):
+            split_partitions[split].append(partition)
+
+    splits = [split for split in splits if len(split_partitions[split]) > 0]
+    partitions = [partition for partition in partitions if any(partition in split_partitions[split] for split in splits)]
+
+    if len(splits) == 0:
+        return
+
+    kb_begin_time = time.time() # After the checksums of the inputs, so only the KB loading is measured
+    kbs_data = {partition: load_kb(partition) for partition in partitions}
+    kb_load_time = time.time() - kb_begin_time
+    split_times = dict()
+
+    split_workers = max(workers // concurrent_splits, 1) # Share of the workers for the other corpora of each split
+
+    with multi_KB_pool(list(kbs_data.values()), workers=workers) as pool:
+
+        with ThreadPoolExecutor(max_workers=concurrent_splits) as executor:
+            futures = {split: executor.submit(build_PBDMS_multi_split, 
+                                                [kbs_data[partition] for partition in split_partitions[split]], split, 
+                                                pool, max_in_flight, output_format, manifests, inputs[split], 
+                                                split_workers) \
+                            for split in splits}
+
+            for split, future in futures.items():
+                split_times[split] = future.result()
+
+    print("---------------\nPARTITIONS: ", ", ".join(partitions))
     
-    total_docs =  len(train_annotations.keys()) + len(dev_annotations.keys()) + len(test_annotations.keys())
+    for split in splits:
+        print("Runtime for split", split, ":", str(round(split_times[split], 3)), "s")
 
-    print("-----------OUTPUT-----------\nPARTITION: ", partition, "\tSPLIT: ", str(split), \
-        "\nTOTAL DOCS: ", total_docs, "\nTRAIN: ", len(train_annotations.keys()), \
-        "| DEV: ", len(dev_annotations.keys()), "| TEST: ", len(test_annotations.keys()))
+    print("KB loading time:", str(round(kb_load_time, 3)), "s", \
+        "\nPBDMS runtime:", str(round(time.time() - begin_time, 3)), "s")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a partition of EvaNIL dataset")
+    parser.add_argument("partition", nargs="+", help="medic, ctd_anatomy, ctd_chemicals, chebi, go_bp or hp; several \
+                        partitions including PBDMS documents (medic, ctd_anatomy, ctd_chemicals) are built in a single pass")
+    parser.add_argument("--workers", type=int, default=10, help="number of processes parsing PBDMS documents or CRAFT files")
+    parser.add_argument("--stream", action="store_true", 
+                        help="parse PBDMS splits lazily and write the output incrementally, with bounded memory")
+    parser.add_argument("--max-in-flight", type=int, default=4096, 
+                        help="maximum number of PBDMS documents read and not yet written, in streaming mode")
+    parser.add_argument("--concurrent-splits", type=int, default=1, 
+                        help="number of PBDMS splits processed at the same time, sharing the workers")
+    parser.add_argument("--splits", type=int, nargs="+", default=list(range(1, 30)), 
+                        help="PBDMS splits to process (all 29 by default)")
+    parser.add_argument("--format", default="json", choices=["json", "jsonl", "jsonl.gz", "jsonl.zst"], 
+                        help="output format: pretty-printed .json or one document per line, optionally compressed")
+    parser.add_argument("--force", action="store_true", help="rebuild the splits that are up to date in the manifest")
+    parser.add_argument("--profile", nargs="?", const=True, metavar="PATH", 
+                        help="write the timing and memory of each stage to a JSON report (./profiles/ by default)")
+    args = parser.parse_args()
     start_time = time.time()
-    partition = sys.argv[1] # medic, ctd_anatomy, ctd_chemicals, chebi, go_bp, hp
+
+    if args.profile:
+        enable_profiling()
     has_pbmds_files = ["medic", "ctd_anatomy", "ctd_chemicals"]
 
-    if partition not in has_pbmds_files:   
-        annotations = parse_annotations(partition, '')
-        build_partition(annotations, partition, '')
-    
-    else: #PBDMS dataset is too large, so it is processed sequentially in splits        
-        i = 1
+    partitions = args.partition # medic, ctd_anatomy, ctd_chemicals, chebi, go_bp, hp
+
+    if len(partitions) > 1:
 
-        while i <=29: #There are 29 splits in PBDMS dataset
-            annotations = parse_annotations(partition, str(i))
-            build_partition(annotations, partition, str(i))
-            i += 1
+        if not set(partitions).issubset(has_pbmds_files):
+            parser.error("only medic, ctd_anatomy and ctd_chemicals partitions can be built together")
+
+        build_PBDMS_partitions(partitions, [str(split) for split in args.splits], workers=args.workers, 
+                                concurrent_splits=args.concurrent_splits, max_in_flight=args.max_in_flight, 
+                                output_format=args.format, force=args.force)
+
+    elif partitions[0] not in has_pbmds_files:   
+        manifest = BuildManifest(partitions[0])
+        inputs = {'': split_inputs(partitions[0], '', args.format, code_version())}
+
+        if len(pending_splits(manifest, [''], inputs, force=args.force)) > 0:
+            manifest.invalidate('')
+            annotations = parse_annotations(partitions[0], '', workers=args.workers)
+            build_partition(annotations, partitions[0], '', output_format=args.format)
+            manifest.record('', inputs[''], partition_dirpath(partitions[0], ''))
+    
+    else: #PBDMS dataset is too large, so it is processed in splits (there are 29 splits in PBDMS dataset)
+        build_PBDMS_partition(partitions[0], [str(split) for split in args.splits], workers=args.workers, 
+                                concurrent_splits=args.concurrent_splits, stream=args.stream, 
+                                max_in_flight=args.max_in_flight, output_format=args.format, force=args.force)
     
     total_time = time.time() - start_time #total_min= round((end_time-start_time)/60, 2)
     print("---------------\nTotal Runtime:", str(round(total_time, 3)), "s")
 
+    if args.profile:
+        write_profile(None if args.profile is True else args.profile, script="dataset")
+
 
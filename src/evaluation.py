@@ -0,0 +1,159 @@
+import csv
+import sys
+from collections import Counter
+
+sys.path.append("./")
+
+
+class Evaluator:
+    """Streaming evaluation of the answers of a model over a partition.
+
+    Each answer is written to the .csv file and counted as soon as it is added, so the answers do not need to be
+    kept in memory. Besides the accuracy (the answer is the direct ancestor of the annotation), given the hierarchy
+    index of the KB, it counts the ancestor hits at depth k (the answer is the direct ancestor or one of its
+    ancestors at most k - 1 is_a relationships away) and the distance between the answer and the direct ancestor in
+    the hierarchy (shortest path through a common ancestor). The hierarchy metrics compare concepts, not ID strings: a
+    direct ancestor with the "MESH:" prefix (CTD partitions) is the concept of the answer without it.
+
+    Attributes
+    ----------
+        model (str): "baseline"
+        partition (str): has value "hp", "medic", "ctd_anatomy", "ctd_chemicals", "chebi", "go_bp" or "all"
+        hierarchy (HierarchyIndex): hierarchy index of the KB, None to only compute the accuracy
+        max_depth (int): ancestor hits are counted at depth 1 to max_depth
+        docs (set): IDs of the documents of the answers
+        annotations_count (int): number of answers
+        correct_answers_count (int): number of answers equal to the direct ancestor
+        ancestor_hits (list): number of answers that are the ancestor of the direct ancestor at distance j (at index j,
+            the direct ancestor itself being at distance 0)
+        distances (Counter): has format {distance between answer and direct ancestor: number of answers}
+        undefined_distances (int): number of answers without a common ancestor with the direct ancestor (or not in the
+            KB)
+
+    Methods
+    -------
+        __init__(self, model, partition, hierarchy=None, max_depth=3)
+        add(self, answer)
+        add_hierarchy_metrics(self, ancestor_id, top_candidate_id)
+        close(self)
+        summary(self)
+        report(self)
+    """
+
+    def __init__(self, model, partition, hierarchy=None, max_depth=3):
+        self.model = model
+        self.partition = partition
+        self.hierarchy = hierarchy
+        self.max_depth = max_depth
+        self.docs = set()
+        self.annotations_count = int()
+        self.correct_answers_count = int()
+        self.ancestor_hits = [0] * max_depth
+        self.distances = Counter()
+        self.undefined_distances = int()
+        self.out_file = open("./" + model + "_" + partition + "_answers.csv", "w", newline="")
+        self.out_writer = csv.writer(self.out_file, delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL)
+        self.out_writer.writerow(["doc", "text", "gold label", "direct ancestor", "answer", "classification"])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, answer):
+        """Writes and counts an answer, with format ((text, gold label, direct ancestor, doc), top_candidate_id)"""
+
+        annotation, top_candidate_id = answer
+        self.docs.add(annotation[3])
+        self.annotations_count += 1
+
+        if annotation[2] == top_candidate_id:
+            self.correct_answers_count += 1
+            classification = "1"
+
+        else:
+            classification = "0"
+
+        self.out_writer.writerow([annotation[3], annotation[0], annotation[1], annotation[2], top_candidate_id,
+                                    classification])
+
+        if self.hierarchy is not None:
+            self.add_hierarchy_metrics(annotation[2], top_candidate_id)
+
+    def add_hierarchy_metrics(self, ancestor_id, top_candidate_id):
+        """Counts the ancestor hit and the distance of an answer, with the hierarchy index of the KB"""
+
+        ancestor_code = self.hierarchy.code(ancestor_id)
+        top_candidate_code = self.hierarchy.code(top_candidate_id)
+
+        if ancestor_code is None or top_candidate_code is None:
+            self.undefined_distances += 1
+            return
+
+        ancestor_distance = self.hierarchy.ancestor_distance_codes(top_candidate_code, ancestor_code)
+
+        if ancestor_distance is not None and ancestor_distance < self.max_depth:
+            self.ancestor_hits[ancestor_distance] += 1
+
+        _, distance = self.hierarchy.common_ancestor_codes(ancestor_code, top_candidate_code)
+
+        if distance is None: # The answer and the direct ancestor do not have a common ancestor
+            self.undefined_distances += 1
+
+        else:
+            self.distances[distance] += 1
+
+    def close(self):
+        """Closes the .csv file of the answers"""
+
+        self.out_file.close()
+
+    def summary(self):
+        """Returns the metrics of the answers added so far.
+
+        Returns
+            summary (dict): has format {"docs": int, "annotations": int, "correct_answers": int, "accuracy": float},
+                with the hierarchy: {"ancestor_hits": {k: %}, "mean_distance": float, "distances": {distance: int},
+                "undefined_distances": int}
+        """
+
+        annotations_count = max(self.annotations_count, 1)
+        summary = {"docs": len(self.docs), "annotations": self.annotations_count,
+                    "correct_answers": self.correct_answers_count,
+                    "accuracy": (self.correct_answers_count/annotations_count)*100}
+
+        if self.hierarchy is not None:
+            defined_distances = sum(self.distances.values())
+            summary["ancestor_hits"] = {k: (sum(self.ancestor_hits[:k])/annotations_count)*100 \
+                                            for k in range(1, self.max_depth + 1)}
+            summary["mean_distance"] = sum(distance * count for distance, count in self.distances.items()) \
+                                        / defined_distances if defined_distances > 0 else None
+            summary["distances"] = dict(sorted(self.distances.items()))
+            summary["undefined_distances"] = self.undefined_distances
+
+        return summary
+
+    def report(self):
+        """Prints the statistics of the answers, as check_answers did, followed by the hierarchy metrics.
+
+        Returns
+            correct_answers_partition_count (int): correct answers in partition
+            annotations_partition_count (int): number of annotations in partition
+            docs_in_partition_count (int): number of documents in partition
+        """
+
+        summary = self.summary()
+        print("------------\nTotal docs (", self.partition , "):", str(summary["docs"]),  \
+            "\nTotal annotations (", self.partition, "):", str(summary["annotations"]), \
+            "\nCorrect answers:", str(summary["correct_answers"]), \
+            "\nAccuracy (", self.partition, "):", str(summary["accuracy"]))
+
+        if self.hierarchy is not None:
+            print("Ancestor hits (", self.partition, "):", ", ".join("@" + str(k) + " " + str(round(hits, 3)) + " %" \
+                                                                        for k, hits in summary["ancestor_hits"].items()), \
+                "\nMean distance to the direct ancestor (", self.partition, "):",
+                str(None if summary["mean_distance"] is None else round(summary["mean_distance"], 3)), \
+                "(" + str(summary["undefined_distances"]), "answers without a common ancestor or not in the KB )")
+
+        return summary["correct_answers"], summary["annotations"], summary["docs"]
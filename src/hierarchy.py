@@ -0,0 +1,349 @@
+import sys
+from array import array
+from bisect import bisect_left
+from collections import deque
+
+sys.path.append("./")
+
+NO_CONCEPT = -1 # Value of the primary parent of the roots
+
+
+def build_hierarchy_tables(parent_lists, concepts_count):
+    """Builds the tables of HierarchyIndex from the is_a relationships of a KB, with every direct ancestor of a concept.
+
+    The concepts are visited in topological order (parents first). A relationship that would close a cycle is ignored,
+    the concept where the cycle is entered being handled as if it did not have that parent.
+
+    Args
+        parent_lists (dict): has format {concept code: [codes of the direct ancestors]}
+        concepts_count (int): number of concepts (codes go from 0 to concepts_count - 1)
+
+    Returns
+        tables (dict): has format {"parent_offsets": array, "parent_codes": array, "child_offsets": array,
+            "child_codes": array, "depths": array, "primary_parents": array, "entries": array, "exits": array,
+            "ancestor_offsets": array, "ancestor_codes": array, "ancestor_distances": array}
+    """
+
+    parent_offsets, parent_codes = array('I', [0]), array('I')
+    children_count = [0] * concepts_count
+
+    for code in range(concepts_count):
+
+        for parent_code in dict.fromkeys(parent_lists.get(code, list())): # Without repeated parents, in order
+
+            if parent_code != code:
+                parent_codes.append(parent_code)
+                children_count[parent_code] += 1
+
+        parent_offsets.append(len(parent_codes))
+
+    child_offsets = array('I', [0])
+
+    for count in children_count:
+        child_offsets.append(child_offsets[-1] + count)
+
+    child_codes = array('I', [0]) * len(parent_codes)
+    next_child = array('I', child_offsets[:-1])
+
+    for code in range(concepts_count):
+
+        for parent_code in parent_codes[parent_offsets[code]:parent_offsets[code + 1]]:
+            child_codes[next_child[parent_code]] = code
+            next_child[parent_code] += 1
+
+    # Depth (shortest path to a root), primary parent (the one on that path) and ancestor closure, in topological order
+    pending_parents = array('I', (parent_offsets[code + 1] - parent_offsets[code] for code in range(concepts_count)))
+    visited = bytearray(concepts_count)
+    depths = array('i', [0]) * concepts_count
+    primary_parents = array('i', [NO_CONCEPT]) * concepts_count
+    closures = [None] * concepts_count # Has format [(sorted ancestor codes, distances)], by code
+    ready = deque(code for code in range(concepts_count) if pending_parents[code] == 0)
+    next_unvisited = 0
+
+    for _ in range(concepts_count):
+
+        if len(ready) == 0: # Only cycles remain: enter one at its smallest code
+
+            while visited[next_unvisited]:
+                next_unvisited += 1
+
+            ready.append(next_unvisited)
+
+        code = ready.popleft()
+        visited[code] = 1
+        ancestors = dict()
+
+        for parent_code in parent_codes[parent_offsets[code]:parent_offsets[code + 1]]:
+
+            if closures[parent_code] is None: # The parent is in a cycle that was entered here
+                continue
+
+            if primary_parents[code] == NO_CONCEPT or depths[parent_code] + 1 < depths[code]:
+                primary_parents[code], depths[code] = parent_code, depths[parent_code] + 1
+
+            ancestors[parent_code] = 1
+
+            for ancestor_code, distance in zip(*closures[parent_code]):
+
+                if ancestors.get(ancestor_code, distance + 2) > distance + 1:
+                    ancestors[ancestor_code] = distance + 1
+
+        ancestor_codes = sorted(ancestors.keys())
+        closures[code] = (array('I', ancestor_codes), array('H', (ancestors[ancestor_code] for ancestor_code in ancestor_codes)))
+
+        for child_code in child_codes[child_offsets[code]:child_offsets[code + 1]]:
+            pending_parents[child_code] -= 1
+
+            if pending_parents[child_code] == 0 and not visited[child_code]:
+                ready.append(child_code)
+
+    ancestor_offsets, ancestor_codes, ancestor_distances = array('I', [0]), array('I'), array('H')
+
+    for codes, distances in closures:
+        ancestor_codes.extend(codes)
+        ancestor_distances.extend(distances)
+        ancestor_offsets.append(len(ancestor_codes))
+
+    # Euler tour of the tree of primary parents: a concept is a tree ancestor of the concepts in [entry, exit]
+    primary_children = [list() for _ in range(concepts_count)]
+
+    for code, parent_code in enumerate(primary_parents):
+
+        if parent_code != NO_CONCEPT:
+            primary_children[parent_code].append(code)
+
+    entries, exits = array('I', [0]) * concepts_count, array('I', [0]) * concepts_count
+    tour_position = 0
+
+    for root_code in range(concepts_count):
+
+        if primary_parents[root_code] != NO_CONCEPT:
+            continue
+
+        stack = [(root_code, False)]
+
+        while len(stack) > 0:
+            code, finished = stack.pop()
+
+            if finished:
+                exits[code] = tour_position - 1
+                continue
+
+            entries[code] = tour_position
+            tour_position += 1
+            stack.append((code, True))
+            stack.extend((child_code, False) for child_code in reversed(primary_children[code]))
+
+    return {"parent_offsets": parent_offsets, "parent_codes": parent_codes, "child_offsets": child_offsets,
+            "child_codes": child_codes, "depths": depths, "primary_parents": primary_parents, "entries": entries,
+            "exits": exits, "ancestor_offsets": ancestor_offsets, "ancestor_codes": ancestor_codes,
+            "ancestor_distances": ancestor_distances}
+
+
+class HierarchyIndex:
+    """Index of the is_a hierarchy of a KB, including the concepts with several direct ancestors.
+
+    Built the first time KnowledgeBase.hierarchy is used and saved in a snapshot next to the one of the KB, from integer
+    arrays indexed by the concept codes of the KB:
+    - the direct ancestors and the children of each concept, in CSR format (offsets plus a flat array of codes)
+    - the depth of each concept (length of the shortest is_a path to a root) and its primary parent, the direct
+      ancestor on that path
+    - the entry and exit positions of each concept in an Euler tour of the tree of primary parents, so checking if a
+      concept is a tree ancestor of another is O(1)
+    - the ancestor closure of each concept (sorted codes plus the length of the shortest path to each ancestor), for the
+      ancestors outside the tree of primary parents and the lowest common ancestor of two concepts
+
+    Attributes
+    ----------
+        kb_data (KnowledgeBase): instance of the referred class representing a given knowledge base
+        (tables): the arrays returned by build_hierarchy_tables, as attributes with the same names
+
+    Methods
+    -------
+        __init__(self, kb_data, tables)
+        code(self, concept_id)
+        parents(self, concept_id)
+        children(self, concept_id)
+        depth(self, concept_id)
+        ancestors(self, concept_id)
+        ancestor_distance_codes(self, ancestor_code, code)
+        is_ancestor(self, ancestor_id, concept_id)
+        common_ancestor_codes(self, code_1, code_2)
+        lowest_common_ancestor(self, concept_id_1, concept_id_2)
+        distance(self, concept_id_1, concept_id_2)
+    """
+
+    def __init__(self, kb_data, tables):
+        self.kb_data = kb_data
+
+        for table_name, table in tables.items():
+            setattr(self, table_name, table)
+
+    def code(self, concept_id):
+        """Returns the code of given concept ID (str), None if the concept is not in the KB.
+
+        MeSH IDs with the "MESH:" prefix (as the direct ancestors of the CTD partitions) are looked up without it first:
+        the prefixed values of child_to_parent are interned as separate concepts, outside the hierarchy.
+        """
+
+        if concept_id is not None and concept_id.startswith("MESH:"):
+            code = self.kb_data.concept_code(concept_id[5:])
+
+            if code is not None:
+                return code
+
+        return self.kb_data.concept_code(concept_id)
+
+    def parents(self, concept_id):
+        """Returns the IDs of the direct ancestors of given concept, in the order of the KB file"""
+
+        code = self.code(concept_id)
+
+        if code is None:
+            return list()
+
+        return [self.kb_data.concept_ids[parent_code] for parent_code in \
+                    self.parent_codes[self.parent_offsets[code]:self.parent_offsets[code + 1]]]
+
+    def children(self, concept_id):
+        """Returns the IDs of the concepts that have given concept as a direct ancestor"""
+
+        code = self.code(concept_id)
+
+        if code is None:
+            return list()
+
+        return [self.kb_data.concept_ids[child_code] for child_code in \
+                    self.child_codes[self.child_offsets[code]:self.child_offsets[code + 1]]]
+
+    def depth(self, concept_id):
+        """Returns the length of the shortest is_a path from given concept to a root, None if it is not in the KB"""
+
+        code = self.code(concept_id)
+
+        return None if code is None else self.depths[code]
+
+    def ancestors(self, concept_id):
+        """Returns the ancestors of given concept, with format {ancestor ID: length of the shortest path to it}"""
+
+        code = self.code(concept_id)
+
+        if code is None:
+            return dict()
+
+        begin, end = self.ancestor_offsets[code], self.ancestor_offsets[code + 1]
+
+        return {self.kb_data.concept_ids[ancestor_code]: distance for ancestor_code, distance in \
+                    zip(self.ancestor_codes[begin:end], self.ancestor_distances[begin:end])}
+
+    def ancestor_distance_codes(self, ancestor_code, code):
+        """Returns the length of the shortest is_a path from a concept to an ancestor (0 if it is the same concept),
+        None if it is not an ancestor. O(1) for the ancestors in the tree of primary parents and for the concepts that
+        do not have other ancestors, a binary search in the closure otherwise."""
+
+        if self.entries[ancestor_code] <= self.entries[code] <= self.exits[ancestor_code]:
+            return self.depths[code] - self.depths[ancestor_code]
+
+        begin, end = self.ancestor_offsets[code], self.ancestor_offsets[code + 1]
+
+        if end - begin == self.depths[code]: # The closure is the path of primary parents
+            return None
+
+        position = bisect_left(self.ancestor_codes, ancestor_code, begin, end)
+
+        if position < end and self.ancestor_codes[position] == ancestor_code:
+            return self.ancestor_distances[position]
+
+        return None
+
+    def is_ancestor(self, ancestor_id, concept_id):
+        """Returns True if the first concept is an ancestor (direct or not) of the second one"""
+
+        ancestor_code, code = self.code(ancestor_id), self.code(concept_id)
+
+        if ancestor_code is None or code is None or ancestor_code == code:
+            return False
+
+        return self.ancestor_distance_codes(ancestor_code, code) is not None
+
+    def common_ancestor_codes(self, code_1, code_2):
+        """Returns the lowest common ancestor of two concepts (codes) and the length of the shortest path between them
+        through a common ancestor, (NO_CONCEPT, None) if they do not have a common ancestor.
+
+        A concept is a common ancestor of itself and its descendants. A lowest common ancestor is a common ancestor
+        without descendants that are also common ancestors; among several, the one on the shortest path between the
+        concepts and then the one with the smallest code.
+        """
+
+        if code_1 == code_2:
+            return code_1, 0
+
+        common_ancestors, lowest_code = list(), NO_CONCEPT # Has format [(distance, code)]
+
+        for ancestor_code, code in [(code_1, code_2), (code_2, code_1)]:
+            distance = self.ancestor_distance_codes(ancestor_code, code)
+
+            if distance is not None: # The other common ancestors are ancestors of this one
+
+                if self.ancestor_offsets[code + 1] - self.ancestor_offsets[code] == self.depths[code]:
+                    return ancestor_code, distance # Every path from the descendant goes through the ancestor
+
+                common_ancestors.append((distance, ancestor_code))
+                lowest_code = ancestor_code
+                break
+
+        position_1, end_1 = self.ancestor_offsets[code_1], self.ancestor_offsets[code_1 + 1]
+        position_2, end_2 = self.ancestor_offsets[code_2], self.ancestor_offsets[code_2 + 1]
+
+        while position_1 < end_1 and position_2 < end_2: # Merge of the two sorted closures
+            ancestor_code_1, ancestor_code_2 = self.ancestor_codes[position_1], self.ancestor_codes[position_2]
+
+            if ancestor_code_1 < ancestor_code_2:
+                position_1 += 1
+
+            elif ancestor_code_2 < ancestor_code_1:
+                position_2 += 1
+
+            else:
+                common_ancestors.append((self.ancestor_distances[position_1] + self.ancestor_distances[position_2],
+                                            ancestor_code_1))
+                position_1 += 1
+                position_2 += 1
+
+        if len(common_ancestors) == 0:
+            return NO_CONCEPT, None
+
+        common_ancestors.sort()
+
+        if lowest_code != NO_CONCEPT:
+            return lowest_code, common_ancestors[0][0]
+
+        for distance, ancestor_code in common_ancestors:
+
+            if not any(other_code != ancestor_code and self.ancestor_distance_codes(ancestor_code, other_code) is not None \
+                        for _, other_code in common_ancestors):
+                return ancestor_code, common_ancestors[0][0]
+
+    def lowest_common_ancestor(self, concept_id_1, concept_id_2):
+        """Returns the ID of the lowest common ancestor of two concepts (see common_ancestor_codes), None if they do
+        not have one or one of them is not in the KB"""
+
+        code_1, code_2 = self.code(concept_id_1), self.code(concept_id_2)
+
+        if code_1 is None or code_2 is None:
+            return None
+
+        code, _ = self.common_ancestor_codes(code_1, code_2)
+
+        return None if code == NO_CONCEPT else self.kb_data.concept_ids[code]
+
+    def distance(self, concept_id_1, concept_id_2):
+        """Returns the length of the shortest path between two concepts through a common ancestor, None if they do not
+        have one or one of them is not in the KB"""
+
+        code_1, code_2 = self.code(concept_id_1), self.code(concept_id_2)
+
+        if code_1 is None or code_2 is None:
+            return None
+
+        return self.common_ancestor_codes(code_1, code_2)[1]
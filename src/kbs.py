@@ -1,133 +1,875 @@
 import csv
-import obonet
+import glob
+import os
+import pickle
+import re
 import sys
+import tempfile
+import zlib
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+from contextlib import contextmanager
+from hierarchy import HierarchyIndex, build_hierarchy_tables
+from profiling import span
+from utils import MappedSectionFile, atomic_filepath, file_checksum, write_section_file
 
 sys.path.append("./")
 
+KB_CACHE_DIR = "./retrieved_data/kb_cache/"
+KB_CACHE_VERSION = 5 # Increase whenever the parsing rules change, so that existing snapshots are rebuilt
+
+# Same tag-value pattern used by obonet, so that both parsers extract the same values
+obo_tag_line_pattern = re.compile(
+    r"""^
+    (?P<tag>.+?):\s*
+    (?P<value>.*?)
+    (?:\s(?P<trailing_modifier>(?<!\\)\{[^{}]*\}))?
+    (?:\s(?P<comment>(?<!\\)![^\n]*))?
+    \s*$
+    """,
+    re.VERBOSE,
+)
+obo_single_tags = {"id", "name", "namespace", "is_obsolete"}
+obo_list_tags = {"is_a", "synonym", "xref"}
+
+FROZEN_KB_MAGIC = b"EVANILKB"
+FROZEN_KB_MAPS = ["name_to_id", "synonym_to_id", "child_to_parent", "umls_to_hp"]
+FROZEN_KB_FILTER_BITS = 16 # Bits per key of the membership filter of child_to_parent (about 1.5% of false positives)
+
+worker_kbs = dict() # Frozen KBs attached by the current worker process, has format {filepath: FrozenKnowledgeBase}
+
+
+def iter_obo_terms(filepath):
+    """Streams the [Term] stanzas of a .obo file in a single pass, without building the ontology graph.
+
+    Only the tags used to build the KB dicts are kept and obsolete terms are skipped, as in obonet.read_obo.
+
+    Args
+        filepath (str): path to the .obo file
+
+    Yields
+        term (dict): has format {"id": str, "name": str, "namespace": str, "is_a": [str], "synonym": [str], "xref": [str]},
+            each key being present only if the respective tag is in the stanza
+    """
+
+    with open(filepath, 'r', encoding="utf-8") as obo_file:
+        stanza_lines = list()
+
+        for line in obo_file:
+
+            if line.strip() != "":
+                stanza_lines.append(line)
+                continue
+
+            if len(stanza_lines) > 0:
+                term = parse_obo_stanza(stanza_lines)
+                stanza_lines = list()
+
+                if term is not None:
+                    yield term
+
+        if len(stanza_lines) > 0:
+            term = parse_obo_stanza(stanza_lines)
+
+            if term is not None:
+                yield term
+
+
+def parse_obo_stanza(stanza_lines):
+    """Returns the dict representation of a .obo stanza if it is a non-obsolete [Term], None otherwise"""
+
+    if not stanza_lines[0].startswith("[Term]"):
+        return None
+
+    term = dict()
+
+    for line in stanza_lines[1:]:
+        tag = line.split(":", 1)[0]
+
+        if line.startswith("!") or (tag not in obo_single_tags and tag not in obo_list_tags):
+            continue
+
+        match = obo_tag_line_pattern.match(line)
+
+        if match is None:
+            raise ValueError("Tag-value pair parsing failed for:\n" + line)
+
+        if tag in obo_single_tags:
+            term[tag] = match.group("value")
+        else:
+            term.setdefault(tag, []).append(match.group("value"))
+
+    if term.get("is_obsolete", "false") == "true" or "id" not in term:
+        return None
+
+    return term
+
+
+def iter_obo_graph_terms(filepath):
+    """Yields the terms of a .obo file from the networkx graph built by obonet (slower reference implementation)"""
+
+    import obonet
+
+    graph = obonet.read_obo(filepath)
+
+    for node in graph.nodes(data=True):
+        term = dict(node[1])
+        term["id"] = node[0]
+        yield term
+
+
+def parse_obo(filepath, kb, terms=None):
+    """Parses a .obo file (ChEBI, HPO, MEDIC, GO) into structured dicts.
+
+    Args
+        filepath (str): path to the .obo file
+        kb (str): selected ontology, has value "medic", "chebi", "go_bp" or "hp"
+        terms (iterable): terms of the ontology, streamed with iter_obo_terms(filepath) if None
+
+    Returns
+        kb_dicts (dict): has keys "name_to_id", "synonym_to_id", "child_to_parent", "child_to_parents" and "umls_to_hp"
+    """
+
+    name_to_id, synonym_to_id, child_to_parent, umls_to_hp = dict(), dict(), dict(), dict()
+    child_to_parents = dict() # Every direct ancestor, for the hierarchy index
+
+    if terms is None:
+        terms = iter_obo_terms(filepath)
+
+    for term in terms:
+        add_node = True
+
+        if "name" in term.keys():
+            node_id, node_name = term["id"], term["name"]
+
+            if kb == "go_bp": #For go_bp, ensure that only Biological Process concepts are considered
+
+                if term['namespace'] == 'biological_process':
+                    name_to_id[node_name] = node_id
+                else:
+                    add_node = False
+
+            else:
+
+                if kb == "medic":
+
+                    if node_id[0:4] != "OMIM": #exclude OMIM concepts
+                        name_to_id[node_name] = node_id
+
+                else:
+                    name_to_id[node_name] = node_id
+
+            if 'is_a' in term.keys() and add_node: # The root node of the ontology does not have is_a relationships
+
+                if len(term['is_a']) == 1: # Only consider concepts with ONE direct ancestor
+                    child_to_parent[node_id] = term['is_a'][0]
+
+                child_to_parents[node_id] = list(term['is_a'])
+
+            if "synonym" in term.keys() and add_node: # Check for synonyms for node (if they exist)
+
+                for synonym in term["synonym"]:
+                    synonym_name = synonym.split("\"")[1]
+                    synonym_to_id[synonym_name] = node_id
+
+            if "xref" in term.keys() and add_node:
+
+                if kb == "hp": #map UMLS concepts to HPO concepts
+
+                    for xref in term['xref']:
+                        if xref[:4] == "UMLS":
+                            umls_id = xref.strip("UMLS:")
+                            umls_to_hp[umls_id] =  node_id
+
+    return {"name_to_id": name_to_id, "synonym_to_id": synonym_to_id, "child_to_parent": child_to_parent,
+            "child_to_parents": child_to_parents, "umls_to_hp": umls_to_hp}
+
+
+def parse_tsv(filepath):
+    """Parses a .tsv file (CTD-Chemicals, CTD-Anatomy) into structured dicts.
+
+    Args
+        filepath (str): path to the .tsv file
+
+    Returns
+        kb_dicts (dict): has keys "name_to_id", "synonym_to_id", "child_to_parent", "child_to_parents" and "umls_to_hp"
+    """
+
+    name_to_id, synonym_to_id, child_to_parent, child_to_parents = dict(), dict(), dict(), dict()
+
+    with open(filepath) as kb_file:
+        reader = csv.reader(kb_file, delimiter="\t")
+        row_count = int()
+
+        for row in reader:
+            row_count += 1
+
+            if row_count >= 30:
+                node_name = row[0]
+                node_id = row[1][5:]
+                node_parents = row[4].split('|')
+                synonyms = row[7].split('|')
+                name_to_id[node_name] = node_id
+
+                if len(node_parents) == 1: ## Only consider concepts with ONE direct ancestor
+                    child_to_parent[node_id] = node_parents[0]
+
+                # Parent IDs keep the "MESH:" prefix that node_id drops, remove it so the hierarchy connects the concepts
+                child_to_parents[node_id] = [parent_id[5:] if parent_id.startswith("MESH:") else parent_id \
+                                                for parent_id in node_parents if parent_id != ""]
+
+                for synonym in synonyms:
+                    synonym_to_id[synonym] = node_id
+
+    return {"name_to_id": name_to_id, "synonym_to_id": synonym_to_id, "child_to_parent": child_to_parent,
+            "child_to_parents": child_to_parents, "umls_to_hp": dict()}
+
+
+def check_obo_parity(kb, filepath=None):
+    """Checks that the streaming parser and the obonet graph produce the same KB dicts for given ontology.
+
+    Args
+        kb (str): selected ontology, has value "medic", "chebi", "go_bp" or "hp" (selects the filtering rules)
+        filepath (str): path to the .obo file, the file of the KB in ./retrieved_data/kb_files/ if None
+
+    Returns
+        mismatches (list): names of the KB dicts that differ (in content or insertion order), empty if both parsers agree
+    """
+
+    if filepath is None:
+        filepath = KnowledgeBase(kb).kb_filepath(kb)
+
+    streamed_dicts = parse_obo(filepath, kb)
+    graph_dicts = parse_obo(filepath, kb, terms=iter_obo_graph_terms(filepath))
+    mismatches = list()
+
+    for dict_name in streamed_dicts.keys():
+
+        if list(streamed_dicts[dict_name].items()) != list(graph_dicts[dict_name].items()):
+            mismatches.append(dict_name)
+
+    print("Parity (", kb, "):", "OK" if len(mismatches) == 0 else "mismatch in " + ", ".join(mismatches))
+
+    return mismatches
+
+
+NO_PARENT = -1 # Value of KnowledgeBase.parents for the concepts without ONE direct ancestor
+
+
+def compact_kb_dicts(kb_dicts):
+    """Converts the KB dicts returned by parse_obo/parse_tsv into a compact representation with integer-coded concepts.
+
+    Every concept ID (keys and values of child_to_parent, values of the other dicts) is interned once and referred to by
+    its code, i.e. its index in concept_ids. The parent relation becomes an integer array indexed by the code of the child.
+    The IDs only found in child_to_parents are interned last, so the codes of the other concepts do not depend on it, and
+    child_to_parents is kept in CSR format (children, offsets of their parents, parents) to build the hierarchy index 
+    when it is first used (see KnowledgeBase.hierarchy).
+
+    Args
+        kb_dicts (dict): has keys "name_to_id", "synonym_to_id", "child_to_parent", "child_to_parents" (optional) and
+            "umls_to_hp"
+
+    Returns
+        compact_kb (dict): has format {"concept_ids": [str], "parents": array('i'), "name_to_id": ([name], array('I')),
+            "synonym_to_id": ([synonym], array('I')), "umls_to_hp": ([UMLS id], array('I')),
+            "child_to_parents": (array('I'), array('Q'), array('I'))}
+    """
+
+    concept_codes = dict()
+
+    def intern(concept_id):
+
+        if concept_id not in concept_codes:
+            concept_codes[concept_id] = len(concept_codes)
+
+        return concept_codes[concept_id]
+
+    compact_kb = {"name_to_id": (list(kb_dicts["name_to_id"].keys()),
+                                    array('I', (intern(node_id) for node_id in kb_dicts["name_to_id"].values())))}
+    child_to_parent = [(intern(child), intern(parent)) for child, parent in kb_dicts["child_to_parent"].items()]
+
+    for map_name in ["synonym_to_id", "umls_to_hp"]:
+        compact_kb[map_name] = (list(kb_dicts[map_name].keys()),
+                                array('I', (intern(node_id) for node_id in kb_dicts[map_name].values())))
+
+    children, parent_offsets, parent_codes = array('I'), array('Q', [0]), array('I')
+
+    for child, child_parents in kb_dicts.get("child_to_parents", dict()).items():
+        children.append(intern(child))
+        parent_codes.extend(intern(parent) for parent in child_parents)
+        parent_offsets.append(len(parent_codes))
+
+    parents = array('i', [NO_PARENT]) * len(concept_codes)
+
+    for child_code, parent_code in child_to_parent:
+        parents[child_code] = parent_code
+
+    compact_kb["concept_ids"] = list(concept_codes.keys())
+    compact_kb["parents"] = parents
+    compact_kb["child_to_parents"] = (children, parent_offsets, parent_codes)
+
+    return compact_kb
+
+
+class ConceptMap(Mapping):
+    """Read-only dict from strings (names, synonyms, UMLS IDs) to the concept IDs of a KnowledgeBase, stored as codes"""
+
+    def __init__(self, kb_data, codes):
+        self.concept_ids = kb_data.concept_ids
+        self.codes = codes
+
+    def __getitem__(self, key):
+        return self.concept_ids[self.codes[key]]
+
+    def __contains__(self, key):
+        return key in self.codes
+
+    def __iter__(self):
+        return iter(self.codes)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def code(self, key):
+        """Returns the code of the concept that key (str) maps to"""
+
+        return self.codes[key]
+
+
+class ParentMap(Mapping):
+    """Read-only dict from the concept IDs of a KnowledgeBase with ONE direct ancestor to that ancestor, stored as the 
+    integer array KnowledgeBase.parents. Iteration follows the concept codes."""
+
+    def __init__(self, kb_data):
+        self.concept_ids = kb_data.concept_ids
+        self.concept_codes = kb_data.concept_codes
+        self.parents = kb_data.parents
+        self.children_count = len(self.parents) - self.parents.count(NO_PARENT)
+
+    def __getitem__(self, node_id):
+        code = self.concept_codes.get(node_id)
+
+        if code is None or self.parents[code] == NO_PARENT:
+            raise KeyError(node_id)
+
+        return self.concept_ids[self.parents[code]]
+
+    def __contains__(self, node_id):
+        code = self.concept_codes.get(node_id)
+
+        return code is not None and self.parents[code] != NO_PARENT
+
+    def __iter__(self):
+        for code, parent_code in enumerate(self.parents):
+
+            if parent_code != NO_PARENT:
+                yield self.concept_ids[code]
+
+    def __len__(self):
+        return self.children_count
+
+
 class KnowledgeBase:
     """Class representing a knowledge base.
-    
+
+    Each instance keeps its own compact representation of the KB, so several KBs can be loaded in the same process.
+    Concept IDs are interned to integer codes: name_to_id, synonym_to_id and umls_to_hp map strings to codes and the 
+    direct ancestor of each concept is stored in an integer array. The dicts are exposed as read-only mappings that are 
+    still looked up (and return values) by the original string IDs.
+
     Attributes
     ----------
-        kb (str): the knowledge base to represent, including "hp", "medic", "ctd_anatomy", "ctd_chemicals", "chebi", "go_bp" 
-    
+        kb (str): the knowledge base to represent, including "hp", "medic", "ctd_anatomy", "ctd_chemicals", "chebi", "go_bp"
+        use_cache (bool): "True" to load the KB from (and save it to) the compiled snapshot in KB_CACHE_DIR
+        concept_ids (list): the concept IDs of the KB, the code of a concept is its index in this list
+        concept_codes (dict): has format {concept ID: code}
+        parents (array): code of the direct ancestor of each concept, NO_PARENT if it does not have ONE direct ancestor
+        name_to_id, synonym_to_id, umls_to_hp (ConceptMap): has format {name/synonym/UMLS ID: concept ID}
+        child_to_parent (ParentMap): has format {concept ID: direct ancestor ID}
+        hierarchy (HierarchyIndex): every is_a relationship of the KB, including the concepts with several direct
+            ancestors, with depths, ancestor closures and lowest common ancestors; built the first time it is used and 
+            saved in a snapshot of its own, so the runs that do not use it do not pay for it
+
     Methods
     -------
-        __init__(self, kb)
+        __init__(self, kb, use_cache=True)
         load_obo(self, kb)
         load_tsv(self, kb)
+        kb_filepath(self, kb)
+        set_compact_kb(self, compact_kb)
+        concept_code(self, concept_id)
+        parent_code(self, code)
+        load_cache(self, kb, filepath)
+        save_cache(self, kb, filepath, compact_kb)
+        load_hierarchy_tables(self)
     """
 
-    global name_to_id, synonym_to_id, child_to_parent, umls_to_hp
-    name_to_id, synonym_to_id, child_to_parent, umls_to_hp = dict(), dict(), dict(), dict()
-
-    def __init__(self, kb):
+    def __init__(self, kb, use_cache=True):
         self.kb = kb
-    
+        self.use_cache = use_cache
+        self.cache_path = None # Path of the snapshot of the loaded KB file, see load_cache
+        self.set_compact_kb(compact_kb_dicts({map_name: dict() for map_name in FROZEN_KB_MAPS}))
+
     def load_obo(self, kb):
         """Loads KBs from .obo files (ChEBI, HPO, MEDIC, GO) into structured dicts.
-        
-        Args 
+
+        Args
             kb (str): selected ontology to load, has value "medic", "chebi", "go_bp" or "hp"
 
         Returns
             name_to_id (dict):
-            synonym_to_id (dict): 
+            synonym_to_id (dict):
             child_to_parent (dict):
             umls_to_hp (dict): has format {"UMLS id": "HPO id"}
         """
         print("---------------------\nLoading", kb, "...")
-        corpus_dir = "./retrieved_data/kb_files/"
-        filepaths = {"medic": "CTD_diseases", "chebi": "chebi_lite", "go_bp": "go-basic"}
-        
-        if kb in filepaths.keys():
-            filepath = "./retrieved_data/kb_files/" + filepaths[kb] + ".obo"    
-        else:
-            filepath = "./retrieved_data/kb_files/" + kb + '.obo'
-        
-        graph = obonet.read_obo(filepath)
-        
-        for node in  graph.nodes(data=True):
-            add_node = True
-            
-            if "name" in node[1].keys():
-                node_id, node_name = node[0], node[1]["name"]
-
-                if kb == "go_bp": #For go_bp, ensure that only Biological Process concepts are considered
-                    
-                    if node[1]['namespace'] == 'biological_process':
-                        name_to_id[node_name] = node_id
-                    else:
-                        add_node = False
-                
-                else:
+        filepath = self.kb_filepath(kb)
 
-                    if kb == "medic":
+        with span("kb.load." + kb) as record:
+            compact_kb = self.load_cache(kb, filepath)
 
-                        if node_id[0:4] != "OMIM": #exclude OMIM concepts
-                            name_to_id[node_name] = node_id
-                    
-                    else:
-                        name_to_id[node_name] = node_id
+            if compact_kb is None:
+                compact_kb = compact_kb_dicts(parse_obo(filepath, kb))
+                self.save_cache(kb, filepath, compact_kb)
+
+            self.set_compact_kb(compact_kb)
+            record["items"] = len(self.concept_ids)
 
-                if 'is_a' in node[1].keys() and add_node: # The root node of the ontology does not have is_a relationships
+        print("...", kb, "loaded!")
 
-                    if len(node[1]['is_a']) == 1: # Only consider concepts with ONE direct ancestor
-                        child_to_parent[node_id] = node[1]['is_a'][0]
-                
-                if "synonym" in node[1].keys() and add_node: # Check for synonyms for node (if they exist)
-                        
-                    for synonym in node[1]["synonym"]:
-                        synonym_name = synonym.split("\"")[1]
-                        synonym_to_id[synonym_name] = node_id
+    def load_tsv(self, kb):
+        """Loads KBs from .tsv files (CTD-Chemicals, CTD-Anatomy) into structured dicts"""
+
+        print("---------------------\nLoading", kb, "...")
+        filepath = self.kb_filepath(kb)
 
-                if "xref" in node[1].keys() and add_node:
+        with span("kb.load." + kb) as record:
+            compact_kb = self.load_cache(kb, filepath)
 
-                    if kb == "hp": #map UMLS concepts to HPO concepts
-                        umls_xrefs = list()
+            if compact_kb is None:
+                compact_kb = compact_kb_dicts(parse_tsv(filepath))
+                self.save_cache(kb, filepath, compact_kb)
 
-                        for xref in node[1]['xref']:
-                            if xref[:4] == "UMLS":
-                                umls_id = xref.strip("UMLS:")
-                                umls_to_hp[umls_id] =  node_id 
+            self.set_compact_kb(compact_kb)
+            record["items"] = len(self.concept_ids)
 
-        self.name_to_id = name_to_id
-        self.synonym_to_id = synonym_to_id
-        self.child_to_parent = child_to_parent
-        self.umls_to_hp = umls_to_hp
         print("...", kb, "loaded!")
 
-    def load_tsv(self, kb):
-        """Loads KBs from .tsv files (CTD-Chemicals, CTD-Anatomy) into structured dicts"""
+    def kb_filepath(self, kb):
+        """Returns the path of the .obo/.tsv file of given KB in ./retrieved_data/kb_files/"""
 
-        print("---------------------\nLoading", kb, "...")
+        filepaths = {"medic": "CTD_diseases", "chebi": "chebi_lite", "go_bp": "go-basic"}
         kb_dict = {"ctd_chemicals": "CTD_chemicals", "ctd_anatomy": "CTD_anatomy"}
-        filepath = "./retrieved_data/kb_files/" + kb_dict[kb] + ".tsv"
-        
-        with open(filepath) as kb_file:
-            reader = csv.reader(kb_file, delimiter="\t")
-            row_count = int()
-        
-            for row in reader:
-                row_count += 1
-                
-                if row_count >= 30:
-                    node_name = row[0] 
-                    node_id = row[1][5:]
-                    node_parents = row[4].split('|')
-                    synonyms = row[7].split('|')
-                    name_to_id[node_name] = node_id
-                    
-                    if len(node_parents) == 1: ## Only consider concepts with ONE direct ancestor
-                        child_to_parent[node_id] = node_parents[0]
-                    
-                    for synonym in synonyms:
-                        synonym_to_id[synonym] = node_id
-        
-        self.name_to_id = name_to_id
-        self.synonym_to_id = synonym_to_id
-        self.child_to_parent = child_to_parent
-        print("...", kb, "loaded!")
-      
+
+        if kb in kb_dict.keys():
+            return "./retrieved_data/kb_files/" + kb_dict[kb] + ".tsv"
+
+        elif kb in filepaths.keys():
+            return "./retrieved_data/kb_files/" + filepaths[kb] + ".obo"
+
+        else:
+            return "./retrieved_data/kb_files/" + kb + '.obo'
+
+    def set_compact_kb(self, compact_kb):
+        """Sets the concepts and the dicts of the instance from a compact KB built by compact_kb_dicts"""
+
+        self.concept_ids = compact_kb["concept_ids"]
+        self.parents = compact_kb["parents"]
+        codes = list(range(len(self.concept_ids))) # The dicts share these int objects instead of holding one per entry
+        self.concept_codes = dict(zip(self.concept_ids, codes))
+
+        for map_name in ["name_to_id", "synonym_to_id", "umls_to_hp"]:
+            keys, key_codes = compact_kb[map_name]
+            setattr(self, map_name, ConceptMap(self, dict(zip(keys, (codes[code] for code in key_codes)))))
+
+        self.child_to_parent = ParentMap(self)
+        self.child_to_parents = compact_kb["child_to_parents"]
+        self.hierarchy_index = None
+
+    @property
+    def hierarchy(self):
+        """The HierarchyIndex of the KB, built (or loaded from its snapshot) the first time it is used"""
+
+        if self.hierarchy_index is None:
+            self.hierarchy_index = HierarchyIndex(self, self.load_hierarchy_tables())
+
+        return self.hierarchy_index
+
+    def load_hierarchy_tables(self):
+        """Returns the tables of the hierarchy index (see build_hierarchy_tables), from the snapshot next to the one of
+        the KB if there is one, otherwise built from child_to_parents and saved in that snapshot"""
+
+        hierarchy_path = None if self.cache_path is None else self.cache_path[:-len(".pkl")] + ".hierarchy.pkl"
+        tables = None if hierarchy_path is None else read_snapshot(hierarchy_path)
+
+        if tables is not None:
+            return tables
+
+        with span("kb.hierarchy." + self.kb):
+            children, parent_offsets, parent_codes = self.child_to_parents
+            parent_lists = {child_code: parent_codes[parent_offsets[i]:parent_offsets[i + 1]] \
+                                for i, child_code in enumerate(children)}
+            tables = build_hierarchy_tables(parent_lists, len(self.concept_ids))
+
+        if hierarchy_path is not None:
+            write_snapshot(hierarchy_path, tables, self.kb)
+
+        return tables
+
+    def concept_code(self, concept_id):
+        """Returns the code of given concept ID (str), None if the concept is not in the KB"""
+
+        return self.concept_codes.get(concept_id)
+
+    def parent_code(self, code):
+        """Returns the code of the direct ancestor of the concept with given code, None if it does not have ONE"""
+
+        parent_code = self.parents[code]
+
+        return None if parent_code == NO_PARENT else parent_code
+
+    def cache_paths(self, kb, filepath):
+        """Returns the snapshot path for the current contents of the KB file and the path of its checksum stamp"""
+
+        stamp_path = KB_CACHE_DIR + kb + ".stamp.json"
+        checksum = file_checksum(filepath, stamp_path=stamp_path)
+        cache_path = KB_CACHE_DIR + kb + "." + checksum + ".v" + str(KB_CACHE_VERSION) + ".pkl"
+
+        return cache_path, stamp_path
+
+    def load_cache(self, kb, filepath):
+        """Loads the compiled snapshot of the KB if it matches the checksum of the KB file.
+
+        Args
+            kb (str): the knowledge base to load
+            filepath (str): path to the .obo/.tsv file of the KB
+
+        Returns
+            compact_kb (dict): compact representation of the KB (see compact_kb_dicts), None if there is no valid snapshot
+        """
+
+        if not self.use_cache:
+            return None
+
+        if not os.path.exists(KB_CACHE_DIR):
+            os.makedirs(KB_CACHE_DIR)
+
+        self.cache_path, _ = self.cache_paths(kb, filepath)
+        compact_kb = read_snapshot(self.cache_path)
+
+        if compact_kb is not None:
+            print("... using compiled snapshot", self.cache_path)
+
+        return compact_kb
+
+    def save_cache(self, kb, filepath, compact_kb):
+        """Saves the compiled snapshot of the KB, replacing the snapshots (and hierarchy snapshots) of previous versions
+        of the KB file (see write_snapshot)"""
+
+        if not self.use_cache:
+            return
+
+        try:
+            cache_path, _ = self.cache_paths(kb, filepath)
+
+        except OSError as error:
+            print("... could not save the compiled snapshot of", kb, ":", error, file=sys.stderr)
+            return
+
+        if not write_snapshot(cache_path, compact_kb, kb):
+            return
+
+        for old_cache_path in glob.glob(KB_CACHE_DIR + kb + ".*.pkl"):
+
+            if not old_cache_path.startswith(cache_path[:-len(".pkl")] + "."): # Snapshots of the current file are kept
+
+                try:
+                    os.remove(old_cache_path)
+
+                except FileNotFoundError: # Already removed by another process
+                    pass
+
+
+def read_snapshot(filepath):
+    """Returns the object pickled in a snapshot of KB_CACHE_DIR, None if there is no such snapshot"""
+
+    try:
+
+        with open(filepath, 'rb') as cache_file:
+            return pickle.load(cache_file)
+
+    except FileNotFoundError: # No snapshot yet, or it was replaced by another process while opening it
+        return None
+
+
+def write_snapshot(filepath, data, kb):
+    """Pickles data into a snapshot of KB_CACHE_DIR, returning False if it could not be saved.
+
+    Several processes can load the same KB at once: each one writes its own temporary file (see 
+    utils.atomic_filepath), so a snapshot is never published partially written. A snapshot is only an optimization, 
+    so an error while saving it is reported and the KB is used anyway.
+    """
+
+    try:
+
+        with atomic_filepath(filepath) as temp_path:
+
+            with open(temp_path, 'wb') as cache_file:
+                pickle.dump(data, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+        return True
+
+    except OSError as error:
+        print("... could not save the compiled snapshot of", kb, ":", error, file=sys.stderr)
+        return False
+
+
+def freeze_kb(kb_data, filepath):
+    """Compiles the dicts of a KB into an immutable file that processes can memory-map with FrozenKnowledgeBase.
+
+    The file includes a sorted table with every string of the KB (UTF-8 blob plus offsets) and, for each dict, 
+    integer arrays with the string indexes of the keys (sorted), of the respective values and the insertion order of the keys.
+    A membership filter over the keys of child_to_parent lets workers reject MeSH IDs without searching the string table.
+
+    Args
+        kb_data (KnowledgeBase): instance of the referred class representing a given knowledge base
+        filepath (str): path of the output file
+    """
+
+    kb_maps = {map_name: getattr(kb_data, map_name, dict()) for map_name in FROZEN_KB_MAPS}
+    strings = set()
+
+    for kb_map in kb_maps.values():
+        strings.update(kb_map.keys())
+        strings.update(kb_map.values())
+
+    encoded_strings = sorted(string.encode("utf-8") for string in strings) # UTF-8 byte order == code point order
+    string_index = {string.decode("utf-8"): i for i, string in enumerate(encoded_strings)}
+    string_offsets = array('Q', [0])
+
+    for string in encoded_strings:
+        string_offsets.append(string_offsets[-1] + len(string))
+
+    sections = [("string_offsets", string_offsets.tobytes()), ("string_blob", b"".join(encoded_strings))]
+
+    for map_name, kb_map in kb_maps.items():
+        key_indexes = array('I', (string_index[key] for key in kb_map.keys()))
+        sorted_positions = sorted(range(len(key_indexes)), key=key_indexes.__getitem__)
+        insertion_order = array('I', [0] * len(key_indexes))
+
+        for sorted_position, position in enumerate(sorted_positions):
+            insertion_order[position] = sorted_position
+
+        values = list(kb_map.values())
+        sections.append((map_name + ".keys", array('I', (key_indexes[i] for i in sorted_positions)).tobytes()))
+        sections.append((map_name + ".values", array('I', (string_index[values[i]] for i in sorted_positions)).tobytes()))
+        sections.append((map_name + ".order", insertion_order.tobytes()))
+
+    sections.append(("child_to_parent.filter", build_membership_filter(kb_maps["child_to_parent"].keys())))
+    write_section_file(filepath, FROZEN_KB_MAGIC, {"kb": kb_data.kb}, sections)
+
+
+def membership_filter_bits(key, bits_count):
+    """Returns the two bits of the membership filter that represent given key (str), stable across processes"""
+
+    key_bytes = key.encode("utf-8")
+
+    return zlib.crc32(key_bytes) % bits_count, zlib.crc32(key_bytes, 0x9E3779B9) % bits_count
+
+
+def build_membership_filter(keys):
+    """Builds a Bloom filter (bytes) over the keys, answering membership queries without false negatives"""
+
+    bits_count = max(len(keys) * FROZEN_KB_FILTER_BITS, 64)
+    bits_count += -bits_count % 64
+    membership_filter = bytearray(bits_count // 8)
+
+    for key in keys:
+
+        for bit in membership_filter_bits(key, bits_count):
+            membership_filter[bit >> 3] |= 1 << (bit & 7)
+
+    return bytes(membership_filter)
+
+
+@contextmanager
+def frozen_kb_file(kb_data):
+    """Yields the path of a frozen version of the KB, removing it at exit if it was created here.
+
+    Args
+        kb_data (KnowledgeBase or FrozenKnowledgeBase): the KB to freeze (a FrozenKnowledgeBase is used as it is)
+    """
+
+    if isinstance(kb_data, FrozenKnowledgeBase):
+        yield kb_data.filepath
+        return
+
+    file_descriptor, filepath = tempfile.mkstemp(prefix=kb_data.kb + ".", suffix=".kbf")
+    os.close(file_descriptor)
+
+    try:
+        freeze_kb(kb_data, filepath)
+        yield filepath
+
+    finally:
+        os.remove(filepath)
+
+
+def attach_frozen_kb(filepath):
+    """Memory-maps the frozen KB in filepath, once per process, and returns it"""
+
+    if filepath not in worker_kbs.keys():
+        worker_kbs[filepath] = FrozenKnowledgeBase(filepath)
+
+    return worker_kbs[filepath]
+
+
+def detach_frozen_kb(filepath):
+    """Releases the frozen KB in filepath attached by the current process, if any (the file is unmapped once it is no
+    longer referenced)"""
+
+    worker_kbs.pop(filepath, None)
+
+
+def init_worker_kbs(filepaths):
+    """Initializer of multiprocessing.Pool workers: attaches the frozen KBs, that are then shared by all the tasks"""
+
+    for filepath in filepaths:
+        attach_frozen_kb(filepath)
+
+
+def get_worker_kb(kb=None):
+    """Returns the frozen KB attached by the current worker process (the one representing given kb, if there are several)"""
+
+    for kb_data in worker_kbs.values():
+
+        if kb is None or kb_data.kb == kb:
+            return kb_data
+
+    raise KeyError("No frozen KB attached for " + str(kb))
+
+
+class FrozenMap(Mapping):
+    """Read-only dict stored in a FrozenKnowledgeBase. Iteration follows the insertion order of the original dict."""
+
+    def __init__(self, frozen_kb, map_name):
+        self.frozen_kb = frozen_kb
+        self.keys_column = frozen_kb.section(map_name + ".keys").cast('I')
+        self.values_column = frozen_kb.section(map_name + ".values").cast('I')
+        self.order_column = frozen_kb.section(map_name + ".order").cast('I')
+
+    def position(self, key):
+        """Returns the position of key in the sorted keys column, None if the key is not in the dict"""
+
+        string_index = self.frozen_kb.string_index(key)
+
+        if string_index is None:
+            return None
+
+        position = bisect_left(self.keys_column, string_index)
+
+        if position < len(self.keys_column) and self.keys_column[position] == string_index:
+            return position
+
+        return None
+
+    def __getitem__(self, key):
+        position = self.position(key)
+
+        if position is None:
+            raise KeyError(key)
+
+        return self.frozen_kb.string(self.values_column[position])
+
+    def __contains__(self, key):
+        return self.position(key) is not None
+
+    def __iter__(self):
+        for position in self.order_column:
+            yield self.frozen_kb.string(self.keys_column[position])
+
+    def __len__(self):
+        return len(self.keys_column)
+
+
+class FrozenKnowledgeBase:
+    """Read-only knowledge base memory-mapped from a file written by freeze_kb.
+
+    The pages of the file are shared by every process that maps it, so the KB is not copied to each worker.
+    Pickling only transfers the path of the file.
+
+    Attributes
+    ----------
+        filepath (str): path of the frozen KB file
+        kb (str): the knowledge base represented, including "hp", "medic", "ctd_anatomy", "ctd_chemicals", "chebi", "go_bp"
+        name_to_id, synonym_to_id, child_to_parent, umls_to_hp (FrozenMap): read-only versions of the KB dicts
+
+    Methods
+    -------
+        __init__(self, filepath)
+        section(self, section_name)
+        string(self, index)
+        string_index(self, string)
+        may_have_parent(self, node_id)
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.mapped_file = MappedSectionFile(filepath, FROZEN_KB_MAGIC)
+        self.kb = self.mapped_file.header["kb"]
+        self.string_offsets = self.section("string_offsets").cast('Q')
+        self.string_blob = self.section("string_blob")
+
+        for map_name in FROZEN_KB_MAPS:
+            setattr(self, map_name, FrozenMap(self, map_name))
+
+        self.child_filter = self.section("child_to_parent.filter")
+        self.child_filter_bits = len(self.child_filter) * 8
+
+    def __reduce__(self):
+        return (FrozenKnowledgeBase, (self.filepath,))
+
+    def section(self, section_name):
+        """Returns a zero-copy view of given section of the file"""
+
+        return self.mapped_file.section(section_name)
+
+    def string(self, index):
+        """Returns the string with given index in the string table"""
+
+        return str(self.string_blob[self.string_offsets[index]:self.string_offsets[index + 1]], "utf-8")
+
+    def string_index(self, string):
+        """Returns the index of given string in the (sorted) string table, None if it is not in the table"""
+
+        encoded_string = string.encode("utf-8")
+        low, high = 0, len(self.string_offsets) - 1
+
+        while low < high:
+            middle = (low + high) // 2
+
+            if self.string_blob[self.string_offsets[middle]:self.string_offsets[middle + 1]].tobytes() < encoded_string:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low < len(self.string_offsets) - 1 and \
+                self.string_blob[self.string_offsets[low]:self.string_offsets[low + 1]] == encoded_string:
+            return low
+
+        return None
+
+    def may_have_parent(self, node_id):
+        """Returns False if node_id (str) is surely not a key of child_to_parent, using only the membership filter"""
+
+        for bit in membership_filter_bits(node_id, self.child_filter_bits):
+
+            if not self.child_filter[bit >> 3] & (1 << (bit & 7)):
+                return False
+
+        return True
 
 
+if __name__ == "__main__":
+    check_obo_parity(sys.argv[1]) # hp, chebi, medic, go_bp
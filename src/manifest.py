@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+from utils import atomic_filepath, file_checksum
+
+sys.path.append("./")
+
+CHECKSUM_STAMP_DIR = "./retrieved_data/checksum_stamps/" # Memoized checksums of the input files, see input_checksum
+CODE_VERSION_FILES = ["annotations.py", "dataset.py", "kbs.py", "statistics.py", "utils.py"] # Code that shapes the output
+MANIFEST_FILENAME = "manifest.json"
+
+
+def code_version():
+    """Returns the SHA-256 checksum of the source files that determine the output of dataset.py"""
+
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    sha256 = hashlib.sha256()
+
+    for filename in CODE_VERSION_FILES:
+
+        with open(os.path.join(src_dir, filename), 'rb') as src_file:
+            sha256.update(src_file.read())
+
+    return sha256.hexdigest()
+
+
+def input_checksum(filepath):
+    """Returns the SHA-256 checksum of an input file, only recomputed when its size or modification time change"""
+
+    if not os.path.exists(CHECKSUM_STAMP_DIR):
+        os.makedirs(CHECKSUM_STAMP_DIR, exist_ok=True)
+
+    stamp_name = os.path.normpath(filepath).replace(os.sep, "__") + ".json"
+
+    return file_checksum(filepath, stamp_path=CHECKSUM_STAMP_DIR + stamp_name)
+
+
+def output_stamps(dirpath):
+    """Returns the size and modification time of the output files in dirpath (hidden files and directories excluded)"""
+
+    stamps = dict()
+
+    for filename in sorted(os.listdir(dirpath)):
+        filepath = os.path.join(dirpath, filename)
+
+        if filename.startswith(".") or filename == MANIFEST_FILENAME or not os.path.isfile(filepath):
+            continue
+
+        file_stat = os.stat(filepath)
+        stamps[filename] = {"size": file_stat.st_size, "mtime_ns": file_stat.st_mtime_ns}
+
+    return stamps
+
+
+class BuildManifest:
+    """Manifest of the builds of a partition, kept in ./evanil/<partition>/manifest.json.
+
+    Each split (or "" for the partitions without PBDMS documents) has an entry with the checksums of its inputs (KB file,
+    corpus files), the code version, the output format and the stamps of the files it outputs. A split whose entry
+    matches the current inputs and outputs does not need to be built again. The manifest is saved atomically after each
+    update, so an interrupted build keeps the entries of the splits it completed.
+
+    Attributes
+    ----------
+        filepath (str): path of the manifest
+        splits (dict): has format {split: {"inputs": dict, "output_dir": str, "outputs": dict}}
+
+    Methods
+    -------
+        __init__(self, partition)
+        is_current(self, split, inputs)
+        invalidate(self, split)
+        record(self, split, inputs, output_dir)
+        save(self)
+    """
+
+    def __init__(self, partition):
+        self.filepath = "./evanil/" + partition + "/" + MANIFEST_FILENAME
+        self.partition = partition
+        self.splits = dict()
+        self.lock = threading.Lock() # Splits built concurrently update the same manifest
+
+        if os.path.exists(self.filepath):
+
+            with open(self.filepath, 'r', encoding="utf-8") as manifest_file:
+                self.splits = json.load(manifest_file)["splits"]
+
+    def is_current(self, split, inputs):
+        """Returns True if the split was built from the given inputs (dict) and its outputs did not change since"""
+
+        with self.lock:
+            entry = self.splits.get(split)
+
+        if entry is None or entry["inputs"] != inputs or not os.path.isdir(entry["output_dir"]):
+            return False
+
+        return output_stamps(entry["output_dir"]) == entry["outputs"]
+
+    def invalidate(self, split):
+        """Removes the entry of a split before building it, so that a failed build is not taken as complete"""
+
+        with self.lock:
+            self.splits.pop(split, None)
+            self.save()
+
+    def record(self, split, inputs, output_dir):
+        """Records that the split was built from the given inputs (dict), with its outputs in output_dir"""
+
+        with self.lock:
+            self.splits[split] = {"inputs": inputs, "output_dir": output_dir, "outputs": output_stamps(output_dir)}
+            self.save()
+
+    def save(self):
+        """Writes the manifest atomically (the caller holds the lock)"""
+
+        if not os.path.exists(os.path.dirname(self.filepath)):
+            os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+
+        with atomic_filepath(self.filepath) as temp_path:
+
+            with open(temp_path, "w", encoding="utf-8") as manifest_file:
+                json.dump({"partition": self.partition, "splits": self.splits}, manifest_file, indent=4, sort_keys=True)
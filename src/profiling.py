@@ -0,0 +1,230 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    import resource # Unix only, the peak RSS is not reported on other platforms
+
+except ImportError:
+    resource = None
+
+sys.path.append("./")
+
+PROFILE_DIR = "./profiles/"
+
+profiling_enabled = False
+profile_spans = list() # Finished spans, in the order they ended
+profile_lock = threading.Lock()
+profile_begin = dict() # Wall time, CPU time and command line of the run, set by enable_profiling
+span_stacks = threading.local() # Spans open in each thread, to record the path of nested spans
+
+
+def enable_profiling():
+    """Starts recording the spans of the current run (spans are not timed until this is called)"""
+
+    global profiling_enabled
+    profiling_enabled = True
+    profile_begin.update({"wall_time": time.perf_counter(), "cpu_time": time.process_time(),
+                            "started": time.strftime("%Y-%m-%dT%H:%M:%S"), "command": list(sys.argv)})
+
+
+def peak_rss_mb(who="self"):
+    """Returns the peak resident set size (MB) of the current process ("self") or of its finished child processes
+    ("children"), None if it cannot be measured"""
+
+    if resource is None:
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN).ru_maxrss
+
+    return max_rss / (1024 * 1024) if sys.platform == "darwin" else max_rss / 1024 # bytes on macOS, KB on Linux
+
+
+def children_cpu_time():
+    """Returns the CPU time of the finished child processes of the current process (e.g. closed pool workers)"""
+
+    times = os.times()
+
+    return times.children_user + times.children_system
+
+
+def open_spans():
+    """Returns the list of spans open in the current thread"""
+
+    if not hasattr(span_stacks, "spans"):
+        span_stacks.spans = list()
+
+    return span_stacks.spans
+
+
+@contextmanager
+def span(name, items=None):
+    """Records the wall time, CPU time, peak RSS and throughput of the enclosed block under given name.
+
+    Yields a dict, where the block can set "items" (int) once it knows the number of items processed. Spans can be
+    nested, each one records the path of the spans that enclose it. Nothing is recorded if profiling is not enabled.
+
+    Example
+        with span("corpus.MedMentions") as record:
+            ...
+            record["items"] = annotations_count
+    """
+
+    record = {"name": name, "items": items}
+
+    if not profiling_enabled:
+        yield record
+        return
+
+    stack = open_spans()
+    record["path"] = "/".join([open_record["name"] for open_record in stack] + [name])
+    record["thread"] = threading.current_thread().name
+    stack.append(record)
+    begin_time, begin_cpu_time, begin_children_cpu_time = time.perf_counter(), time.process_time(), children_cpu_time()
+
+    try:
+        yield record
+
+    finally:
+        wall_time = time.perf_counter() - begin_time
+
+        for i in reversed(range(len(stack))): # Generators may close their spans after an inner span was opened
+
+            if stack[i] is record:
+                del stack[i]
+                break
+
+        record.update({"start": begin_time - profile_begin["wall_time"], "wall_time": wall_time,
+                        "cpu_time": time.process_time() - begin_cpu_time,
+                        "children_cpu_time": children_cpu_time() - begin_children_cpu_time,
+                        "peak_rss_mb": peak_rss_mb(), "children_peak_rss_mb": peak_rss_mb("children")})
+        add_span(record)
+
+
+def profiled(name, count_items=None):
+    """Decorator recording each call of the function as a span with given name.
+
+    Args
+        name (str): name of the span
+        count_items (function): receives the return value of the function and returns the number of items processed
+    """
+
+    def decorator(func):
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+
+            with span(name) as record:
+                output = func(*args, **kwargs)
+
+                if count_items is not None:
+                    record["items"] = count_items(output)
+
+                return output
+
+        return wrapper
+
+    return decorator
+
+
+def record_span(name, wall_time, items=None):
+    """Records a span whose wall time was measured by the caller, e.g. the sum of many short operations interleaved
+    with other work (JSON serialization and disk writes of each document)"""
+
+    if not profiling_enabled:
+        return
+
+    stack = open_spans()
+    add_span({"name": name, "items": items, "path": "/".join([record["name"] for record in stack] + [name]),
+                "thread": threading.current_thread().name, "wall_time": wall_time})
+
+
+def add_span(record):
+    """Adds a finished span to the profile, with its throughput (items/s) if the number of items is known"""
+
+    if record["items"] is not None:
+        record["throughput"] = record["items"] / max(record["wall_time"], 1e-9)
+
+    with profile_lock:
+        profile_spans.append(record)
+
+
+def profile_summary():
+    """Returns the spans aggregated by name.
+
+    Returns
+        summary (dict): has format {name: {"count": int, "wall_time": float, "cpu_time": float, "items": int,
+            "throughput": float, "peak_rss_mb": float}}
+    """
+
+    summary = dict()
+
+    with profile_lock:
+        spans = list(profile_spans)
+
+    for record in spans:
+        entry = summary.setdefault(record["name"], {"count": 0, "wall_time": 0.0, "cpu_time": 0.0, "items": None,
+                                                        "peak_rss_mb": None})
+        entry["count"] += 1
+        entry["wall_time"] += record["wall_time"]
+        entry["cpu_time"] += record.get("cpu_time") or 0.0
+
+        if record["items"] is not None:
+            entry["items"] = (entry["items"] or 0) + record["items"]
+
+        if record.get("peak_rss_mb") is not None:
+            entry["peak_rss_mb"] = max(entry["peak_rss_mb"] or 0.0, record["peak_rss_mb"])
+
+    for entry in summary.values():
+
+        if entry["items"] is not None:
+            entry["throughput"] = entry["items"] / max(entry["wall_time"], 1e-9)
+
+    return summary
+
+
+def profile_report():
+    """Returns the profile of the run (dict), with every span and the summary by name"""
+
+    with profile_lock:
+        spans = list(profile_spans)
+
+    return {"command": profile_begin.get("command"), "started": profile_begin.get("started"),
+            "wall_time": time.perf_counter() - profile_begin.get("wall_time", 0.0),
+            "cpu_time": time.process_time() - profile_begin.get("cpu_time", 0.0), "children_cpu_time": children_cpu_time(),
+            "peak_rss_mb": peak_rss_mb(), "children_peak_rss_mb": peak_rss_mb("children"),
+            "summary": profile_summary(), "spans": spans}
+
+
+def write_profile(filepath=None, script="run"):
+    """Writes the profile of the run to filepath (./profiles/<script>_<date>.json if None) and prints its summary.
+
+    Returns
+        filepath (str): path of the written profile
+    """
+
+    if filepath is None:
+        filepath = PROFILE_DIR + script + "_" + time.strftime("%Y%m%d_%H%M%S") + ".json"
+
+    report = profile_report()
+    os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+
+    with open(filepath, 'w', encoding="utf-8") as out_file:
+        json.dump(report, out_file, indent=4)
+
+    print("------------\n" + "Span".ljust(36), "Count".rjust(6), "Wall (s)".rjust(10), "CPU (s)".rjust(10),
+            "Items/s".rjust(12), "Peak RSS (MB)".rjust(14))
+
+    for name, entry in report["summary"].items():
+        throughput = str(round(entry["throughput"], 1)) if entry["items"] is not None else "-"
+        peak_rss = str(round(entry["peak_rss_mb"], 1)) if entry["peak_rss_mb"] is not None else "-"
+        print(name.ljust(36), str(entry["count"]).rjust(6), str(round(entry["wall_time"], 3)).rjust(10),
+                str(round(entry["cpu_time"], 3)).rjust(10), throughput.rjust(12), peak_rss.rjust(14))
+
+    print("Profile:", filepath)
+
+    return filepath
@@ -0,0 +1,500 @@
+import argparse
+import json
+import math
+import multiprocessing
+import queue
+import signal
+import sys
+import threading
+import time
+from annotations import load_kb
+from baseline import candidate_index_file
+from candidates import ChoiceTable, attach_candidate_index, normalize_mention
+from collections import deque
+from contextlib import ExitStack, redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from kbs import attach_frozen_kb, frozen_kb_file
+
+sys.path.append("./")
+
+worker_tables = dict() # Has format {kb: (FrozenKnowledgeBase, FrozenChoiceTable)}, set by init_server_worker
+
+
+def link_mentions(kb_data, choice_table, mentions):
+    """Retrieves the top-k KB concepts for each mention (Fuzzy Wuzzy token sort ratio, as in baseline.rank_candidates).
+
+    Args
+        kb_data (KnowledgeBase or FrozenKnowledgeBase): the KB of the choice table
+        choice_table (ChoiceTable): precomputed names of the KB
+        mentions (list): has format [(mention text, k)]
+
+    Returns
+        candidates (list): has format [[{"id": str, "name": str, "score": int}]], one list per mention
+    """
+
+    candidates = list()
+
+    for text, k in mentions:
+        candidates.append([{"id": kb_data.name_to_id[name], "name": name, "score": score} \
+                                for name, score in choice_table.top_candidates(text, k)])
+
+    return candidates
+
+
+def init_server_worker(kb_files):
+    """Initializer of the pool workers: attaches the frozen KBs and their frozen choice tables once.
+
+    Args
+        kb_files (dict): has format {kb: (frozen KB filepath, frozen choice table filepath)}
+    """
+
+    for kb, (kb_filepath, table_filepath) in kb_files.items():
+        worker_tables[kb] = (attach_frozen_kb(kb_filepath), attach_candidate_index(table_filepath))
+
+
+def link_mentions_worker(task):
+    """Applies link_mentions in a pool worker, task has format (kb, [(mention text, k)])"""
+
+    kb_data, choice_table = worker_tables[task[0]]
+
+    return link_mentions(kb_data, choice_table, task[1])
+
+
+def percentile(sorted_values, fraction):
+    """Returns the nearest-rank percentile of a sorted list (None if it is empty)"""
+
+    if len(sorted_values) == 0:
+        return None
+
+    return sorted_values[min(max(math.ceil(fraction * len(sorted_values)) - 1, 0), len(sorted_values) - 1)]
+
+
+class LinkingService:
+    """Keeps KBs and their choice tables loaded and links batches of mentions sent by several clients.
+
+    Requests are queued and a dispatcher thread takes them in micro-batches: it waits at most max_wait_ms after the
+    first request of a batch for other ones, up to max_batch mentions. The mentions of a batch are deduplicated across
+    requests (same KB, normalized text and k) and scored by a pool of workers, which attach the frozen KBs and load the
+    choice tables once when the service starts. While a batch is scored, the next requests accumulate in the queue.
+
+    Attributes
+    ----------
+        kbs (list): KBs served, e.g. ["hp", "chebi"]
+        workers (int): number of processes scoring the mentions, 0 to score them in the dispatcher thread
+        max_batch (int): maximum number of mentions in a batch (a larger request is a batch by itself)
+        max_wait_ms (float): maximum time to wait for other requests after the first one of a batch
+        max_k (int): maximum number of candidates per mention
+        stats_lock (threading.Lock): protects the counters and the latency window
+
+    Methods
+    -------
+        __init__(self, kbs, workers=4, max_batch=256, max_wait_ms=5, max_k=100, latency_window=10000)
+        start(self)
+        close(self)
+        submit(self, kb, mentions, k=5, callback=None)
+        link(self, kb, mentions, k=5)
+        dispatch(self)
+        score_batch(self, batch)
+        answer(self, request, results, error, end_time)
+        is_alive(self)
+        stats(self)
+    """
+
+    def __init__(self, kbs, workers=4, max_batch=256, max_wait_ms=5, max_k=100, latency_window=10000):
+        self.kbs = list(kbs)
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.max_k = max_k
+        self.requests = queue.Queue()
+        self.tables = dict() # Has format {kb: (KnowledgeBase, ChoiceTable)}, used when workers is 0
+        self.files = ExitStack()
+        self.pool = None
+        self.dispatcher = None
+        self.stats_lock = threading.Lock()
+        self.latencies = deque(maxlen=latency_window) # Latency (s) of the last requests
+        self.counters = {"requests": 0, "mentions": 0, "scored_mentions": 0, "batches": 0, "errors": 0}
+        self.begin_time = None
+
+    def start(self):
+        """Loads the KBs, builds their choice tables, starts the pool of workers and the dispatcher thread"""
+
+        kb_files = dict()
+
+        for kb in self.kbs:
+            begin_time = time.time()
+            kb_data = load_kb(kb)
+            choice_table = ChoiceTable(kb_data.name_to_id)
+            self.tables[kb] = (kb_data, choice_table)
+
+            if self.workers > 0:
+                kb_files[kb] = (self.files.enter_context(frozen_kb_file(kb_data)),
+                                self.files.enter_context(candidate_index_file(choice_table)))
+
+            print("KB", kb, "ready:", str(len(choice_table.names)), "names in", str(round(time.time() - begin_time, 3)),
+                    "s", file=sys.stderr)
+
+        if self.workers > 0: # The pool is started before any thread, so that the workers are not forked while it runs
+            self.pool = multiprocessing.Pool(processes=self.workers, initializer=init_server_worker, initargs=(kb_files,))
+
+        self.begin_time = time.time()
+        self.dispatcher = threading.Thread(target=self.dispatch, name="dispatcher", daemon=True)
+        self.dispatcher.start()
+
+    def close(self):
+        """Stops the dispatcher once the queued requests are answered, then the pool, and removes the KB files"""
+
+        if self.dispatcher is not None:
+            self.requests.put(None)
+            self.dispatcher.join()
+
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+        self.files.close()
+
+    def submit(self, kb, mentions, k=5, callback=None):
+        """Queues a request and returns it without waiting for its answer.
+
+        Args
+            kb (str): one of the KBs served
+            mentions (list): mention texts (str)
+            k (int): number of candidates per mention
+            callback (function): called with the request (dict) by the dispatcher thread once it is answered
+
+        Returns
+            request (dict): has format {"kb": str, "mentions": list, "k": int, "results": list, "error": str,
+                "latency": float, "done": threading.Event}, "results" being set as in link_mentions once "done" is set
+
+        Raises
+            ValueError if the KB is not served, k is out of range or a mention is not a string
+        """
+
+        if kb not in self.tables.keys():
+            raise ValueError("KB not served: " + str(kb) + " (served: " + ", ".join(self.kbs) + ")")
+
+        if isinstance(k, bool) or not isinstance(k, int) or k < 1 or k > self.max_k:
+            raise ValueError("k must be an integer between 1 and " + str(self.max_k))
+
+        if not isinstance(mentions, list) or not all(isinstance(mention, str) for mention in mentions):
+            raise ValueError("mentions must be a list of strings")
+
+        request = {"kb": kb, "mentions": mentions, "k": k, "results": None, "error": None, "latency": None,
+                    "callback": callback, "done": threading.Event(), "begin_time": time.perf_counter()}
+        self.requests.put(request)
+
+        return request
+
+    def link(self, kb, mentions, k=5):
+        """Links the mentions and waits for the answer, see submit. Returns the request (dict)"""
+
+        request = self.submit(kb, mentions, k)
+        request["done"].wait()
+
+        return request
+
+    def dispatch(self):
+        """Dispatcher thread: takes the queued requests in micro-batches and answers them, until close is called"""
+
+        closing = False
+
+        while not closing:
+            request = self.requests.get()
+
+            if request is None:
+                break
+
+            batch = [request]
+            mentions_count = len(request["mentions"])
+            deadline = time.perf_counter() + self.max_wait_ms / 1000
+
+            while mentions_count < self.max_batch:
+
+                try:
+                    request = self.requests.get(timeout=max(deadline - time.perf_counter(), 0))
+
+                except queue.Empty:
+                    break
+
+                if request is None:
+                    closing = True
+                    break
+
+                batch.append(request)
+                mentions_count += len(request["mentions"])
+
+            try:
+                self.score_batch(batch)
+
+            except Exception as exception: # The requests of the batch not answered yet get the error, the loop goes on
+                end_time = time.perf_counter()
+
+                for request in batch:
+
+                    if not request["done"].is_set():
+                        self.answer(request, None, repr(exception), end_time)
+
+    def score_batch(self, batch):
+        """Scores the unique (KB, normalized text, k) keys of a batch of requests and answers each request"""
+
+        keys = dict() # Has format {(kb, normalized text, k): index of the key in its KB}
+        kb_mentions = {kb: list() for kb in self.kbs} # Has format {kb: [(mention text, k)]}
+        kb_candidates = dict()
+        error = None
+
+        for request in batch:
+
+            for mention in request["mentions"]:
+                key = (request["kb"], normalize_mention(mention), request["k"])
+
+                if key not in keys.keys():
+                    keys[key] = len(kb_mentions[request["kb"]])
+                    kb_mentions[request["kb"]].append((mention, request["k"]))
+
+        try:
+
+            if self.pool is None:
+
+                for kb, mentions in kb_mentions.items():
+                    kb_candidates[kb] = link_mentions(self.tables[kb][0], self.tables[kb][1], mentions)
+
+            else:
+                tasks = list()
+                chunk_size = max(math.ceil(len(keys) / (self.workers * 4)), 1) # About 4 chunks per worker
+
+                for kb, mentions in kb_mentions.items():
+                    tasks.extend((kb, mentions[i:i + chunk_size]) for i in range(0, len(mentions), chunk_size))
+
+                for task, candidates in zip(tasks, self.pool.map(link_mentions_worker, tasks, chunksize=1)):
+                    kb_candidates.setdefault(task[0], list()).extend(candidates)
+
+            batch_results = [[kb_candidates[request["kb"]][keys[(request["kb"], normalize_mention(mention), 
+                                request["k"])]] for mention in request["mentions"]] for request in batch]
+
+        except Exception as exception: # The requests of the batch get the error, the service keeps running
+            error = repr(exception)
+            batch_results = [None] * len(batch)
+
+        end_time = time.perf_counter()
+
+        with self.stats_lock:
+            self.counters["batches"] += 1
+            self.counters["scored_mentions"] += len(keys)
+
+            for request in batch:
+                self.counters["requests"] += 1
+                self.counters["mentions"] += len(request["mentions"])
+                self.counters["errors"] += int(error is not None)
+                self.latencies.append(end_time - request["begin_time"])
+
+        for request, results in zip(batch, batch_results):
+            self.answer(request, results, error, end_time)
+
+    def answer(self, request, results, error, end_time):
+        """Sets the results (or the error) of a request, calls its callback and marks it as done. An exception raised 
+        by the callback is printed to stderr, so that it does not stop the dispatcher."""
+
+        request["results"] = results
+        request["error"] = error
+        request["latency"] = end_time - request["begin_time"]
+
+        try:
+
+            if request["callback"] is not None:
+                request["callback"](request)
+
+        except Exception as exception:
+            print("Callback of a request failed:", repr(exception), file=sys.stderr)
+
+        finally:
+            request["done"].set()
+
+    def is_alive(self):
+        """Returns True if the dispatcher thread is running, i.e. queued requests will be answered"""
+
+        return self.dispatcher is not None and self.dispatcher.is_alive()
+
+    def stats(self):
+        """Returns the counters of the service, its throughput and the latency percentiles (ms) of the last requests"""
+
+        with self.stats_lock:
+            counters = dict(self.counters)
+            latencies = sorted(self.latencies)
+
+        uptime = time.time() - self.begin_time
+
+        return dict(counters, uptime_s=uptime, kbs=self.kbs, workers=self.workers,
+                    requests_per_s=counters["requests"] / max(uptime, 1e-9),
+                    mentions_per_s=counters["mentions"] / max(uptime, 1e-9),
+                    mentions_per_batch=counters["mentions"] / max(counters["batches"], 1),
+                    dedup_ratio=counters["mentions"] / max(counters["scored_mentions"], 1),
+                    latency_ms={name: None if percentile(latencies, fraction) is None \
+                                    else percentile(latencies, fraction) * 1000 \
+                                for name, fraction in [("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0)]})
+
+
+class LinkingRequestHandler(BaseHTTPRequestHandler):
+    """HTTP interface of the LinkingService of the server (self.server.service).
+
+    GET /health and GET /stats return JSON, POST /link receives {"kb": str, "mentions": [str], "k": int} and returns
+    {"kb": str, "results": [[{"id": str, "name": str, "score": int}]], "latency_ms": float}.
+    """
+
+    def send_json(self, status, output):
+        body = json.dumps(output).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+
+        if self.path == "/health":
+
+            if self.server.service.is_alive():
+                self.send_json(200, {"status": "ok", "kbs": self.server.service.kbs})
+
+            else:
+                self.send_json(503, {"status": "unavailable", "kbs": self.server.service.kbs})
+
+        elif self.path == "/stats":
+            self.send_json(200, self.server.service.stats())
+
+        else:
+            self.send_json(404, {"error": "unknown path " + self.path})
+
+    def do_POST(self):
+
+        if self.path != "/link":
+            self.send_json(404, {"error": "unknown path " + self.path})
+            return
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8"))
+            request = self.server.service.link(body.get("kb"), body.get("mentions"), body.get("k", self.server.k))
+
+        except (ValueError, AttributeError) as error: # Invalid JSON (json.JSONDecodeError), not an object or invalid request
+            self.send_json(400, {"error": str(error)})
+            return
+
+        if request["error"] is not None:
+            self.send_json(500, {"error": request["error"]})
+
+        else:
+            self.send_json(200, {"kb": request["kb"], "results": request["results"],
+                                    "latency_ms": request["latency"] * 1000})
+
+    def log_message(self, format, *args):
+        """Requests are not logged, see GET /stats"""
+
+        return
+
+
+class LinkingHTTPServer(ThreadingHTTPServer):
+    """HTTP server handling each connection in its own thread, with a listen queue large enough for bursts of clients"""
+
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def serve_http(service, host="127.0.0.1", port=8000, k=5):
+    """Serves the LinkingService over HTTP until interrupted, see LinkingRequestHandler"""
+
+    server = LinkingHTTPServer((host, port), LinkingRequestHandler)
+    server.service = service
+    server.k = k
+    print("Serving", ", ".join(service.kbs), "on http://" + host + ":" + str(server.server_address[1]), file=sys.stderr)
+
+    try:
+        server.serve_forever()
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        server.server_close()
+
+
+def serve_stdio(service, k=5, in_file=sys.stdin, out_file=sys.stdout):
+    """Serves the LinkingService over a JSON-lines protocol until the end of the input.
+
+    Each input line is a request {"id": any, "kb": str, "mentions": [str], "k": int} or {"id": any, "op": "stats"}.
+    Requests are not answered in order: each output line echoes the "id" of its request, with its "results" or "error".
+    """
+
+    out_lock = threading.Lock()
+    pending = list()
+
+    def write_line(output):
+
+        with out_lock:
+            out_file.write(json.dumps(output) + "\n")
+            out_file.flush()
+
+    def write_answer(request_id, request):
+
+        if request["error"] is not None:
+            write_line({"id": request_id, "error": request["error"]})
+
+        else:
+            write_line({"id": request_id, "kb": request["kb"], "results": request["results"],
+                        "latency_ms": request["latency"] * 1000})
+
+    for line in in_file:
+
+        if line.strip() == "":
+            continue
+
+        body = None
+
+        try:
+            body = json.loads(line)
+
+            if body.get("op") == "stats":
+                write_line({"id": body.get("id"), "stats": service.stats()})
+                continue
+
+            pending.append(service.submit(body.get("kb"), body.get("mentions"), body.get("k", k), 
+                            callback=lambda request, request_id=body.get("id"): write_answer(request_id, request)))
+
+        except (ValueError, AttributeError) as error: # Invalid JSON, request that is not an object or invalid request
+            write_line({"id": body.get("id") if isinstance(body, dict) else None, "error": str(error)})
+
+    for request in pending:
+        request["done"].wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the baseline candidate retrieval over loaded KBs")
+    parser.add_argument("kbs", nargs="+", help="hp, medic, ctd_anatomy, ctd_chemicals, chebi and/or go_bp")
+    parser.add_argument("--stdio", action="store_true", help="read JSON-lines requests from stdin instead of HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=4, help="number of processes scoring the mentions (0: none)")
+    parser.add_argument("--k", type=int, default=5, help="default number of candidates per mention")
+    parser.add_argument("--max-batch", type=int, default=256, help="maximum number of mentions in a micro-batch")
+    parser.add_argument("--max-wait-ms", type=float, default=5,
+                        help="maximum time to wait for other requests before scoring a micro-batch")
+    args = parser.parse_args()
+
+    service = LinkingService(args.kbs, workers=args.workers, max_batch=args.max_batch, max_wait_ms=args.max_wait_ms)
+
+    with redirect_stdout(sys.stderr): # The KB loading progress must not mix with the JSON lines of --stdio
+        service.start()
+
+    # SIGTERM stops the server like Ctrl+C, so that the frozen KBs and choice tables are removed (workers keep the default)
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: sys.exit(0))
+
+    try:
+
+        if args.stdio:
+            serve_stdio(service, k=args.k)
+
+        else:
+            serve_http(service, host=args.host, port=args.port, k=args.k)
+
+    finally:
+        service.close()
+        print(json.dumps(service.stats()), file=sys.stderr)
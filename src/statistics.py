@@ -1,83 +1,304 @@
+import argparse
 import json
+import multiprocessing
 import os
 import sys
-from utils import retrieve_annotations
+from collections import Counter
+from collections.abc import Mapping
+from store import load_store
+from utils import annotation_files, atomic_filepath, file_stamp, load_annotation_file
 
 sys.path.append("./")
 
+STATS_FILENAME = "stats.json" # Sidecar with the statistics of the subsets of a partition (or PBDMS split) directory
 
-def get_corpus_statistics(annotations):
-    """Calculate and output the corpus statistics.
+
+class CorpusStatistics:
+    """Mergeable accumulator of the statistics of a set of documents.
+
+    Statistics of different files can be computed separately and then merged, in any order, into the statistics of
+    the whole partition.
+
+    Attributes
+    ----------
+        doc_count (int): number of documents
+        annotations_count (int): number of annotations
+        max_annotations_count, min_annotations_count (int): max/min number of annotations per document
+        unique_annot_count (int): number of annotations with distinct start positions in each document
+        word_counts (Counter): annotations with distinct start positions in each document by number of words,
+            has keys 1, 2, 3, 4 and 5 (5 or more words)
+        mention_counts (Counter): frequency of each mention text
+        kb_id_counts (Counter): frequency of each KB ID
+        ancestor_counts (Counter): frequency of each direct ancestor
+
+    Methods
+    -------
+        __init__(self)
+        add_doc(self, annotations)
+        consume(self, doc_annotations)
+        merge(self, other)
+        to_dict(self)
+        from_dict(stats_dict)
+        report(self, top=10)
+    """
+
+    def __init__(self):
+        self.doc_count = int()
+        self.annotations_count = int()
+        self.max_annotations_count = int()
+        self.min_annotations_count = None
+        self.unique_annot_count = int()
+        self.word_counts = Counter()
+        self.mention_counts = Counter()
+        self.kb_id_counts = Counter()
+        self.ancestor_counts = Counter()
+
+    def add_doc(self, annotations):
+        """Updates the statistics with the annotations (list) of a document"""
+
+        self.doc_count += 1
+        self.annotations_count += len(annotations)
+        self.max_annotations_count = max(self.max_annotations_count, len(annotations))
+
+        if self.min_annotations_count is None or len(annotations) < self.min_annotations_count:
+            self.min_annotations_count = len(annotations)
+
+        added_annotations = set()
+
+        for annotation in annotations:
+            self.mention_counts[annotation[0]] += 1
+            self.kb_id_counts[annotation[3]] += 1
+            self.ancestor_counts[annotation[4]] += 1
+
+            if annotation[1] not in added_annotations:
+                added_annotations.add(annotation[1])
+                self.unique_annot_count += 1
+                self.word_counts[min(len(annotation[0].split(" ")), 5)] += 1
+
+    def consume(self, doc_annotations):
+        """Yields the (file_id, annotations) in doc_annotations (iterable), adding each document to the statistics"""
+
+        for doc, annotations in doc_annotations:
+            self.add_doc(annotations)
+            yield doc, annotations
+
+    def merge(self, other):
+        """Adds the statistics of other (CorpusStatistics) to these ones and returns them"""
+
+        self.doc_count += other.doc_count
+        self.annotations_count += other.annotations_count
+        self.max_annotations_count = max(self.max_annotations_count, other.max_annotations_count)
+
+        if self.min_annotations_count is None or (other.min_annotations_count is not None and \
+                other.min_annotations_count < self.min_annotations_count):
+            self.min_annotations_count = other.min_annotations_count
+
+        self.unique_annot_count += other.unique_annot_count
+        self.word_counts.update(other.word_counts)
+        self.mention_counts.update(other.mention_counts)
+        self.kb_id_counts.update(other.kb_id_counts)
+        self.ancestor_counts.update(other.ancestor_counts)
+
+        return self
+
+    def to_dict(self):
+        """Returns the statistics in a JSON-serializable dict"""
+
+        return {"doc_count": self.doc_count, "annotations_count": self.annotations_count,
+                "max_annotations_count": self.max_annotations_count, "min_annotations_count": self.min_annotations_count,
+                "unique_annot_count": self.unique_annot_count,
+                "word_counts": {str(words): count for words, count in sorted(self.word_counts.items())},
+                "mention_counts": dict(self.mention_counts), "kb_id_counts": dict(self.kb_id_counts),
+                "ancestor_counts": dict(self.ancestor_counts)}
+
+    @staticmethod
+    def from_dict(stats_dict):
+        """Returns the CorpusStatistics represented by a dict built with to_dict"""
+
+        stats = CorpusStatistics()
+        stats.doc_count = stats_dict["doc_count"]
+        stats.annotations_count = stats_dict["annotations_count"]
+        stats.max_annotations_count = stats_dict["max_annotations_count"]
+        stats.min_annotations_count = stats_dict["min_annotations_count"]
+        stats.unique_annot_count = stats_dict["unique_annot_count"]
+        stats.word_counts = Counter({int(words): count for words, count in stats_dict["word_counts"].items()})
+        stats.mention_counts = Counter(stats_dict["mention_counts"])
+        stats.kb_id_counts = Counter(stats_dict["kb_id_counts"])
+        stats.ancestor_counts = Counter(stats_dict["ancestor_counts"])
+
+        return stats
+
+    def report(self, top=10):
+        """Returns the statistics as text, including the 'top' (int) most frequent KB IDs and direct ancestors"""
+
+        doc_count, annotations_count = max(self.doc_count, 1), max(self.annotations_count, 1)
+        word_labels = {1: "1 word", 2: "2 words", 3: "3 words", 4: "4 words", 5: "5 or more words"}
+        stats = "Total number of documents: " + str(self.doc_count) + "\n" \
+                + "Total number of annotations: " + str(self.annotations_count) + "\n" \
+                + "Annotations per document: " + str(float(self.annotations_count/doc_count)) + "\n" \
+                + "Max number of annotations per document: " + str(self.max_annotations_count) + "\n" \
+                + "Min number of annotations per document: " + str(self.min_annotations_count or 0) + "\n"
+
+        for words, label in word_labels.items():
+            stats += str(self.word_counts[words]) + " annotations (" \
+                    + str(float(self.word_counts[words]/annotations_count)*100) + " %) with " + label + "\n"
+
+        stats += "Unique mentions: " + str(len(self.mention_counts)) + "\n" \
+                + "Distinct KB IDs: " + str(len(self.kb_id_counts)) + "\n" \
+                + "Distinct direct ancestors: " + str(len(self.ancestor_counts)) + "\n" \
+                + "Most frequent KB IDs: " + most_frequent(self.kb_id_counts, top) + "\n" \
+                + "Most frequent direct ancestors: " + most_frequent(self.ancestor_counts, top)
+
+        return stats
+
+
+def most_frequent(counts, top):
+    """Returns the 'top' most frequent keys of counts (Counter) as text, ties sorted by key so the result does not 
+    depend on the order in which statistics were merged"""
+
+    top_counts = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:top]
+
+    return ", ".join(key + " (" + str(count) + ")" for key, count in top_counts)
+
+
+def get_corpus_statistics(doc_annotations):
+    """Calculate and output the corpus statistics, consuming the documents one at a time.
 
     Args
-        annotations (dict): has format {file_id: [(annotation_str, start_pos, end_pos, hp_id, direct_ancestor)]}
-    
+        doc_annotations (dict or iterable): has format {file_id: [(annotation_str, start_pos, end_pos, hp_id, 
+            direct_ancestor)]} or [(file_id, [(annotation_str, start_pos, end_pos, hp_id, direct_ancestor)])]
+
     Returns
         Prints out statistics of chosen partition, e.g. Total number of documents , annotations, etc.
     """
-    
-    annotations_count = int()
-    #doc_count = len(annotations.keys())
-    doc_count = 0
-    total_annot = int()
-    unique_annot_count = int()
-    max_annotations_count = int()
-    min_annotations_count = int(100)
-    word_1 = int()
-    word_2 = int()
-    word_3 = int()
-    word_4 = int()
-    word_5_more = int()
-
-    for doc in annotations:
-        doc_count += 1
-        annotations_count += len(annotations[doc])
-        added_annotations = list()
-
-        if len(annotations[doc]) > max_annotations_count:
-            max_annotations_count = len(annotations[doc])
-            
-        if len(annotations[doc]) < min_annotations_count:
-            min_annotations_count = len(annotations[doc])
-
-        for annotation in annotations[doc]:
-            total_annot += 1
-            
-            if annotation[1] not in added_annotations:
-                added_annotations.append(annotation[1])
-                unique_annot_count += 1
-                annotations_words = annotation[0].split(" ")
-                
-                if len(annotations_words) == 1:
-                    word_1 += 1
-                
-                elif len(annotations_words) == 2:
-                    word_2 += 1
-                
-                elif len(annotations_words) == 3:
-                    word_3 += 1
-
-                elif len(annotations_words) == 4:
-                    word_4 += 1
-
-                elif len(annotations_words) >= 5:
-                    word_5_more += 1
-        
-    stats = "Total number of documents: " + str(doc_count) + "\n" \
-            + "Total number of annotations: " + str(annotations_count) + "\n" \
-            + "Annotations per document: " + str(float(annotations_count/doc_count)) + "\n" \
-            + "Max number of annotations per document: " + str(max_annotations_count) + "\n" \
-            + "Min number of annotations per document: " + str(min_annotations_count) + "\n" \
-            + str(word_1) + " annotations (" + str(float(word_1/annotations_count)*100) + " %) with 1 word\n" \
-            + str(word_2) + " annotations (" + str(float(word_2/annotations_count)*100) + " %) with 2 words\n" \
-            + str(word_3) + " annotations (" + str(float(word_3/annotations_count)*100) + " %) with 3 words\n" \
-            + str(word_4) + " annotations (" + str(float(word_4/annotations_count)*100) + " %) with 4 words\n" \
-            + str(word_5_more) + " annotations (" + str(float(word_5_more/annotations_count)*100) \
-            + " %) with 5 or more words"
-
-    print(stats)
+
+    if isinstance(doc_annotations, Mapping):
+        doc_annotations = doc_annotations.items()
+
+    stats = CorpusStatistics()
+
+    for doc, annotations in stats.consume(doc_annotations):
+        pass
+
+    print(stats.report())
+
+    return stats
+
+
+def file_statistics(filepath):
+    """Returns the CorpusStatistics of an annotation file, runs in pool workers"""
+
+    stats = CorpusStatistics()
+
+    for doc, annotations in load_annotation_file(filepath).items():
+        stats.add_doc(annotations)
+
+    return stats
+
+
+def write_stats_sidecar(dirpath, subset_stats):
+    """Writes the statistics of the subsets in dirpath to its stats.json sidecar.
+
+    Args
+        dirpath (str): directory of a partition or PBDMS split
+        subset_stats (dict): has format {subset: (filepath, CorpusStatistics)}
+    """
+
+    sidecar = {subset: dict(file_stamp(filepath), stats=stats.to_dict()) for subset, (filepath, stats) in subset_stats.items()}
+
+    with atomic_filepath(dirpath + STATS_FILENAME) as temp_path:
+
+        with open(temp_path, "w", encoding="utf-8") as out_file:
+            json.dump(sidecar, out_file, ensure_ascii=False)
+
+
+def load_sidecar_statistics(filepath, subset, sidecars):
+    """Returns the CorpusStatistics of an annotation file stored in the sidecar of its directory, None if there is no
+    sidecar or if the file changed since the sidecar was written. 'sidecars' (dict) caches the loaded sidecars."""
+
+    dirpath = os.path.dirname(filepath) + "/"
+
+    if dirpath not in sidecars:
+        sidecars[dirpath] = dict()
+
+        if os.path.exists(dirpath + STATS_FILENAME):
+
+            with open(dirpath + STATS_FILENAME, 'r', encoding="utf-8") as in_file:
+                sidecars[dirpath] = json.load(in_file)
+
+    entry = sidecars[dirpath].get(subset)
+
+    if entry is None or not os.path.exists(filepath) or \
+            {key: entry[key] for key in ["file", "size", "mtime_ns"]} != file_stamp(filepath):
+        return None
+
+    return CorpusStatistics.from_dict(entry["stats"])
+
+
+def get_partition_statistics(partition, splits=None, subsets=None, workers=4, use_sidecars=True):
+    """Computes the statistics of a partition: the statistics of each annotation file are read from the stats.json 
+    sidecar written by dataset.py or computed from the columnar store of the partition (see store.py) if they are up
+    to date, otherwise the file is processed by a pool worker. The statistics of the files are then merged.
+
+    Args
+        partition (str): has value "medic", "ctd_anatomy", "ctd_chemicals", "chebi", "go_bp" or "hp"
+        splits (list): PBDMS splits to consider, all of them if None (see utils.annotation_files)
+        subsets (list): subsets to consider among "train", "dev" and "test", all of them if None
+        workers (int): number of worker processes
+        use_sidecars (bool): "False" to ignore the sidecars and read every file
+
+    Returns
+        stats (CorpusStatistics): statistics of the selected files
+    """
+
+    stats = CorpusStatistics()
+    pending_files = list()
+    sidecars = dict()
+    sidecar_count, store_count = int(), int()
+    store, store_loaded = None, False
+
+    for split, subset, filepath in annotation_files(partition, splits=splits, subsets=subsets):
+        file_stats = load_sidecar_statistics(filepath, subset, sidecars) if use_sidecars else None
+
+        if file_stats is not None:
+            stats.merge(file_stats)
+            sidecar_count += 1
+            continue
+
+        if not store_loaded: # Only when a sidecar is missing or out of date
+            store, store_loaded = load_store(partition), True
+
+        if store is not None:
+
+            for doc, annotations in store.iter_file_docs(split, subset):
+                stats.add_doc(annotations)
+
+            store_count += 1
+
+        else:
+            pending_files.append(filepath)
+
+    if len(pending_files) > 0:
+
+        with multiprocessing.Pool(processes=min(workers, len(pending_files))) as pool:
+
+            for file_stats in pool.imap(file_statistics, pending_files):
+                stats.merge(file_stats)
+
+    print("Annotation files:", str(sidecar_count + store_count + len(pending_files)), "(" + str(sidecar_count), 
+            "from sidecars,", str(store_count), "from the store)")
+
+    return stats
 
 
 if __name__ == "__main__":
-    get_corpus_statistics(retrieve_annotations(sys.argv[1], test=False))
-    
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Statistics of a partition of EvaNIL dataset")
+    parser.add_argument("partition", help="medic, ctd_anatomy, ctd_chemicals, chebi, go_bp or hp")
+    parser.add_argument("--splits", type=int, nargs="+", help="PBDMS splits to consider (all by default)")
+    parser.add_argument("--subsets", nargs="+", choices=["train", "dev", "test"], help="subsets to consider (all by default)")
+    parser.add_argument("--workers", type=int, default=4, help="number of processes reading annotation files")
+    parser.add_argument("--no-sidecars", action="store_true", help="read every annotation file, ignoring stats.json")
+    args = parser.parse_args()
+    stats = get_partition_statistics(args.partition, splits=args.splits, subsets=args.subsets, workers=args.workers,
+                                        use_sidecars=not args.no_sidecars)
+    print(stats.report())
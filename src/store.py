@@ -0,0 +1,357 @@
+import argparse
+import os
+import sys
+import time
+from array import array
+from utils import PARTITION_SUBSETS, MappedSectionFile, annotation_files, file_stamp, load_annotation_file, \
+    write_section_file
+
+sys.path.append("./")
+
+STORE_MAGIC = b"EVANILDS"
+STORE_FILENAME = "annotations.store"
+STORE_SUBSETS = PARTITION_SUBSETS
+# Kinds of the values of the start/end columns, so that offsets are restored with their original type
+OFFSET_INT = 0 # int in the .json file
+OFFSET_DECIMAL_STR = 1 # str with the decimal representation of the value, e.g. "102"
+OFFSET_STR = 2 # any other str, the value is its index in the string heap
+
+
+class StringHeap:
+    """Interns strings, each distinct string is stored once and referred to by its index (insertion order).
+
+    Methods
+    -------
+        __init__(self)
+        intern(self, string)
+        sections(self, heap_name)
+    """
+
+    def __init__(self):
+        self.indexes = dict()
+        self.offsets = array('Q', [0])
+        self.blob = bytearray()
+
+    def intern(self, string):
+        """Returns the index of the string in the heap, adding it if needed"""
+
+        if type(string) != str:
+            raise ValueError("only str values can be added to the string heap, got " + repr(string))
+
+        if string not in self.indexes:
+            self.indexes[string] = len(self.indexes)
+            self.blob += string.encode("utf-8")
+            self.offsets.append(len(self.blob))
+
+        return self.indexes[string]
+
+    def sections(self, heap_name):
+        """Returns the sections of the heap to write with write_section_file"""
+
+        return [(heap_name + ".offsets", self.offsets.tobytes()), (heap_name + ".blob", bytes(self.blob))]
+
+
+def encode_offset(value, strings):
+    """Returns (int value, kind) for a start/end position of an annotation, see OFFSET_INT, OFFSET_DECIMAL_STR and
+    OFFSET_STR. Strings that are not the canonical decimal representation of a number go to the string heap."""
+
+    if type(value) == int:
+
+        if -2 ** 63 <= value < 2 ** 63:
+            return value, OFFSET_INT
+
+    elif type(value) == str:
+
+        if value.isdigit() and value.isascii() and str(int(value)) == value:
+
+            if int(value) < 2 ** 63:
+                return int(value), OFFSET_DECIMAL_STR
+
+        return strings.intern(value), OFFSET_STR
+
+    raise ValueError("position " + repr(value) + " cannot be stored losslessly")
+
+
+def build_store(partition, filepath=None):
+    """Converts the annotation files of a partition into a columnar store that can be memory-mapped with AnnotationStore.
+
+    The store has a doc table (split, subset, doc ID and first mention of each document) and a mention table: mention
+    texts as indexes into a string heap, integer start/end columns and interned KB ID and direct ancestor columns. The
+    header records the rows of the doc table of each annotation file and the size and modification time of the file,
+    so that a store older than the annotation files is not used (see AnnotationStore.is_current).
+
+    Args
+        partition (str): has value "medic", "ctd_anatomy", "ctd_chemicals", "chebi", "go_bp" or "hp"
+        filepath (str): path of the output file, ./dataset/<partition>/annotations.store if None
+
+    Returns
+        filepath (str): path of the written store
+    """
+
+    if filepath is None:
+        filepath = "./dataset/" + partition + "/" + STORE_FILENAME
+
+    strings, concept_ids = StringHeap(), StringHeap()
+    doc_split, doc_subset, doc_id, doc_mentions = array('H'), array('B'), array('I'), array('Q', [0])
+    mention_text, mention_kb_id, mention_ancestor = array('I'), array('I'), array('I')
+    mention_start, mention_end, start_kind, end_kind = array('q'), array('q'), array('B'), array('B')
+
+    files = list()
+
+    for split, subset, annotations_filepath in annotation_files(partition):
+        stamp = file_stamp(annotations_filepath) # Before reading the file, so a later change is always detected
+        first_doc = len(doc_id)
+
+        for doc, annotations in load_annotation_file(annotations_filepath).items():
+            doc_split.append(int(split) if split != "" else 0)
+            doc_subset.append(STORE_SUBSETS.index(subset))
+            doc_id.append(strings.intern(doc))
+
+            for annotation in annotations:
+
+                if len(annotation) != 5:
+                    raise ValueError("annotation " + repr(annotation) + " of " + doc + " does not have 5 fields")
+
+                start_value, start_type = encode_offset(annotation[1], strings)
+                end_value, end_type = encode_offset(annotation[2], strings)
+                mention_text.append(strings.intern(annotation[0]))
+                mention_start.append(start_value)
+                mention_end.append(end_value)
+                start_kind.append(start_type)
+                end_kind.append(end_type)
+                mention_kb_id.append(concept_ids.intern(annotation[3]))
+                mention_ancestor.append(concept_ids.intern(annotation[4]))
+
+            doc_mentions.append(len(mention_text))
+
+        files.append(dict(stamp, split=split, subset=subset, docs=[first_doc, len(doc_id)]))
+
+    columns = {"doc.split": doc_split, "doc.subset": doc_subset, "doc.id": doc_id, "doc.mentions": doc_mentions,
+                "mention.text": mention_text, "mention.start": mention_start, "mention.end": mention_end,
+                "mention.start_kind": start_kind, "mention.end_kind": end_kind, "mention.kb_id": mention_kb_id,
+                "mention.ancestor": mention_ancestor}
+    sections = [(column_name, column.tobytes()) for column_name, column in columns.items()]
+    sections.extend(strings.sections("strings") + concept_ids.sections("concept_ids"))
+    header = {"partition": partition, "subsets": STORE_SUBSETS, "files": files, "docs_count": len(doc_id),
+                "mentions_count": len(mention_text), "typecodes": {name: column.typecode for name, column in columns.items()}}
+    write_section_file(filepath, STORE_MAGIC, header, sections)
+    print("Store ( " + partition + " ):", str(len(doc_id)), "documents,", str(len(mention_text)), "annotations,",
+            str(len(concept_ids.indexes)), "distinct concept IDs ->", filepath)
+
+    return filepath
+
+
+class AnnotationStore:
+    """Read-only columnar store of the annotations of a partition, memory-mapped from a file written by build_store.
+
+    Opening the store does not read the annotations: columns are zero-copy views of the file, and annotations are only
+    decoded when they are requested.
+
+    Attributes
+    ----------
+        filepath (str): path of the store
+        partition (str): the partition represented
+        files (list): has format [{"split": str, "subset": str, "docs": [first row, end row], "file": str, "size": int,
+            "mtime_ns": int}] for each annotation file converted
+        doc_split, doc_subset, doc_id, doc_mentions (memoryview): columns of the doc table, the annotations of the doc i
+            are the rows doc_mentions[i]:doc_mentions[i + 1] of the mention table
+        mention_text, mention_start, mention_end, mention_start_kind, mention_end_kind, mention_kb_id,
+            mention_ancestor (memoryview): columns of the mention table
+
+    Methods
+    -------
+        __init__(self, filepath)
+        __len__(self)
+        string(self, index)
+        concept_id(self, index)
+        decode_offset(self, value, kind)
+        doc_name(self, doc_index)
+        annotations(self, doc_index)
+        is_current(self)
+        iter_file_docs(self, split, subset)
+        iter_docs(self, splits=None, subsets=None)
+        to_dict(self, test=False)
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.mapped_file = MappedSectionFile(filepath, STORE_MAGIC)
+        header = self.mapped_file.header
+        self.partition = header["partition"]
+        self.subsets = header["subsets"]
+        self.files = header.get("files") # Stores built before the files were recorded are never current
+
+        for column_name, typecode in header["typecodes"].items():
+            setattr(self, column_name.replace(".", "_"), self.mapped_file.section(column_name).cast(typecode))
+
+        self.strings_offsets = self.mapped_file.section("strings.offsets").cast('Q')
+        self.strings_blob = self.mapped_file.section("strings.blob")
+        self.concept_ids_offsets = self.mapped_file.section("concept_ids.offsets").cast('Q')
+        self.concept_ids_blob = self.mapped_file.section("concept_ids.blob")
+        self.concept_ids_cache = dict() # Few distinct concept IDs are repeated across many annotations
+
+    def __len__(self):
+        return len(self.doc_id)
+
+    def string(self, index):
+        """Returns the string with given index in the string heap"""
+
+        return str(self.strings_blob[self.strings_offsets[index]:self.strings_offsets[index + 1]], "utf-8")
+
+    def concept_id(self, index):
+        """Returns the KB ID or direct ancestor with given index in the interned concept IDs"""
+
+        if index not in self.concept_ids_cache:
+            self.concept_ids_cache[index] = \
+                str(self.concept_ids_blob[self.concept_ids_offsets[index]:self.concept_ids_offsets[index + 1]], "utf-8")
+
+        return self.concept_ids_cache[index]
+
+    def decode_offset(self, value, kind):
+        """Restores a start/end position with its original type (see encode_offset)"""
+
+        if kind == OFFSET_INT:
+            return value
+
+        if kind == OFFSET_DECIMAL_STR:
+            return str(value)
+
+        return self.string(value)
+
+    def doc_name(self, doc_index):
+        """Returns the ID of the document in given row of the doc table"""
+
+        return self.string(self.doc_id[doc_index])
+
+    def annotations(self, doc_index):
+        """Returns the annotations of the document in given row of the doc table, as they are in the .json file.
+
+        Returns
+            annotations (list): has format [[annotation_str, start_pos, end_pos, kb_id, direct_ancestor]]
+        """
+
+        annotations = list()
+
+        for i in range(self.doc_mentions[doc_index], self.doc_mentions[doc_index + 1]):
+            annotations.append([self.string(self.mention_text[i]),
+                                self.decode_offset(self.mention_start[i], self.mention_start_kind[i]),
+                                self.decode_offset(self.mention_end[i], self.mention_end_kind[i]),
+                                self.concept_id(self.mention_kb_id[i]), self.concept_id(self.mention_ancestor[i])])
+
+        return annotations
+
+    def is_current(self):
+        """Returns True if the annotation files of the partition are the ones converted into the store, i.e. none of 
+        them was rebuilt, added or removed since then"""
+
+        if self.files is None:
+            return False
+
+        current_files = annotation_files(self.partition)
+
+        if len(current_files) != len(self.files):
+            return False
+
+        for (split, subset, filepath), stored_file in zip(current_files, self.files):
+
+            if (split, subset) != (stored_file["split"], stored_file["subset"]) or not os.path.exists(filepath) or \
+                    file_stamp(filepath) != {key: stored_file[key] for key in ["file", "size", "mtime_ns"]}:
+                return False
+
+        return True
+
+    def iter_file_docs(self, split, subset):
+        """Yields (doc_id, annotations) for the documents of the annotation file of given split (str) and subset (str),
+        in the order of the file, as utils.load_annotation_file(filepath).items()"""
+
+        for stored_file in self.files:
+
+            if (stored_file["split"], stored_file["subset"]) == (split, subset):
+
+                for doc_index in range(*stored_file["docs"]):
+                    yield self.doc_name(doc_index), self.annotations(doc_index)
+
+    def iter_docs(self, splits=None, subsets=None):
+        """Yields (split, subset, doc_id, annotations) for the documents of the selected splits (list of str or int) 
+        and subsets (list of str), all of them if None, in the order of the annotation files, as utils.iter_annotations"""
+
+        split_codes = None if splits is None else {int(split) if split != "" else 0 for split in splits}
+        subset_codes = None if subsets is None else {self.subsets.index(subset) for subset in subsets}
+
+        for doc_index in range(len(self.doc_id)):
+
+            if split_codes is not None and self.doc_split[doc_index] not in split_codes:
+                continue
+
+            if subset_codes is not None and self.doc_subset[doc_index] not in subset_codes:
+                continue
+
+            split = str(self.doc_split[doc_index]) if self.doc_split[doc_index] != 0 else ""
+            yield split, self.subsets[self.doc_subset[doc_index]], self.doc_name(doc_index), self.annotations(doc_index)
+
+    def to_dict(self, test=False):
+        """Returns the annotations in the same format as utils.retrieve_annotations, 'test' (bool) as in that function"""
+
+        return {doc: annotations for split, subset, doc, annotations in
+                    self.iter_docs(subsets=["test"] if test else None)}
+
+
+def load_store(partition, current_only=True):
+    """Memory-maps the store of given partition (str), built with build_store.
+
+    Returns
+        store (AnnotationStore): None if the partition has no store or, if current_only (bool), if its annotation files 
+            changed since the store was built (see AnnotationStore.is_current)
+    """
+
+    filepath = "./dataset/" + partition + "/" + STORE_FILENAME
+
+    if not os.path.exists(filepath):
+        return None
+
+    store = AnnotationStore(filepath)
+
+    if current_only and not store.is_current():
+        print("The store of", partition, "is older than its annotation files, rebuild it with src/store.py")
+        return None
+
+    return store
+
+
+def check_store(partition):
+    """Checks that the store of given partition restores every annotation file exactly, including the order of the
+    documents and the types of the positions.
+
+    Returns
+        mismatches (list): the annotation files that differ from the store, empty if the conversion is lossless
+    """
+
+    store = load_store(partition, current_only=False)
+    mismatches = list()
+
+    if store is None:
+        raise FileNotFoundError("the partition " + partition + " does not have a store, build it with src/store.py")
+
+    for split, subset, filepath in annotation_files(partition):
+        stored_docs = [(doc, annotations) for doc_split, doc_subset, doc, annotations in
+                            store.iter_docs(splits=[split], subsets=[subset])]
+
+        if stored_docs != list(load_annotation_file(filepath).items()):
+            mismatches.append(filepath)
+
+    print("Lossless (", partition, "):", "OK" if len(mismatches) == 0 else "mismatch in " + ", ".join(mismatches))
+
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a built partition of EvaNIL dataset into a columnar store")
+    parser.add_argument("partition", help="medic, ctd_anatomy, ctd_chemicals, chebi, go_bp or hp")
+    parser.add_argument("--check", action="store_true", help="check that the store restores every annotation file")
+    args = parser.parse_args()
+    begin_time = time.time()
+    build_store(args.partition)
+    print("Conversion runtime:", str(round(time.time() - begin_time, 3)), "s")
+
+    if args.check:
+        check_store(args.partition)
@@ -1,52 +1,426 @@
+import gzip
+import hashlib
 import json
+import mmap
 import os
 import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from profiling import record_span
 
 sys.path.append("./")
 
+ANNOTATION_FILE_EXTENSIONS = [".json", ".jsonl", ".jsonl.gz", ".jsonl.zst"] # Formats written by dataset.py
+JSONL_INDEX_EXTENSION = ".idx"
+PARTITION_SUBSETS = ["train", "dev", "test"]
+has_pbmds_files = ["medic", "ctd_anatomy", "ctd_chemicals"]
 
-def retrieve_annotations(partition, test):
-    """Retrieves annotations from chosen partition of EvaNIL dataset into dict.
+
+def create_temp_file(dirpath, filename):
+    """Creates an empty file with a unique name in dirpath, ending with filename, and returns its path.
+
+    Unlike tempfile.mkstemp, that creates files readable only by the owner, the file is created with mode 0o666 so 
+    the umask of the process applies, as with open().
+    """
+
+    while True:
+        temp_path = os.path.join(dirpath, ".tmp." + os.urandom(6).hex() + "." + filename)
+
+        try:
+            os.close(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+            return temp_path
+
+        except FileExistsError:
+            continue
+
+
+@contextmanager
+def atomic_filepath(filepath):
+    """Yields a temporary path, in the same directory, to write filepath: the file is only replaced, at once, if the 
+    block completes, so an interrupted write never leaves a partial file behind.
+
+    The temporary path is unique, so concurrent writers of the same file never share it, and ends with the name of the
+    file, so its extension (e.g. .jsonl.gz) is kept.
+    """
+
+    dirpath, filename = os.path.split(filepath)
+    temp_path = create_temp_file(dirpath or ".", filename)
+
+    try:
+        yield temp_path
+        os.replace(temp_path, filepath)
+
+    finally:
+
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def file_checksum(filepath, stamp_path=None):
+    """Computes the SHA-256 checksum of given file.
+
+    Args
+        filepath (str): path of the file to checksum
+        stamp_path (str): optional path of a .json file where the checksum is memoized along with the size and 
+            modification time of the file, so it is only recomputed when the file changes
+
+    Returns
+        checksum (str): hexadecimal SHA-256 digest of the file contents
+    """
+
+    file_stat = os.stat(filepath)
+    stamp = {"size": file_stat.st_size, "mtime_ns": file_stat.st_mtime_ns}
+
+    if stamp_path is not None and os.path.exists(stamp_path):
+        
+        with open(stamp_path, 'r') as stamp_file:
+            previous_stamp = json.load(stamp_file)
+        
+        if previous_stamp.get("size") == stamp["size"] and previous_stamp.get("mtime_ns") == stamp["mtime_ns"]:
+            return previous_stamp["checksum"]
+
+    sha256 = hashlib.sha256()
+
+    with open(filepath, 'rb') as in_file:
+        
+        for block in iter(lambda: in_file.read(1 << 20), b""):
+            sha256.update(block)
+
+    stamp["checksum"] = sha256.hexdigest()
+
+    if stamp_path is not None:
+        
+        with atomic_filepath(stamp_path) as temp_path:
+
+            with open(temp_path, 'w') as stamp_file:
+                json.dump(stamp, stamp_file)
+
+    return stamp["checksum"]
+
+
+def file_stamp(filepath):
+    """Returns the name, size and modification time of a file, used to check that the data derived from it (e.g. the
+    stats.json sidecar or the annotation store) is up to date"""
+
+    file_stat = os.stat(filepath)
+
+    return {"file": os.path.basename(filepath), "size": file_stat.st_size, "mtime_ns": file_stat.st_mtime_ns}
+
+
+def write_section_file(filepath, magic, header, sections):
+    """Writes binary sections (e.g. integer arrays) in a file that can be memory-mapped with MappedSectionFile.
+
+    The file starts with the magic bytes, the length of the header and the header (JSON), that stores the offset and 
+    length of each section. Every section is 8-byte aligned, so it can be cast to an array of any item size.
+
+    Args
+        filepath (str): path of the output file
+        magic (bytes): identifies the type of the file
+        header (dict): metadata of the file, JSON-serializable, the key "sections" is added
+        sections (list): has format [(section_name, bytes)]
+    """
+
+    header = dict(header, sections=dict())
+    offset = int()
+
+    for section_name, section in sections:
+        header["sections"][section_name] = [offset, len(section)]
+        offset += len(section) + (-len(section) % 8) # Keep every section 8-byte aligned
+
+    header_bytes = json.dumps(header).encode("utf-8")
+    header_bytes += b" " * (-len(header_bytes) % 8)
+
+    with atomic_filepath(filepath) as temp_path:
+
+        with open(temp_path, 'wb') as out_file:
+            out_file.write(magic + len(header_bytes).to_bytes(8, "little") + header_bytes)
+
+            for section_name, section in sections:
+                out_file.write(section + b"\0" * (-len(section) % 8))
+
+
+class MappedSectionFile:
+    """Read-only memory map of a file written by write_section_file. 
     
+    The pages of the file are shared by every process that maps it and sections are read without copying them.
+
+    Attributes
+    ----------
+        filepath (str): path of the mapped file
+        header (dict): metadata of the file
+
+    Methods
+    -------
+        __init__(self, filepath, magic)
+        section(self, section_name)
+    """
+
+    def __init__(self, filepath, magic):
+        self.filepath = filepath
+
+        with open(filepath, 'rb') as in_file:
+            self.buffer = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.buffer[:len(magic)] != magic:
+            raise ValueError(filepath + " is not a " + magic.decode("ascii") + " file")
+
+        header_start = len(magic) + 8
+        header_length = int.from_bytes(self.buffer[len(magic):header_start], "little")
+        self.header = json.loads(self.buffer[header_start:header_start + header_length].decode("utf-8"))
+        self.data_start = header_start + header_length
+        self.view = memoryview(self.buffer)
+
+    def section(self, section_name):
+        """Returns a zero-copy view of given section of the file"""
+
+        offset, length = self.header["sections"][section_name]
+
+        return self.view[self.data_start + offset:self.data_start + offset + length]
+
+
+def open_jsonl(filepath, mode):
+    """Opens a .jsonl file in binary mode ("rb" or "wb"), compressed with gzip (.jsonl.gz) or zstd (.jsonl.zst) if the
+    extension says so. The zstandard package is only needed for .jsonl.zst files."""
+
+    if filepath.endswith(".gz"):
+        return gzip.open(filepath, mode, compresslevel=6)
+
+    if filepath.endswith(".zst"):
+
+        try:
+            import zstandard
+        
+        except ImportError:
+            raise ImportError("the zstandard package is required to read or write " + filepath)
+
+        return zstandard.open(filepath, mode)
+
+    return open(filepath, mode)
+
+
+def write_jsonl(filepath, doc_annotations):
+    """Writes the annotations in a .jsonl file, one document per line, and the index of the file.
+
+    Each line has format {file_id: [(annotation_str, start_pos, end_pos, kb_id, direct_ancestor)]}. The index, written 
+    to filepath + ".idx", has format {file_id: [offset, length]}, with the byte offsets of the lines in the 
+    uncompressed file.
+
+    Args
+        filepath (str): path of the output file, with extension .jsonl, .jsonl.gz or .jsonl.zst
+        doc_annotations (iterable): has format [(file_id, [(annotation_str, start_pos, end_pos, kb_id, direct_ancestor)])]
+
+    Returns
+        docs_count (int): number of documents written
+    """
+
+    index = dict()
+    offset = int()
+    serialize_time, write_time = float(), float()
+
+    with atomic_filepath(filepath) as temp_path:
+
+        with open_jsonl(temp_path, "wb") as out_file:
+
+            for doc_id, annotations in doc_annotations:
+                begin_time = time.perf_counter()
+                doc_line = (json.dumps({doc_id: annotations}, ensure_ascii=False) + "\n").encode("utf-8")
+                serialized_time = time.perf_counter()
+                index[doc_id] = [offset, len(doc_line)]
+                out_file.write(doc_line) # Includes the compression time in .jsonl.gz and .jsonl.zst
+                offset += len(doc_line)
+                serialize_time += serialized_time - begin_time
+                write_time += time.perf_counter() - serialized_time
+
+            closing_time = time.perf_counter()
+
+    with atomic_filepath(filepath + JSONL_INDEX_EXTENSION) as temp_path:
+
+        with open(temp_path, "w", encoding="utf-8") as index_file:
+            json.dump(index, index_file, ensure_ascii=False)
+
+    record_span("output.serialize", serialize_time, items=len(index))
+    record_span("output.write", write_time + time.perf_counter() - closing_time, items=len(index))
+
+    return len(index)
+
+
+def iter_jsonl(filepath):
+    """Yields (file_id, annotations) for each line of a .jsonl, .jsonl.gz or .jsonl.zst file written by write_jsonl"""
+
+    with open_jsonl(filepath, "rb") as in_file:
+
+        for line in in_file:
+            yield next(iter(json.loads(line.decode("utf-8")).items()))
+
+
+def read_jsonl_doc(filepath, doc_id, index=None):
+    """Reads the annotations of one document from a file written by write_jsonl, seeking to its offset in the index.
+
+    Args
+        filepath (str): path of the .jsonl, .jsonl.gz or .jsonl.zst file
+        doc_id (str): the document to read
+        index (dict): the index of the file, loaded from filepath + ".idx" if None
+
+    Returns
+        annotations (list): has format [(annotation_str, start_pos, end_pos, kb_id, direct_ancestor)]
+    """
+
+    if index is None:
+
+        with open(filepath + JSONL_INDEX_EXTENSION, 'r', encoding="utf-8") as index_file:
+            index = json.load(index_file)
+
+    offset, length = index[doc_id]
+
+    with open_jsonl(filepath, "rb") as in_file: # Seeking in a compressed file decompresses the data before the offset
+        in_file.seek(offset)
+        
+        return json.loads(in_file.read(length).decode("utf-8"))[doc_id]
+
+
+def annotation_file_format(filename):
+    """Returns the extension of an annotation file written by dataset.py, None for other files (e.g. indexes)"""
+
+    for extension in sorted(ANNOTATION_FILE_EXTENSIONS, key=len, reverse=True):
+
+        if filename.endswith(extension):
+            return extension
+
+    return None
+
+
+def subset_filepath(dirpath, subset):
+    """Returns the path of the file of given subset ("train", "dev" or "test") in dirpath, whatever its format"""
+
+    for extension in ANNOTATION_FILE_EXTENSIONS:
+        filepath = dirpath + subset + extension
+
+        if os.path.exists(filepath):
+            return filepath
+
+    return dirpath + subset + ".json"
+
+
+def load_annotation_file(filepath):
+    """Loads an annotation file in any of the formats written by dataset.py into a dict"""
+
+    if annotation_file_format(filepath) == ".json":
+
+        with open(filepath, 'r') as in_file:
+            return json.load(in_file)
+
+    return dict(iter_jsonl(filepath))
+
+
+def annotation_files(partition, splits=None, subsets=None):
+    """Returns the annotation files of a partition of EvaNIL dataset in ./dataset.
+
     Args
         partition (str): has value "medic", "ctd_anatomy", "ctd_chemicals", "chebi", "go_bp" or "hp"
-        test (bool): "True" to retrieve only annotation from test set, "False" otherwise
-    
+        splits (list): PBDMS splits to select (str or int), every split directory present if None; ignored for the 
+            partitions without PBDMS documents
+        subsets (list): subsets to select among "train", "dev" and "test", all of them if None
+
     Returns
-        annotations (dict): has format {file_id: [(annotation_str, start_pos, end_pos, hp_id, direct_ancestor)]}
+        annotation_files (list): has format [(split, subset, filepath)], split being "" for the partitions without 
+            PBDMS documents, sorted by split and then by subset (train, dev, test)
     """
-    
-    annotation_files = list()
-    has_pbmds_files = ["medic", "ctd_anatomy", "ctd_chemicals"]
+
     corpus_dir = "./dataset/" + partition + "/"
-    annotations = dict()
+    subsets = PARTITION_SUBSETS if subsets is None else subsets
+    files = list()
 
     if partition in has_pbmds_files:
         
-        for split in range(1, 30): 
-            corpus_dir_temp = corpus_dir + "split_" + str(split) + "/"
-            
-            if test:
-                test_filepath = corpus_dir_temp + "test.json"
-                annotation_files.append(test_filepath)
-            
-            else:
-                annotation_files_temp = [corpus_dir_temp + filepath for filepath in os.listdir(corpus_dir_temp)]
-                annotation_files.extend(annotation_files_temp)
+        if splits is None:
+            splits = [split for split in range(1, 30) if os.path.isdir(corpus_dir + "split_" + str(split))]
 
-    elif partition not in has_pbmds_files:
+        split_dirs = [(str(split), corpus_dir + "split_" + str(split) + "/") for split in splits]
 
-        if test:
-            annotation_files = [corpus_dir + "test.json"]
-        
-        else:
-            annotation_files_temp = os.listdir(corpus_dir)
-            annotation_files = [corpus_dir + filepath for filepath in annotation_files_temp]
+    else:
+        split_dirs = [("", corpus_dir)]
 
-    for annot_file in annotation_files:
-        
-        with open(annot_file, 'r') as in_file:
-            data = json.load(in_file)
-            annotations.update(data)
+    for split, split_dir in split_dirs:
+
+        for subset in subsets:
+            files.append((split, subset, subset_filepath(split_dir, subset)))
+
+    return files
+
+
+def iter_annotations(partition, splits=None, subsets=None, workers=4, use_store=True):
+    """Lazily yields the annotations of a partition of EvaNIL dataset, one document at a time.
+
+    If the partition has an up-to-date columnar store (see store.py), the annotations are decoded from it. Otherwise, 
+    the annotation files are read by a pool of threads, at most 'workers' files ahead of the consumer, so memory 
+    depends on the size of the files and not on the size of the partition. Documents sharing an ID in different files
+    are all yielded.
+
+    Args
+        partition (str): has value "medic", "ctd_anatomy", "ctd_chemicals", "chebi", "go_bp" or "hp"
+        splits (list): PBDMS splits to read, see annotation_files
+        subsets (list): subsets to read, see annotation_files
+        workers (int): number of threads reading annotation files
+        use_store (bool): "False" to read the annotation files even if the partition has an up-to-date store
+
+    Yields
+        split, subset, doc_id, annotations (tuple): annotations with format [(annotation_str, start_pos, end_pos, 
+            kb_id, direct_ancestor)], in the order of annotation_files and of the documents in each file
+    """
+
+    from store import load_store # store.py builds on this module
+
+    store = load_store(partition) if use_store else None
+
+    if store is not None:
+
+        for split, subset, filepath in annotation_files(partition, splits=splits, subsets=subsets):
+
+            for doc_id, annotations in store.iter_file_docs(split, subset):
+                yield split, subset, doc_id, annotations
+
+        return
+
+    pending_files = deque()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+
+        for split, subset, filepath in annotation_files(partition, splits=splits, subsets=subsets):
+            pending_files.append((split, subset, executor.submit(load_annotation_file, filepath)))
+
+            if len(pending_files) <= workers:
+                continue
+
+            split_done, subset_done, future = pending_files.popleft()
+
+            for doc_id, annotations in future.result().items():
+                yield split_done, subset_done, doc_id, annotations
+
+        while len(pending_files) > 0:
+            split_done, subset_done, future = pending_files.popleft()
+
+            for doc_id, annotations in future.result().items():
+                yield split_done, subset_done, doc_id, annotations
+
+
+def retrieve_annotations(partition, test):
+    """Retrieves annotations from chosen partition of EvaNIL dataset into dict (see iter_annotations).
+    
+    Args
+        partition (str): has value "medic", "ctd_anatomy", "ctd_chemicals", "chebi", "go_bp" or "hp"
+        test (bool): "True" to retrieve only annotation from test set, "False" otherwise
+    
+    Returns
+        annotations (dict): has format {file_id: [(annotation_str, start_pos, end_pos, hp_id, direct_ancestor)]}, 
+            read from .json, .jsonl, .jsonl.gz or .jsonl.zst files; a document in several files keeps the annotations
+            of the last one
+    """
+    
+    annotations = dict()
+
+    for split, subset, doc_id, doc_annotations in iter_annotations(partition, subsets=["test"] if test else None):
+        annotations[doc_id] = doc_annotations
         
     return annotations
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+# The modules in src/ import each other by name, as when the scripts are run from the root of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+@pytest.fixture
+def ctd_kb():
+    """CTD-style KB (tests/fixtures/sample_ctd.tsv): concept IDs without the "MESH:" prefix, parents with it"""
+
+    from kbs import KnowledgeBase, compact_kb_dicts, parse_tsv
+
+    kb_data = KnowledgeBase("ctd_chemicals", use_cache=False)
+    kb_data.set_compact_kb(compact_kb_dicts(parse_tsv(os.path.join(FIXTURES_DIR, "sample_ctd.tsv"))))
+
+    return kb_data
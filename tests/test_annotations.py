@@ -0,0 +1,217 @@
+import multiprocessing
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import pytest
+
+import annotations
+from annotations import add_annotation_to_output_dict, imap_bounded, parse_BC5CDR, parse_MedMentions, \
+    parse_NCBI_disease, pubtator_ranges
+from kbs import KnowledgeBase, compact_kb_dicts
+
+
+def timed_square(item):
+    """Returns the square of item and when it was computed"""
+
+    time.sleep(0.01)
+
+    return item * item, time.monotonic()
+
+
+def test_imap_bounded_order_and_bound():
+    """Results come in the order of the items, and items are only read max_in_flight ahead of the consumer"""
+
+    read_items = list()
+
+    def items():
+        for item in range(100):
+            read_items.append(item)
+            yield item
+
+    with multiprocessing.Pool(processes=2) as pool:
+        results = imap_bounded(pool, timed_square, items(), max_in_flight=8, chunksize=4)
+        first_result = next(results)
+        read_ahead = len(read_items)
+        squares = [first_result[0]] + [square for square, end_time in results]
+
+    assert squares == [item * item for item in range(100)]
+    assert read_ahead <= 8 + 4 # The chunks in flight and the next chunk, already read
+
+
+def test_imap_bounded_shares_pool():
+    """Threads sharing a pool are served in turn instead of one after the other"""
+
+    with multiprocessing.Pool(processes=1) as pool, ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(lambda: list(imap_bounded(pool, timed_square, range(20), max_in_flight=2, 
+                                                                chunksize=1))) for thread in range(2)]
+        end_times = [[end_time for square, end_time in future.result()] for future in futures]
+
+    assert end_times[0][0] < end_times[1][-1] and end_times[1][0] < end_times[0][-1]
+    assert max(end_times[0][0], end_times[1][0]) < min(end_times[0][-1], end_times[1][-1])
+
+
+def write_pubtator(filepath, rng, docs_count, newline="\n", final_blank_line=True, relations=True):
+    """Writes a PubTator file with titles including tabs, non-ASCII mentions, CID relation lines (if relations, there
+    are none in MedMentions) and lines with IDs in and out of the test KB, returns its path"""
+
+    lines = list()
+
+    for doc in range(docs_count):
+        doc_id = str(1000 + doc)
+        lines.append(doc_id + "|t|Title\twith a tab and ünïcode " + str(doc))
+        lines.append(doc_id + "|a|Abstract " + "text " * rng.randint(0, 30))
+
+        for i in range(rng.randint(0, 6)):
+            concept = rng.choice(["D000001", "D000002", "MESH:D000002", "D000003", "C0000001", "C0000002", "C0000009",
+                                    "D000001|D000002", "-1"])
+            entity_type = rng.choice(["Disease", "Chemical"])
+            mention = rng.choice(["Fièvre", "β-lactam", "seizure", "mention " + str(i)])
+            lines.append("\t".join([doc_id, str(i * 10), str(i * 10 + len(mention)), mention, entity_type, concept]))
+
+        if relations and rng.random() < 0.3:
+            lines.append("\t".join([doc_id, "CID", "D000001", "D000002"]))
+
+        if doc < docs_count - 1 or final_blank_line:
+            lines.append("")
+
+    with open(filepath, "w", encoding="utf-8", newline="") as pubtator_file:
+        pubtator_file.write(newline.join(lines) + (newline if final_blank_line else ""))
+
+    return filepath
+
+
+def reference_NCBI_disease(kb_data, filepaths):
+    """parse_NCBI_disease as it read the files line by line, before iter_pubtator_lines"""
+
+    output_NCBI_disease = dict()
+
+    for filepath in filepaths:
+
+        with open(filepath, 'r', encoding="utf-8") as corpus_file:
+
+            for line in corpus_file.readlines():
+                line_data = line.split("\t")
+
+                if len(line_data) == 6:
+                    mesh_id = line_data[5].strip("\n")
+
+                    if mesh_id in kb_data.child_to_parent.keys():
+                        direct_ancestor = kb_data.child_to_parent[mesh_id].strip("MESH:")
+                        update_mesh_id = line_data[5].strip("MESH:").strip("\n")
+                        annotation = (line_data[3], line_data[1], line_data[2], update_mesh_id, direct_ancestor)
+                        add_annotation_to_output_dict(line_data[0], annotation, output_NCBI_disease)
+
+    return output_NCBI_disease
+
+
+def reference_BC5CDR(kb_data, filepaths):
+    """parse_BC5CDR as it read the files line by line, before iter_pubtator_lines"""
+
+    output_BC5CDR = dict()
+    entity_type = "Disease" if kb_data.kb == "medic" else "Chemical"
+
+    for filepath in filepaths:
+
+        with open(filepath, 'r', encoding="utf-8") as corpus_file:
+
+            for line in corpus_file.readlines():
+                line_data = line.split("\t")
+
+                if len(line_data) == 6 and line_data[4] == entity_type:
+                    mesh_id = "MESH:" + line_data[5].strip("\n")
+
+                    if mesh_id in kb_data.child_to_parent.keys():
+                        direct_ancestor = "https://id.nlm.nih.gov/mesh/" + kb_data.child_to_parent[mesh_id].strip("MESH:")
+                        update_mesh_id = "https://id.nlm.nih.gov/mesh/" + line_data[5].strip("MESH:").strip("\n")
+                        annotation = (line_data[3], line_data[1], line_data[2], update_mesh_id, direct_ancestor)
+                        add_annotation_to_output_dict(line_data[0], annotation, output_BC5CDR)
+
+    return output_BC5CDR
+
+
+def reference_MedMentions(kb_data, filepath):
+    """parse_MedMentions as it read the file line by line, before iter_pubtator_lines"""
+
+    output_MedMentions = dict()
+
+    with open(filepath, 'r', buffering=1, encoding="utf-8") as corpus_file:
+
+        for line in corpus_file:
+
+            if "|t|" not in line and "|a|" not in line and line != "\n":
+                umls_id = line.split("\t")[5].strip("\n")
+
+                if umls_id in kb_data.umls_to_hp.keys() and kb_data.umls_to_hp[umls_id] in kb_data.child_to_parent.keys():
+                    hp_id = kb_data.umls_to_hp[umls_id]
+                    annotation = (line.split("\t")[3], line.split("\t")[1], line.split("\t")[2], hp_id, 
+                                    kb_data.child_to_parent[hp_id].strip("\n"))
+                    add_annotation_to_output_dict(line.split("\t")[0], annotation, output_MedMentions)
+
+    return output_MedMentions
+
+
+def pubtator_kb(kb):
+    """Small KB whose child_to_parent includes MeSH IDs with and without the "MESH:" prefix and HPO concepts"""
+
+    kb_data = KnowledgeBase(kb, use_cache=False)
+    kb_data.set_compact_kb(compact_kb_dicts({"name_to_id": dict(), "synonym_to_id": dict(),
+        "child_to_parent": {"D000001": "MESH:D000010", "MESH:D000002": "MESH:D000010", "HP:0000001": "HP:0000010"},
+        "umls_to_hp": {"C0000001": "HP:0000001", "C0000002": "HP:0000002"}}))
+
+    return kb_data
+
+
+@pytest.fixture
+def pubtator_corpora(tmp_path, monkeypatch):
+    """NCBI disease, BC5CDR and MedMentions files with LF and CRLF line endings, split into ranges of about 64 bytes"""
+
+    rng = random.Random(7)
+    filenames = ["train.txt", "dev.txt", "test.txt"]
+    monkeypatch.setattr(annotations, "NCBI_DISEASE_DIR", str(tmp_path) + "/ncbi_")
+    monkeypatch.setattr(annotations, "NCBI_DISEASE_FILENAMES", filenames)
+    monkeypatch.setattr(annotations, "BC5CDR_DIR", str(tmp_path) + "/cdr_")
+    monkeypatch.setattr(annotations, "BC5CDR_FILENAMES", filenames)
+    monkeypatch.setattr(annotations, "MEDMENTIONS_FILEPATH", str(tmp_path) + "/medmentions.txt")
+    monkeypatch.setattr(annotations, "pubtator_ranges", partial(pubtator_ranges, range_size=64))
+
+    for i, filename in enumerate(filenames):
+        write_pubtator(str(tmp_path) + "/ncbi_" + filename, rng, 40, newline="\r\n" if i == 1 else "\n")
+        write_pubtator(str(tmp_path) + "/cdr_" + filename, rng, 40, newline="\r\n" if i == 2 else "\n", 
+                        final_blank_line=i != 0)
+
+    write_pubtator(annotations.MEDMENTIONS_FILEPATH, rng, 120, relations=False)
+
+    return [str(tmp_path) + "/" + prefix + filename for prefix in ["ncbi_", "cdr_"] for filename in filenames]
+
+
+def test_pubtator_ranges(pubtator_corpora):
+    """The ranges cover the file in order and each one ends with the blank line closing a document"""
+
+    for filepath in pubtator_corpora:
+        ranges = pubtator_ranges(filepath, range_size=64)
+        data = open(filepath, 'rb').read()
+
+        assert len(ranges) > 10
+        assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+        assert all(ranges[i][1] == ranges[i + 1][0] for i in range(len(ranges) - 1))
+        assert all(data[:end].endswith((b"\n\n", b"\r\n\r\n")) for start, end in ranges[:-1])
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+@pytest.mark.parametrize("kb", ["medic", "ctd_chemicals"])
+def test_pubtator_parsers_match_line_by_line_parse(pubtator_corpora, workers, kb):
+    """The chunked parsers return the same annotations as the line-by-line parse, in the same order"""
+
+    kb_data = pubtator_kb(kb)
+    ncbi_filepaths, cdr_filepaths = pubtator_corpora[:3], pubtator_corpora[3:]
+    outputs = [(parse_BC5CDR(kb_data, workers=workers), reference_BC5CDR(kb_data, cdr_filepaths)), 
+                (parse_MedMentions(kb_data, workers=workers), reference_MedMentions(kb_data, annotations.MEDMENTIONS_FILEPATH))]
+
+    if kb == "medic":
+        outputs.append((parse_NCBI_disease(kb_data, workers=workers), reference_NCBI_disease(kb_data, ncbi_filepaths)))
+
+    for output, reference_output in outputs:
+        assert len(reference_output) > 5
+        assert list(output.items()) == list(reference_output.items())
@@ -0,0 +1,60 @@
+import pytest
+from fuzzywuzzy import fuzz, process
+
+from baseline import find_best_candidate_blocked, report_resolution_paths
+from candidates import TokenBlockingIndex
+
+NAME_TO_ID = {"Seizure": "HP:0001250", "Epileptic seizure": "HP:0001250", "Febrile seizure": "HP:0002373",
+                "Ataxia": "HP:0001251", "Gait ataxia": "HP:0002066", "Heart defect": "HP:0001627"}
+SYNONYM_TO_ID = {"seizures": "HP:0001250", "Seizure": "HP:0007359", "Cardiac anomaly": "HP:0001627"}
+
+
+@pytest.fixture
+def blocking_index():
+    return TokenBlockingIndex(NAME_TO_ID, SYNONYM_TO_ID, max_block_df=0.5)
+
+
+def test_exact_path_skips_gold_label(blocking_index):
+    """An exact match of the gold label is skipped for the next exact match, or for the blocked path"""
+
+    assert find_best_candidate_blocked(blocking_index, ("SEIZURE", "HP:0001250", "", "doc"))[1:] == ("HP:0007359", 
+                                                                                                        "exact")
+    assert find_best_candidate_blocked(blocking_index, ("seizure", "HP:0007359", "", "doc"))[1:] == ("HP:0001250", 
+                                                                                                        "exact")
+    # The only exact match is the gold label: the entries sharing the token "ataxia" are scored instead
+    assert find_best_candidate_blocked(blocking_index, ("ataxia", "HP:0001251", "", "doc"))[1:] == ("HP:0002066", 
+                                                                                                        "blocked")
+
+
+def test_blocked_and_full_paths(blocking_index):
+    """The blocked path scores the entries sharing a token, the full path every entry when the block is empty"""
+
+    answer = find_best_candidate_blocked(blocking_index, ("febrile seizures", "HP:0001250", "", "doc"))
+
+    assert answer[1:] == ("HP:0002373", "blocked")
+
+    # No shared token: every entry except the ones of the gold label is scored, as process.extract would
+    annotation = ("cardiopathy", "HP:0001627", "", "doc")
+    choices = {i: text for i, (text, concept_id) in enumerate(blocking_index.entries) if concept_id != annotation[1]}
+    best_choice = process.extractOne(annotation[0], choices, scorer=fuzz.token_sort_ratio)
+
+    assert blocking_index.block("cardiopathy") == list()
+    assert find_best_candidate_blocked(blocking_index, annotation)[1:] == (blocking_index.entries[best_choice[2]][1], 
+                                                                            "full")
+    # Only the gold label shares a token: the block has nothing to score, so every entry is
+    assert find_best_candidate_blocked(blocking_index, ("heart", "HP:0001627", "", "doc"))[2] == "full"
+
+
+def test_report_resolution_paths(blocking_index, capsys):
+    """Each annotation is counted in the path of the answer of its (normalized text, gold label) key"""
+
+    valid_annotations = [("Seizure", "HP:0001250", "", "doc_1"), ("seizure!", "HP:0001250", "", "doc_2"), 
+                            ("febrile seizures", "HP:0001250", "", "doc_1"), ("cardiopathy", "HP:0001627", "", "doc_3")]
+    unique_answers = [find_best_candidate_blocked(blocking_index, annotation) for annotation in 
+                        [valid_annotations[0], valid_annotations[2], valid_annotations[3]]]
+    report_resolution_paths(valid_annotations, unique_answers)
+    output = capsys.readouterr().out
+
+    assert "Resolved by exact path: 2 ( 50.0 % )" in output
+    assert "Resolved by blocked path: 1 ( 25.0 % )" in output
+    assert "Resolved by full path: 1 ( 25.0 % )" in output
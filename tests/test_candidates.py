@@ -0,0 +1,102 @@
+import os
+import random
+import tempfile
+
+import pytest
+from fuzzywuzzy import fuzz, process
+
+from candidates import ChoiceTable, TokenBlockingIndex, attach_candidate_index, freeze_candidate_index, \
+    normalize_mention
+
+NAMES = ["Seizure", "Seizures", "seizure!", "Abnormal heart", "heart abnormal", "Café au lait spots", "café-au-lait spot",
+            "Ürik asit", "Ωmega syndrome", "β-thalassemia", "Beta thalassemia", "!!!", "...", "", " ", "-", "ß", 
+            "日本語", "Heart", "HEART", "heart", "a", "ab", "Abnormality of the heart", "Abnormality of the nervous system",
+            "Nervous system abnormality", "(R)-lactate", "lactate (R)", "2,4-dinitrophenol", "Dinitrophenol, 2,4-"]
+
+QUERIES = ["seizure", "SEIZURES", "heart abnormal", "cafe au lait", "Café", "β thalassemia", "thalassemia beta", "!!!", 
+            "", " ", "ß", "日本", "Ωmega", "heart", "abnormality heart", "nervous", "lactate", "2,4 dinitrophenol", "x", 
+            "Abnormality of the nervous system"]
+
+
+def random_names(count, seed):
+    """Random names with shared tokens, so that many of them tie"""
+
+    rng = random.Random(seed)
+    tokens = ["heart", "brain", "Abnormal", "of", "the", "é", "β", "-", "!", "1,2", "syndrome", "x", ""]
+
+    return [" ".join(rng.choice(tokens) for _ in range(rng.randint(0, 4))) for _ in range(count)]
+
+
+@pytest.mark.parametrize("k", [1, 2, 5])
+def test_choice_table_matches_process_extract(k):
+    """The top-k names of ChoiceTable (and of its frozen form) are the ones of process.extract with token_sort_ratio"""
+
+    names = list(dict.fromkeys(NAMES + random_names(300, k)))
+    choice_table = ChoiceTable(dict.fromkeys(names))
+    file_descriptor, filepath = tempfile.mkstemp(suffix=".cif")
+    os.close(file_descriptor)
+
+    try:
+        freeze_candidate_index(choice_table, filepath)
+        frozen_table = attach_candidate_index(filepath)
+
+        for query in QUERIES + random_names(100, k + 100):
+            expected = process.extract(query, names, scorer=fuzz.token_sort_ratio, limit=k)
+
+            assert choice_table.top_candidates(query, k) == expected, query
+            assert frozen_table.top_candidates(query, k) == expected, query
+
+    finally:
+        os.remove(filepath)
+
+
+def blocking_entries():
+    """Names and synonyms where the token "disease" is frequent and "heart" and "valve" are rare"""
+
+    name_to_id = {"Disease " + str(i): "D:" + str(i) for i in range(40)}
+    name_to_id.update({"Heart disease": "D:heart", "Valve disease": "D:valve", "Seizure": "D:seizure"})
+    synonym_to_id = {"seizures": "D:seizures", "cardiac disease": "D:heart"}
+
+    return name_to_id, synonym_to_id
+
+
+def test_token_blocking_index_block():
+    """Frequent tokens are left out of the block unless the mention has no rarer token"""
+
+    name_to_id, synonym_to_id = blocking_entries()
+    blocking_index = TokenBlockingIndex(name_to_id, synonym_to_id, max_block_df=0.1)
+    entry_texts = lambda block: {blocking_index.entries[entry_index][0] for entry_index in block}
+
+    assert blocking_index.max_postings == 4
+    assert entry_texts(blocking_index.block(normalize_mention("heart disease"))) == {"Heart disease"}
+    assert entry_texts(blocking_index.block(normalize_mention("valve of the heart"))) == {"Heart disease", "Valve disease"}
+    assert len(blocking_index.block(normalize_mention("disease"))) == 43 # Only frequent tokens: the rarest is used
+    assert blocking_index.block(normalize_mention("unknown words")) == list()
+    assert entry_texts(blocking_index.exact_matches(normalize_mention("SEIZURE!"))) == {"Seizure"}
+
+
+def test_frozen_token_blocking_index():
+    """The frozen index returns the same entries, exact matches and blocks as the index it was built from"""
+
+    name_to_id, synonym_to_id = blocking_entries()
+    name_to_id.update({name: "R:" + str(i) for i, name in enumerate(NAMES + random_names(200, 7))})
+    blocking_index = TokenBlockingIndex(name_to_id, synonym_to_id)
+    file_descriptor, filepath = tempfile.mkstemp(suffix=".cif")
+    os.close(file_descriptor)
+
+    try:
+        freeze_candidate_index(blocking_index, filepath)
+        frozen_index = attach_candidate_index(filepath)
+
+        assert isinstance(frozen_index, TokenBlockingIndex)
+        assert list(frozen_index.entries) == blocking_index.entries
+        assert frozen_index.max_postings == blocking_index.max_postings
+
+        for query in QUERIES + random_names(100, 8) + ["heart disease", "disease", "Seizure"]:
+            normalized_query = normalize_mention(query)
+
+            assert list(frozen_index.exact_matches(normalized_query)) == blocking_index.exact_matches(normalized_query)
+            assert list(frozen_index.block(normalized_query)) == blocking_index.block(normalized_query), query
+
+    finally:
+        os.remove(filepath)
@@ -0,0 +1,53 @@
+import json
+import os
+
+import pytest
+
+from dataset import build_partition, build_partition_stream, split_partition
+
+# Documents as streamed from a PBDMS split: a repeated ID keeps its first position and its last annotations
+PBDMS_DOCS = [("PMID:1", [["Fièvre", 0, 6, "MESH:D005334", "MESH:D000001"]]),
+                ("PMID:2", [["β-lactam", 10, 18, "MESH:D047090", "MESH:D000002"], 
+                            ["β-lactam", 10, 18, "MESH:D047090", "MESH:D000002"]]),
+                ("PMID:3", list()),
+                ("PMID:1", [["Ménière's disease", 4, 21, "MESH:D008575", "MESH:D000003"]]),
+                ("PMID:4", [["\"quoted\"\\name\t", 0, 15, "MESH:D000004", "MESH:D000005"]])]
+PBDMS_DOCS += [("PMID:" + str(i), [["mention " + str(i), i, i + 9, "MESH:D" + str(i).zfill(6), "MESH:D000001"]]) \
+                for i in range(5, 40)]
+
+
+def read_partition(dirpath, output_format):
+    """Returns the bytes of the subset files (and indexes) of a partition directory"""
+
+    filenames = [subset + "." + output_format for subset in ["train", "dev", "test"]]
+
+    if output_format != "json":
+        filenames += [filename + ".idx" for filename in filenames]
+
+    return {filename: open(os.path.join(dirpath, filename), 'rb').read() for filename in filenames}
+
+
+@pytest.mark.parametrize("output_format", ["json", "jsonl"])
+def test_stream_build_is_byte_identical(tmp_path, monkeypatch, output_format):
+    """build_partition_stream writes the same bytes as build_partition over the same documents"""
+
+    monkeypatch.chdir(tmp_path)
+    build_partition(dict(PBDMS_DOCS), "medic", "1", output_format=output_format)
+    build_partition_stream(iter(PBDMS_DOCS), "medic", "2", output_format=output_format)
+    batch_files = read_partition("evanil/medic/split_1", output_format)
+
+    assert batch_files == read_partition("evanil/medic/split_2", output_format)
+    assert "Ménière".encode("utf-8") in b"".join(batch_files.values())
+
+
+def test_build_matches_original_output(tmp_path, monkeypatch):
+    """The .json subsets are the whole dicts dumped at once, as the original build_partition wrote them"""
+
+    monkeypatch.chdir(tmp_path)
+    build_partition_stream(iter(PBDMS_DOCS), "medic", "1")
+    subsets = dict(zip(["train", "dev", "test"], split_partition(dict(PBDMS_DOCS))))
+
+    for subset, annotations in subsets.items():
+
+        with open("evanil/medic/split_1/" + subset + ".json", 'r', encoding="utf-8") as in_file:
+            assert in_file.read() == json.dumps(annotations, indent=4, ensure_ascii=False)
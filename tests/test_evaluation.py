@@ -0,0 +1,35 @@
+import csv
+
+from evaluation import Evaluator
+
+# Answers over tests/fixtures/sample_ctd.tsv, with the direct ancestors as in the CTD partitions ("MESH:" prefix in the
+# PBDMS documents, no prefix in the BC5CDR documents)
+ANSWERS = [(("lactate", "D000005", "D000004", "doc_1"), "D000004"), # Correct
+            (("hydroxy acid", "D000004", "MESH:D000002", "doc_1"), "D000001"), # Parent of the direct ancestor
+            (("ethanol", "D000006", "MESH:D000002", "doc_2"), "D000003"), # Sibling of the direct ancestor
+            (("unknown", "D000006", "MESH:D000002", "doc_2"), "D999999")] # Not in the KB
+
+
+def test_hierarchy_metrics_with_prefixed_ancestors(ctd_kb, tmp_path, monkeypatch):
+    """Ancestor hits and distances are defined for the CTD partitions, whose direct ancestors have the "MESH:" prefix"""
+
+    monkeypatch.chdir(tmp_path) # The answers are written to ./baseline_<partition>_answers.csv
+
+    with Evaluator("baseline", "ctd_chemicals", hierarchy=ctd_kb.hierarchy) as evaluator:
+
+        for answer in ANSWERS:
+            evaluator.add(answer)
+
+    summary = evaluator.summary()
+
+    assert summary["correct_answers"] == 1
+    assert summary["ancestor_hits"] == {1: 25.0, 2: 50.0, 3: 50.0}
+    assert summary["distances"] == {0: 1, 1: 1, 2: 1}
+    assert summary["mean_distance"] == 1.0
+    assert summary["undefined_distances"] == 1
+
+    with open(tmp_path / "baseline_ctd_chemicals_answers.csv", newline="") as answers_file:
+        rows = list(csv.reader(answers_file, delimiter=',', quotechar='|'))
+
+    assert rows[0] == ["doc", "text", "gold label", "direct ancestor", "answer", "classification"]
+    assert [row[5] for row in rows[1:]] == ["1", "0", "0", "0"]
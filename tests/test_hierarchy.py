@@ -0,0 +1,80 @@
+import random
+from collections import deque
+from types import SimpleNamespace
+
+import pytest
+
+from hierarchy import NO_CONCEPT, HierarchyIndex, build_hierarchy_tables
+
+
+def test_ctd_prefixed_ancestors(ctd_kb):
+    """Direct ancestors with the "MESH:" prefix are the concepts of the hierarchy, not separate concepts"""
+
+    hierarchy = ctd_kb.hierarchy
+
+    assert ctd_kb.child_to_parent["D000002"] == "MESH:D000001" # The values of the KB dicts keep the prefix
+    assert hierarchy.code("MESH:D000002") == hierarchy.code("D000002")
+    assert hierarchy.parents("MESH:D000004") == ["D000002", "D000003"]
+    assert hierarchy.is_ancestor("MESH:D000001", "D000005")
+    assert hierarchy.is_ancestor("MESH:D000003", "MESH:D000005")
+    assert not hierarchy.is_ancestor("MESH:D000006", "D000005")
+    assert hierarchy.depth("MESH:D000005") == 3
+    assert hierarchy.distance("MESH:D000002", "D000004") == hierarchy.distance("D000002", "D000004") == 1
+    assert hierarchy.distance("MESH:D000006", "D000003") == 3
+    assert hierarchy.lowest_common_ancestor("MESH:D000005", "D000006") == "D000002"
+    assert hierarchy.lowest_common_ancestor("MESH:D000002", "D000003") == "D000001"
+
+
+def ancestor_distances(parent_lists, code):
+    """Shortest distance from a concept to each of its ancestors (and itself), by breadth-first search"""
+
+    distances = {code: 0}
+    queue = deque([code])
+
+    while len(queue) > 0:
+        current_code = queue.popleft()
+
+        for parent_code in parent_lists.get(current_code, list()):
+
+            if parent_code not in distances:
+                distances[parent_code] = distances[current_code] + 1
+                queue.append(parent_code)
+
+    return distances
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_hierarchy_index_matches_search(seed):
+    """Ancestor checks, distances, depths and lowest common ancestors of random DAGs, against breadth-first search"""
+
+    rng = random.Random(seed)
+    concepts_count = rng.randint(1, 40)
+    parent_lists = {code: sorted(set(rng.randrange(code) for _ in range(rng.choice([0, 1, 1, 2, 3])))) \
+                        for code in range(1, concepts_count)}
+    kb_data = SimpleNamespace(concept_ids=[str(code) for code in range(concepts_count)])
+    kb_data.concept_code = lambda concept_id: int(concept_id) if concept_id.isdigit() else None
+    hierarchy = HierarchyIndex(kb_data, build_hierarchy_tables(parent_lists, concepts_count))
+    distances = [ancestor_distances(parent_lists, code) for code in range(concepts_count)]
+
+    for code in range(concepts_count):
+        roots = [ancestor for ancestor in distances[code] if len(parent_lists.get(ancestor, list())) == 0]
+
+        assert hierarchy.depths[code] == min(distances[code][root] for root in roots)
+        assert hierarchy.ancestors(str(code)) == {str(ancestor): distance for ancestor, distance \
+                                                        in distances[code].items() if ancestor != code}
+
+        for other_code in range(concepts_count):
+            common_ancestors = set(distances[code]) & set(distances[other_code])
+            lowest_code, distance = hierarchy.common_ancestor_codes(code, other_code)
+
+            assert hierarchy.ancestor_distance_codes(other_code, code) == distances[code].get(other_code)
+
+            if len(common_ancestors) == 0:
+                assert (lowest_code, distance) == (NO_CONCEPT, None)
+
+            else:
+                assert distance == min(distances[code][ancestor] + distances[other_code][ancestor] \
+                                        for ancestor in common_ancestors)
+                assert lowest_code in common_ancestors
+                assert not any(ancestor != lowest_code and lowest_code in distances[ancestor] \
+                                for ancestor in common_ancestors) # No common ancestor below it
@@ -0,0 +1,108 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import kbs
+from conftest import FIXTURES_DIR
+from kbs import KnowledgeBase, check_obo_parity, iter_obo_terms, parse_obo
+
+SAMPLE_OBO = os.path.join(FIXTURES_DIR, "sample.obo")
+
+
+@pytest.mark.parametrize("kb", ["hp", "medic", "go_bp", "chebi"])
+def test_obo_parity(kb):
+    """The streaming parser and the obonet graph produce the same KB dicts, in the same order"""
+
+    pytest.importorskip("obonet")
+
+    assert check_obo_parity(kb, filepath=SAMPLE_OBO) == list()
+
+
+def test_iter_obo_terms_edge_cases():
+    """Comments, trailing modifiers, obsolete terms, [Typedef] stanzas and a missing final newline"""
+
+    terms = {term["id"]: term for term in iter_obo_terms(SAMPLE_OBO)}
+
+    assert "HP:0000005" not in terms # Obsolete
+    assert "part_of" not in terms # [Typedef]
+    assert terms["HP:0001251"]["is_a"] == ["HP:0012638"] # Last stanza, without a final newline
+    assert terms["HP:0000118"]["name"] == "Phenotypic abnormality"
+    assert terms["HP:0000707"]["is_a"] == ["HP:0000118"]
+    assert terms["HP:0000707"]["xref"] == ["UMLS:C4020980", "MSH:D009421"]
+
+
+def test_parse_obo_rules():
+    """Single-parent child_to_parent, every parent in child_to_parents, and the filters of each KB"""
+
+    hp_dicts = parse_obo(SAMPLE_OBO, "hp")
+
+    assert "HP:0001250" not in hp_dicts["child_to_parent"]
+    assert hp_dicts["child_to_parents"]["HP:0001250"] == ["HP:0000707", "HP:0012638"]
+    assert hp_dicts["child_to_parents"]["HP:0012638"] == ["HP:0000707", "HP:9999999"]
+    assert hp_dicts["synonym_to_id"]["Nervous system anomaly"] == "HP:0000707"
+    assert hp_dicts["umls_to_hp"]["C0036572"] == "HP:0001250"
+    assert "Prune belly syndrome" not in parse_obo(SAMPLE_OBO, "medic")["name_to_id"]
+    assert "Seizure" not in parse_obo(SAMPLE_OBO, "go_bp")["name_to_id"]
+
+
+def test_concurrent_cold_loads(tmp_path, monkeypatch):
+    """Loads of the same KB racing to save its snapshot all succeed and publish one complete snapshot"""
+
+    monkeypatch.setattr(kbs, "KB_CACHE_DIR", str(tmp_path) + "/")
+    monkeypatch.setattr(KnowledgeBase, "kb_filepath", lambda self, kb: SAMPLE_OBO)
+    (tmp_path / "hp.0.v0.pkl").write_bytes(b"") # Snapshot of a previous version of the KB file
+
+    def load(i):
+        kb_data = KnowledgeBase("hp")
+        kb_data.load_obo("hp")
+
+        return dict(kb_data.name_to_id)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        loaded = list(executor.map(load, range(8)))
+
+    snapshots = sorted(os.listdir(tmp_path))
+    cached_kb = KnowledgeBase("hp")
+    cached_kb.load_obo("hp")
+
+    assert all(name_to_id == loaded[0] for name_to_id in loaded)
+    assert [name for name in snapshots if name.endswith(".pkl")] == [os.path.basename(cached_kb.cache_paths("hp", 
+                                                                        SAMPLE_OBO)[0])]
+    assert not any(name.startswith(".tmp.") for name in snapshots)
+    assert dict(cached_kb.name_to_id) == loaded[0]
+
+
+def test_lazy_hierarchy(tmp_path, monkeypatch):
+    """The hierarchy index is only built when it is used, then saved in its own snapshot and loaded from it"""
+
+    monkeypatch.setattr(kbs, "KB_CACHE_DIR", str(tmp_path) + "/")
+    monkeypatch.setattr(KnowledgeBase, "kb_filepath", lambda self, kb: SAMPLE_OBO)
+    (tmp_path / "hp.0.v0.hierarchy.pkl").write_bytes(b"") # Hierarchy snapshot of a previous version of the KB file
+    build_calls = list()
+    build_hierarchy_tables = kbs.build_hierarchy_tables
+    monkeypatch.setattr(kbs, "build_hierarchy_tables", lambda *args: build_calls.append(args) or \
+                            build_hierarchy_tables(*args))
+
+    kb_data = KnowledgeBase("hp")
+    kb_data.load_obo("hp")
+    cache_path = kb_data.cache_paths("hp", SAMPLE_OBO)[0]
+
+    assert build_calls == list()
+    assert not os.path.exists(tmp_path / "hp.0.v0.hierarchy.pkl")
+    assert kb_data.hierarchy.parents("HP:0001250") == ["HP:0000707", "HP:0012638"]
+    assert len(build_calls) == 1
+    assert sorted(os.listdir(tmp_path)) == sorted([os.path.basename(cache_path), "hp.stamp.json", 
+                                                os.path.basename(cache_path)[:-len(".pkl")] + ".hierarchy.pkl"])
+
+    cached_kb = KnowledgeBase("hp")
+    cached_kb.load_obo("hp")
+
+    assert cached_kb.hierarchy.ancestors("HP:0001250") == kb_data.hierarchy.ancestors("HP:0001250")
+    assert len(build_calls) == 1
+
+    uncached_kb = KnowledgeBase("hp", use_cache=False)
+    uncached_kb.load_obo("hp")
+
+    assert uncached_kb.hierarchy.depth("HP:0001250") == kb_data.hierarchy.depth("HP:0001250")
+    assert len(build_calls) == 2
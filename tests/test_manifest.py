@@ -0,0 +1,101 @@
+import os
+
+import pytest
+
+import dataset
+from dataset import build_PBDMS_split, build_partition, partition_dirpath, pending_splits
+from manifest import BuildManifest, input_checksum
+
+DOC_ANNOTATIONS = {"PMID:" + str(i): [["mention " + str(i), i, i + 9, "MESH:D" + str(i).zfill(6), "MESH:D000001"]] \
+                    for i in range(20)}
+
+
+def split_inputs(filepath, output_format="json"):
+    """Inputs of a split as recorded by dataset.split_inputs, with a single corpus file"""
+
+    return {"code_version": "test", "output_format": output_format, "files": {filepath: input_checksum(filepath)}}
+
+
+@pytest.fixture
+def built_split(tmp_path, monkeypatch):
+    """Split "1" of medic built and recorded in the manifest, returns the path of its input file"""
+
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("corpora")
+    filepath = "corpora/split_1.txt"
+
+    with open(filepath, "w") as input_file:
+        input_file.write("first version\n")
+
+    manifest = BuildManifest("medic")
+    manifest.invalidate("1")
+    build_partition(DOC_ANNOTATIONS, "medic", "1")
+    manifest.record("1", split_inputs(filepath), partition_dirpath("medic", "1"))
+
+    return filepath
+
+
+def test_manifest_skips_current_split(built_split):
+    """A split built from the same inputs, with untouched outputs, is current, also for a new run"""
+
+    assert BuildManifest("medic").is_current("1", split_inputs(built_split))
+    assert pending_splits(BuildManifest("medic"), ["1", "2"], {split: split_inputs(built_split) for split in ["1", "2"]}) \
+        == ["2"]
+    assert pending_splits(BuildManifest("medic"), ["1"], {"1": split_inputs(built_split)}, force=True) == ["1"]
+
+
+def test_manifest_detects_changes(built_split):
+    """Changed inputs, another output format and changed or deleted outputs make the split pending again"""
+
+    manifest = BuildManifest("medic")
+
+    assert not manifest.is_current("1", split_inputs(built_split, output_format="jsonl"))
+    assert not manifest.is_current("1", dict(split_inputs(built_split), code_version="other"))
+
+    with open(built_split, "a") as input_file:
+        input_file.write("second version\n")
+
+    assert not manifest.is_current("1", split_inputs(built_split))
+
+    with open(built_split, "w") as input_file:
+        input_file.write("first version\n")
+
+    assert manifest.is_current("1", split_inputs(built_split)) # Same contents, so same checksum
+
+    with open("evanil/medic/split_1/dev.json", "a") as output_file:
+        output_file.write(" ")
+
+    assert not manifest.is_current("1", split_inputs(built_split))
+
+    manifest.record("1", split_inputs(built_split), partition_dirpath("medic", "1"))
+    os.remove("evanil/medic/split_1/test.json")
+
+    assert not manifest.is_current("1", split_inputs(built_split))
+
+
+def test_interrupted_build_is_not_recorded(built_split, monkeypatch):
+    """A split whose build fails is invalidated and never recorded, while the completed splits stay current"""
+
+    second_split = "corpora/split_2.txt"
+
+    with open(second_split, "w") as input_file:
+        input_file.write("split 2\n")
+
+    def interrupted_build(annotations, partition, split, output_format="json"):
+        dataset.write_subset(partition_dirpath(partition, split), "train", iter(annotations.items()), output_format)
+        raise KeyboardInterrupt()
+
+    monkeypatch.setattr(dataset, "parse_annotations", lambda *args, **kwargs: DOC_ANNOTATIONS)
+    monkeypatch.setattr(dataset, "build_partition", interrupted_build)
+    manifest = BuildManifest("medic")
+    manifest.record("2", split_inputs(second_split), partition_dirpath("medic", "2")) # Entry of a previous build
+
+    with pytest.raises(KeyboardInterrupt):
+        build_PBDMS_split("medic", "2", None, None, manifest=manifest, inputs=split_inputs(second_split))
+
+    reloaded = BuildManifest("medic")
+
+    assert "2" not in reloaded.splits
+    assert reloaded.is_current("1", split_inputs(built_split))
+    assert pending_splits(reloaded, ["1", "2"], {"1": split_inputs(built_split), "2": split_inputs(second_split)}) \
+        == ["2"]
@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+
+import pytest
+
+import server
+from server import LinkingService
+
+NAME_TO_ID = {"Seizure": "HP:0001250", "Ataxia": "HP:0001251", "Abnormal heart": "HP:0001627"}
+
+
+@pytest.fixture
+def service(monkeypatch):
+    """LinkingService scoring in the dispatcher thread, over a small KB instead of the KB files"""
+
+    monkeypatch.setattr(server, "load_kb", lambda kb: SimpleNamespace(kb=kb, name_to_id=NAME_TO_ID))
+    linking_service = LinkingService(["hp"], workers=0, max_wait_ms=1)
+    linking_service.start()
+    yield linking_service
+    linking_service.close()
+
+
+def test_link(service):
+    request = service.link("hp", ["seizures"], k=2)
+
+    assert request["error"] is None
+    assert request["results"][0][0] == {"id": "HP:0001250", "name": "Seizure", "score": 93}
+
+
+def test_bool_k_is_rejected(service):
+
+    with pytest.raises(ValueError):
+        service.submit("hp", ["seizure"], k=True)
+
+
+def test_scoring_error_does_not_stop_the_dispatcher(service, monkeypatch):
+    link_mentions = server.link_mentions
+
+    def failing_link_mentions(kb_data, choice_table, mentions):
+
+        if any(text == "boom" for text, k in mentions):
+            raise RuntimeError("scoring failed")
+
+        return link_mentions(kb_data, choice_table, mentions)
+
+    monkeypatch.setattr(server, "link_mentions", failing_link_mentions)
+
+    assert "scoring failed" in service.link("hp", ["boom"])["error"]
+    assert service.link("hp", ["ataxia"])["error"] is None
+    assert service.is_alive()
+
+
+def test_callback_error_does_not_stop_the_dispatcher(service):
+
+    def failing_callback(request):
+        raise RuntimeError("callback failed")
+
+    request = service.submit("hp", ["ataxia"], callback=failing_callback)
+
+    assert request["done"].wait(10) and request["error"] is None
+    assert service.link("hp", ["seizure"])["error"] is None
+    assert service.is_alive()
+
+
+def test_batch_error_answers_the_waiting_requests(service, monkeypatch):
+
+    def failing_score_batch(batch):
+        raise RuntimeError("batch failed")
+
+    monkeypatch.setattr(service, "score_batch", failing_score_batch)
+
+    assert "batch failed" in service.link("hp", ["ataxia"])["error"]
+    assert service.is_alive()
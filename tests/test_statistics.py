@@ -0,0 +1,15 @@
+from statistics import get_corpus_statistics
+
+DOC_ANNOTATIONS = {"doc_1": [("seizure", 0, 7, "HP:0001250", "HP:0012638"), ("ataxia", 10, 16, "HP:0001251", "HP:0012638")],
+                    "doc_2": [("heart defect", 3, 15, "HP:0001627", "HP:0030680")]}
+
+
+def test_get_corpus_statistics_accepts_dict_and_pairs():
+    """A {doc: annotations} dict (the original signature) and (doc, annotations) pairs give the same statistics"""
+
+    from_dict = get_corpus_statistics(DOC_ANNOTATIONS)
+    from_pairs = get_corpus_statistics(iter(DOC_ANNOTATIONS.items()))
+
+    assert from_dict.to_dict() == from_pairs.to_dict()
+    assert from_dict.report() == from_pairs.report()
+    assert (from_dict.doc_count, from_dict.annotations_count) == (2, 3) # Documents, not the characters of their IDs
@@ -0,0 +1,73 @@
+import os
+import time
+
+import pytest
+
+import utils
+from dataset import write_subset
+from statistics import file_statistics, get_partition_statistics
+from store import build_store, check_store, load_store
+from utils import annotation_files, iter_annotations
+
+# Positions of every kind restored by the store: int, decimal str and any other str
+SUBSET_DOCS = {"train": {"PMID:1": [["Fièvre", 0, 6, "MESH:D005334", "MESH:D000001"], 
+                                    ["β-lactam", "10", "18", "MESH:D047090", "MESH:D000002"]],
+                            "PMID:2": list(), 
+                            "PMID:3": [["mention", "007", "1e3", "MESH:D000003", "MESH:D000001"]]},
+                "dev": {"PMID:4": [["\"quoted\"\tname", 2, 15, "MESH:D000004", "MESH:D000002"]]},
+                "test": {"PMID:5": [["Ménière", 0, 7, "MESH:D008575", "MESH:D000003"]],
+                            "PMID:1": [["Fièvre", 0, 6, "MESH:D005334", "MESH:D000001"]]}}
+
+
+@pytest.fixture
+def built_partitions(tmp_path, monkeypatch):
+    """hp (.json files) and medic (2 PBDMS splits in .jsonl and .jsonl.gz) in ./dataset, with their stores"""
+
+    monkeypatch.chdir(tmp_path)
+
+    for partition_dir, output_format in [("dataset/hp/", "json"), ("dataset/medic/split_1/", "jsonl"), 
+                                            ("dataset/medic/split_2/", "jsonl.gz")]:
+        os.makedirs(partition_dir)
+
+        for subset, doc_annotations in SUBSET_DOCS.items():
+            write_subset(partition_dir, subset, iter(doc_annotations.items()), output_format)
+
+    build_store("hp")
+    build_store("medic")
+
+
+@pytest.mark.parametrize("partition", ["hp", "medic"])
+def test_store_is_lossless(built_partitions, partition, monkeypatch, capsys):
+    """check_store restores every annotation file exactly, and the readers get the same documents from the store"""
+
+    assert check_store(partition) == list()
+    assert load_store(partition).is_current()
+
+    selections = [(None, None), (["2", "1"], ["test", "train"]), (None, ["test"])]
+    from_files = [list(iter_annotations(partition, splits=splits, subsets=subsets, use_store=False)) \
+                    for splits, subsets in selections]
+    files_stats = get_partition_statistics(partition, use_sidecars=False, workers=1).to_dict()
+    monkeypatch.setattr(utils, "load_annotation_file", None) # The annotation files can only be read from the store
+    capsys.readouterr()
+
+    for (splits, subsets), docs in zip(selections, from_files):
+        assert list(iter_annotations(partition, splits=splits, subsets=subsets)) == docs
+
+    assert get_partition_statistics(partition, use_sidecars=False).to_dict() == files_stats
+    assert "(0 from sidecars, " + str(len(annotation_files(partition))) + " from the store)" in capsys.readouterr().out
+
+
+def test_stale_store_is_not_used(built_partitions):
+    """A store older than its annotation files is ignored by the readers, which read the files instead"""
+
+    time.sleep(0.01) # So the rebuilt file gets a new modification time even on coarse clocks
+    changed_docs = {"PMID:9": [["new mention", 0, 11, "MESH:D000009", "MESH:D000001"]]}
+    write_subset("dataset/medic/split_2/", "dev", iter(changed_docs.items()), "jsonl.gz")
+
+    assert load_store("medic") is None
+    assert not load_store("medic", current_only=False).is_current()
+    assert check_store("medic") == ["./dataset/medic/split_2/dev.jsonl.gz"]
+    assert list(iter_annotations("medic", splits=["2"], subsets=["dev"])) == [("2", "dev", "PMID:9", 
+                                                                                changed_docs["PMID:9"])]
+    assert get_partition_statistics("medic", splits=["2"], subsets=["dev"], use_sidecars=False).to_dict() == \
+        file_statistics("./dataset/medic/split_2/dev.jsonl.gz").to_dict()
@@ -0,0 +1,69 @@
+import json
+import os
+
+import pytest
+
+from dataset import write_subset
+from utils import JSONL_INDEX_EXTENSION, atomic_filepath, iter_jsonl, load_annotation_file, read_jsonl_doc
+
+DOC_ANNOTATIONS = {"PMID:1": [["Fièvre", 0, 6, "MESH:D005334", "MESH:D000001"]],
+                    "PMID:2": [["β-lactam", 10, 18, "MESH:D047090", "MESH:D000002"], 
+                                ["line\nbreak \"quoted\"", 20, 38, "MESH:D000003", "MESH:D000004"]],
+                    "PMID:3": list()}
+DOC_ANNOTATIONS.update({"PMID:" + str(i): [["mention " + str(i), i, i + 9, "MESH:D" + str(i).zfill(6), "MESH:D000001"]] \
+                        for i in range(4, 200)})
+
+
+@pytest.mark.parametrize("output_format", ["json", "jsonl", "jsonl.gz", "jsonl.zst"])
+def test_annotation_file_round_trip(tmp_path, output_format):
+    """Every format written by dataset.py loads back to the same annotations, in the same order"""
+
+    if output_format == "jsonl.zst":
+        pytest.importorskip("zstandard")
+
+    filepath = write_subset(str(tmp_path) + "/", "test", iter(DOC_ANNOTATIONS.items()), output_format)
+    loaded = load_annotation_file(filepath)
+
+    assert loaded == DOC_ANNOTATIONS
+    assert list(loaded.keys()) == list(DOC_ANNOTATIONS.keys())
+
+    if output_format == "json":
+        assert not os.path.exists(filepath + JSONL_INDEX_EXTENSION)
+        return
+
+    with open(filepath + JSONL_INDEX_EXTENSION, 'r', encoding="utf-8") as index_file:
+        index = json.load(index_file)
+
+    assert list(index.keys()) == list(DOC_ANNOTATIONS.keys())
+    assert [doc_id for doc_id, annotations in iter_jsonl(filepath)] == list(DOC_ANNOTATIONS.keys())
+
+    for doc_id in ["PMID:1", "PMID:2", "PMID:3", "PMID:199"]:
+        assert read_jsonl_doc(filepath, doc_id, index=index) == DOC_ANNOTATIONS[doc_id]
+
+    assert read_jsonl_doc(filepath, "PMID:100") == DOC_ANNOTATIONS["PMID:100"] # Loads the index itself
+
+
+def test_atomic_filepath(tmp_path):
+    """The file gets the permissions of open(), and is left untouched if the write is interrupted"""
+
+    filepath = str(tmp_path / "train.json")
+
+    with open(str(tmp_path / "reference.json"), "w") as reference_file:
+        reference_file.write("{}")
+
+    with atomic_filepath(filepath) as temp_path:
+        
+        with open(temp_path, "w") as out_file:
+            out_file.write("{}")
+
+    with pytest.raises(RuntimeError):
+
+        with atomic_filepath(filepath) as temp_path:
+
+            with open(temp_path, "w") as out_file:
+                out_file.write("{\"partial")
+                raise RuntimeError("interrupted")
+
+    assert open(filepath).read() == "{}"
+    assert os.stat(filepath).st_mode == os.stat(str(tmp_path / "reference.json")).st_mode
+    assert sorted(os.listdir(tmp_path)) == ["reference.json", "train.json"]